@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Runtime settings.
+
+Settings can be set via environment variables ('BRING_<SETTING_NAME>', e.g. 'BRING_GIT_BACKEND=native'), or overwritten
+for the current process with 'set_setting' (e.g. from a cli option). Defaults are defined in
+'bring.defaults.BRING_DEFAULT_SETTINGS'.
+"""
+
+import os
+from typing import Any, Dict
+
+from bring.defaults import BRING_DEFAULT_SETTINGS
+from frkl.common.exceptions import FrklException
+
+
+_OVERRIDES: Dict[str, Any] = {}
+
+_TRUE_VALUES = ("true", "yes", "on", "1")
+_FALSE_VALUES = ("false", "no", "off", "0", "")
+
+
+def _convert(key: str, value: str, default: Any) -> Any:
+
+    if isinstance(default, bool):
+        if value.lower() in _TRUE_VALUES:
+            return True
+        if value.lower() in _FALSE_VALUES:
+            return False
+        raise FrklException(msg=f"Invalid value for setting '{key}': {value}", reason="Not a boolean.", solution=f"Use one of: {', '.join(_TRUE_VALUES + _FALSE_VALUES[:-1])}")
+    if isinstance(default, int):
+        try:
+            return int(value)
+        except ValueError:
+            raise FrklException(msg=f"Invalid value for setting '{key}': {value}", reason="Not an integer.")
+    if isinstance(default, float):
+        try:
+            return float(value)
+        except ValueError:
+            raise FrklException(msg=f"Invalid value for setting '{key}': {value}", reason="Not a number.")
+
+    return value
+
+
+def get_setting(key: str) -> Any:
+    """Return the current value of a setting."""
+
+    if key not in BRING_DEFAULT_SETTINGS.keys():
+        raise FrklException(msg=f"Can't get setting '{key}'.", reason=f"Invalid setting name, available: {', '.join(sorted(BRING_DEFAULT_SETTINGS.keys()))}")
+
+    if key in _OVERRIDES.keys():
+        return _OVERRIDES[key]
+
+    default = BRING_DEFAULT_SETTINGS[key]
+    env_value = os.environ.get(f"BRING_{key.upper()}", None)
+    if env_value is None:
+        return default
+
+    return _convert(key, env_value, default)
+
+
+def set_setting(key: str, value: Any) -> None:
+    """Overwrite a setting for the current process."""
+
+    if key not in BRING_DEFAULT_SETTINGS.keys():
+        raise FrklException(msg=f"Can't set setting '{key}'.", reason=f"Invalid setting name, available: {', '.join(sorted(BRING_DEFAULT_SETTINGS.keys()))}")
+
+    if isinstance(value, str):
+        value = _convert(key, value, BRING_DEFAULT_SETTINGS[key])
+    _OVERRIDES[key] = value
+
+
+def reset_settings() -> None:
+    """Remove all settings that were overwritten with 'set_setting'."""
+
+    _OVERRIDES.clear()
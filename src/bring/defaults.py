@@ -26,15 +26,20 @@ BRING_RESOURCES_FOLDER = os.path.join(
 BRING_DOWNLOAD_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "downloads")
 BRING_TEMP_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "temp")
 BRING_INDEX_FILES_CACHE = os.path.join(BRING_DOWNLOAD_CACHE, "indexes")
+BRING_SEARCH_INDEX_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "search_indexes")
 BRING_GIT_CHECKOUT_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "git_checkouts")
 # BRING_PKG_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "pkgs")
 BRING_PKG_METADATA_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "pkg_metadata")
+BRING_STEP_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "transform_steps")
 BRING_PLUGIN_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "plugins")
+BRING_METRICS_FILE = os.path.join(bring_app_dirs.user_cache_dir, "metrics.json")
 
 # package cache settings
 BRING_PKG_VERSION_CACHE = os.path.join(bring_app_dirs.user_cache_dir, "pkg_versions")
 BRING_PKG_VERSION_DATA_FOLDER_NAME = "version_data"
 BRING_PKG_DATA_FOLDER_NAME = "package_data"
+BRING_PKG_MANIFEST_FILE_NAME = "manifest.json"
+BRING_TARGET_STATE_FOLDER_NAME = ".bring"
 BRING_PKG_VERSION_PACKAGES_FOLDER_NAME = "packages"
 
 BRING_PKG_INSTALL_FOLDER = os.path.join(bring_app_dirs.user_cache_dir, BRING_PKG_VERSION_PACKAGES_FOLDER_NAME)
@@ -51,6 +56,28 @@ BRING_DEFAULT_LOG_FILE = os.path.join(bring_app_dirs.user_data_dir, "logs", "bri
 
 BRING_VERSIONS_DEFAULT_CACHE_CONFIG: Mapping[str, Any] = {"metadata_max_age": 3600 * 24}
 
+BRING_DEFAULT_SETTINGS: Mapping[str, Any] = {
+    "offline": False,  # only use local caches, never the network
+    "git_backend": "auto",  # dulwich, native, or auto: the faster one per operation (native git only if installed)
+    "disk_threads": 16,
+    "cpu_threads": 0,  # 0: number of cpus
+    "debug_loop_stalls": False,
+    "loop_stall_threshold": 0.1,
+    "step_cache_max_size": 2 * 1024 * 1024 * 1024,  # 0: disable the transform step cache
+    "step_cache_max_age": 3600 * 24 * 14,  # 0: no age limit
+    "versions_memory_cache_max_size": 256 * 1024 * 1024,  # loaded package versions kept in memory (size of their metadata cache files), 0: disable
+    "shared_cache": False,  # the cache folder is shared with other nodes (e.g. on NFS), use lock files
+    "node_id": "",  # empty: use the host name
+    "lease_seconds": 60,  # lock files of processes that stopped renewing them expire after this
+    "lock_timeout": 1800,  # how long to wait for a lock held by another process
+    "retired_grace_seconds": 3600,  # shared cache only: how long replaced or evicted entries stay readable
+    "binary_caches": "",  # comma-separated folders and/or urls to get prebuilt packages from, in order
+    "binary_cache_key": "",  # if set, binary cache manifests must be signed with this key
+    "target_link_mode": "auto",  # how packages are installed into target paths: auto, symlink, hardlink, reflink, copy
+    "target_keep_versions": 3,  # link farms kept per target path (including the installed one), for fast switching
+}
+"""Default values for runtime settings (check 'bring.config.settings' for details)."""
+
 BRING_MODULES_TO_LOAD = [
     "bring.transform.transformers.*",
     "frkl.events.app_events.*",
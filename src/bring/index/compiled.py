@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""Compiled index files, bundling many package descriptions and their version metadata in one (memory-mapped) file.
+
+File layout:
+
+    header:   magic (8 bytes) | format version (uint32) | toc offset (uint64) | toc length (uint64)
+    blobs:    one pickled description and one pickled '(versions, version_args)' tuple per package
+    toc:      json table of contents, mapping package names to blob offsets/lengths (and some metadata)
+
+Only the header and the table of contents are read when an index is opened, the blobs of a package are
+unpickled when (and if) that package is used.
+"""
+
+import json
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, MutableMapping, Optional, Tuple, Union
+
+from tzlocal import get_localzone
+
+from bring.defaults import BRING_INDEX_FILES_CACHE
+from bring.pkg import ResolvePkg
+from bring.pkg.versions import PkgVersion
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+from frkl.common.formats.auto import AutoInput
+from tings.tingistry import Tingistry
+
+
+log = logging.getLogger("bring")
+
+INDEX_MAGIC = b"BRINGIDX"
+INDEX_FORMAT_VERSION = 1
+INDEX_FILE_EXTENSION = ".bidx"
+PKG_FILE_EXTENSION = ".pkg.br"
+
+_HEADER = struct.Struct("<8sIQQ")
+
+
+def find_pkg_files(*paths: str) -> Dict[str, str]:
+    """Find all package description files in the provided files/folders.
+
+    Package names are calculated from the path of the file relative to the folder it was found in (e.g.
+    'binaries/helm.pkg.br' becomes 'binaries.helm'), or from the file name if a file was provided directly.
+
+    Returns:
+        Dict: a map with package names as keys, and file paths as values
+    """
+
+    result: Dict[str, str] = {}
+
+    def add(name: str, path: str):
+        if name in result.keys() and result[name] != path:
+            raise FrklException(
+                msg=f"Can't add package file '{path}'.",
+                reason=f"Duplicate package name '{name}' (already used by: {result[name]}).",
+            )
+        result[name] = path
+
+    for path in paths:
+        path = os.path.abspath(os.path.expanduser(path))
+        if os.path.isfile(path):
+            name = os.path.basename(path)
+            if name.endswith(PKG_FILE_EXTENSION):
+                name = name[0 : -len(PKG_FILE_EXTENSION)]
+            add(name, path)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                for f in sorted(files):
+                    if not f.endswith(PKG_FILE_EXTENSION):
+                        continue
+                    full_path = os.path.join(root, f)
+                    rel_path = os.path.relpath(full_path, path)[0 : -len(PKG_FILE_EXTENSION)]
+                    add(rel_path.replace(os.path.sep, "."), full_path)
+        else:
+            raise FrklException(msg=f"Can't find package files in: {path}", reason="Path does not exist.")
+
+    return result
+
+
+async def load_pkg_description(path: str) -> Mapping[str, Any]:
+
+    ai = AutoInput(path)
+    content = await ai.get_content_async()
+    return content
+
+
+class PkgMap(Mapping[str, ResolvePkg]):
+    """A read-only map of package names to packages, that creates packages from compiled indexes on first access.
+
+    The compiled indexes stay open for as long as the map is used (or until 'close' is called).
+    """
+
+    def __init__(self):
+
+        self._sources: Dict[str, Union[ResolvePkg, "CompiledIndex"]] = {}
+        self._indexes: List["CompiledIndex"] = []
+
+    def _add_pkg(self, name: str, pkg: ResolvePkg) -> None:
+
+        self._sources[name] = pkg
+
+    def _add_index(self, index: "CompiledIndex") -> None:
+
+        self._indexes.append(index)
+        for name in index.package_names:
+            self._sources[name] = index
+
+    def __getitem__(self, name: str) -> ResolvePkg:
+
+        source = self._sources[name]
+        if isinstance(source, CompiledIndex):
+            return source.get_pkg(name)
+        return source
+
+    def __iter__(self) -> Iterator[str]:
+
+        return iter(self._sources.keys())
+
+    def __contains__(self, name: object) -> bool:
+
+        return name in self._sources.keys()
+
+    def __len__(self) -> int:
+
+        return len(self._sources)
+
+    def close(self) -> None:
+
+        for index in self._indexes:
+            index.close()
+
+
+async def load_pkgs(tingistry: Tingistry, *paths: str) -> PkgMap:
+    """Create packages from package description files, folders containing them, or compiled index files.
+
+    Packages from compiled indexes are only created when they are accessed, and come with their versions pre-loaded.
+
+    Returns:
+        PkgMap: a map with package names as keys, and packages as values
+    """
+
+    result = PkgMap()
+    for path in paths:
+        if path.endswith(INDEX_FILE_EXTENSION):
+            result._add_index(CompiledIndex(path, tingistry=tingistry))
+        else:
+            for name, pkg_file in find_pkg_files(path).items():
+                content = await load_pkg_description(pkg_file)
+                result._add_pkg(name, ResolvePkg(tingistry=tingistry, **content))
+
+    return result
+
+
+async def compile_index(
+    tingistry: Tingistry,
+    target: str,
+    pkg_descriptions: Mapping[str, Mapping[str, Any]],
+) -> str:
+    """Retrieve the versions of all provided packages, and write them (along with the descriptions) to an index file.
+
+    Args:
+        tingistry (Tingistry): the tingistry to use to create the packages
+        target (str): the path of the index file (if not absolute, it'll be created in the bring index cache folder)
+        pkg_descriptions (Mapping): a map with package names as keys, and package descriptions as values
+
+    Returns:
+        str: the path to the index file
+    """
+
+    if not os.path.isabs(target):
+        if not target.endswith(INDEX_FILE_EXTENSION):
+            target = target + INDEX_FILE_EXTENSION
+        target = os.path.join(BRING_INDEX_FILES_CACHE, target)
+
+    ensure_folder(os.path.dirname(target))
+
+    tz = get_localzone()
+    toc: Dict[str, Any] = {}
+
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".bidx_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, 0, 0))
+
+            for name in sorted(pkg_descriptions.keys()):
+                description = pkg_descriptions[name]
+                pkg = ResolvePkg(tingistry=tingistry, **description)
+                versions = list(await pkg.get_versions())
+                version_args = await pkg.version_source.get_version_args_dict()
+
+                description_blob = pickle.dumps(dict(description), protocol=pickle.HIGHEST_PROTOCOL)
+                versions_blob = pickle.dumps((versions, version_args), protocol=pickle.HIGHEST_PROTOCOL)
+
+                description_offset = f.tell()
+                f.write(description_blob)
+                versions_offset = f.tell()
+                f.write(versions_blob)
+
+                toc[name] = {
+                    "description": [description_offset, len(description_blob)],
+                    "versions": [versions_offset, len(versions_blob)],
+                    "source_id": pkg.version_source.get_unique_source_id(),
+                    "num_versions": len(versions),
+                }
+
+            toc_blob = json.dumps(
+                {"created": str(tz.localize(datetime.now())), "packages": toc}
+            ).encode("utf-8")
+            toc_offset = f.tell()
+            f.write(toc_blob)
+            f.seek(0)
+            f.write(_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, toc_offset, len(toc_blob)))
+
+        os.replace(temp_file, target)
+    finally:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+
+    return target
+
+
+async def compile_index_from_files(tingistry: Tingistry, target: str, *paths: str) -> str:
+    """Compile an index from all package description files found in the provided files/folders."""
+
+    descriptions = {}
+    for name, path in find_pkg_files(*paths).items():
+        descriptions[name] = await load_pkg_description(path)
+
+    return await compile_index(tingistry=tingistry, target=target, pkg_descriptions=descriptions)
+
+
+class CompiledIndex(object):
+    """Read-only access to a compiled index file.
+
+    Package descriptions and versions are unpickled lazily, on first access, and kept in memory afterwards.
+
+    Args:
+        path (str): the path to the index file
+        tingistry (Tingistry): the tingistry used to create package objects (only required for 'get_pkg')
+    """
+
+    def __init__(self, path: str, tingistry: Optional[Tingistry] = None):
+
+        self._path: str = path
+        self._tingistry: Optional[Tingistry] = tingistry
+
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, version, toc_offset, toc_length = _HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            self.close()
+            raise FrklException(msg=f"Can't open index file: {path}", reason="Not a bring index file.")
+        if version != INDEX_FORMAT_VERSION:
+            self.close()
+            raise FrklException(
+                msg=f"Can't open index file: {path}",
+                reason=f"Unsupported index format version: {version}",
+                solution="Re-compile the index with the current version of bring.",
+            )
+
+        toc = json.loads(self._mmap[toc_offset : toc_offset + toc_length])
+        self._created: str = toc["created"]
+        self._toc: Mapping[str, Mapping[str, Any]] = toc["packages"]
+
+        self._descriptions: MutableMapping[str, Mapping[str, Any]] = {}
+        self._versions: MutableMapping[str, Tuple[List[PkgVersion], Mapping[str, Mapping[str, Any]]]] = {}
+        self._pkgs: MutableMapping[str, ResolvePkg] = {}
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def created(self) -> str:
+        return self._created
+
+    @property
+    def package_names(self) -> Iterable[str]:
+        return self._toc.keys()
+
+    def __contains__(self, pkg_name: str) -> bool:
+        return pkg_name in self._toc.keys()
+
+    def __len__(self) -> int:
+        return len(self._toc)
+
+    def get_toc_entry(self, pkg_name: str) -> Mapping[str, Any]:
+
+        entry = self._toc.get(pkg_name, None)
+        if entry is None:
+            raise FrklException(
+                msg=f"Can't retrieve package '{pkg_name}'.",
+                reason=f"No package with that name in index: {self._path}",
+            )
+        return entry
+
+    def _load_blob(self, pkg_name: str, key: str) -> Any:
+
+        offset, length = self.get_toc_entry(pkg_name)[key]
+        return pickle.loads(self._mmap[offset : offset + length])
+
+    def get_pkg_description(self, pkg_name: str) -> Mapping[str, Any]:
+
+        if pkg_name not in self._descriptions.keys():
+            self._descriptions[pkg_name] = self._load_blob(pkg_name, "description")
+        return self._descriptions[pkg_name]
+
+    def get_versions(self, pkg_name: str) -> List[PkgVersion]:
+
+        return self._get_versions_data(pkg_name)[0]
+
+    def get_version_args_dict(self, pkg_name: str) -> Mapping[str, Mapping[str, Any]]:
+
+        return self._get_versions_data(pkg_name)[1]
+
+    def _get_versions_data(self, pkg_name: str) -> Tuple[List[PkgVersion], Mapping[str, Mapping[str, Any]]]:
+
+        if pkg_name not in self._versions.keys():
+            self._versions[pkg_name] = self._load_blob(pkg_name, "versions")
+        return self._versions[pkg_name]
+
+    def get_pkg(self, pkg_name: str) -> ResolvePkg:
+        """Return a package object, with its version source pre-seeded with the versions from this index."""
+
+        if pkg_name in self._pkgs.keys():
+            return self._pkgs[pkg_name]
+
+        if self._tingistry is None:
+            raise FrklException(
+                msg=f"Can't create package '{pkg_name}'.", reason="No tingistry provided for index."
+            )
+
+        pkg = ResolvePkg(tingistry=self._tingistry, **self.get_pkg_description(pkg_name))
+        versions, version_args = self._get_versions_data(pkg_name)
+        pkg.version_source.set_versions(versions, version_args)
+        self._pkgs[pkg_name] = pkg
+        return pkg
+
+    def close(self) -> None:
+
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "CompiledIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
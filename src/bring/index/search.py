@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""A persistent, incrementally updated inverted index to search packages.
+
+Indexed are:
+
+  - words in the package name, and all string values of the package 'info'
+  - tags (both the individual words and the full tag)
+  - labels (as 'key=value' filters), and words in label values
+  - the values of all version 'id_vars', and the 'allowed' values of the package args (also as 'key=value' filters)
+
+Queries consist of a list of terms, all of which have to match (AND):
+
+  - 'word': packages that contain this word
+  - 'wor*': packages that contain a word starting with 'wor'
+  - 'key=value': packages with a label/variable 'key' that has the value 'value' ('value' can end with '*', too)
+"""
+
+import bisect
+import collections
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from bring.defaults import BRING_SEARCH_INDEX_CACHE
+from bring.index.compiled import CompiledIndex, find_pkg_files, load_pkg_description
+from bring.pkg import ResolvePkg
+from frkl.common.filesystem import ensure_folder
+from tings.tingistry import Tingistry
+
+
+log = logging.getLogger("bring")
+
+SEARCH_INDEX_FORMAT_VERSION = 1
+PKG_FILES_ORIGIN = "__pkg_files__"
+
+_WORD_SPLIT = re.compile(r"[^\w]+", re.UNICODE)
+
+
+def tokenize(value: Any) -> Set[str]:
+    """Split a (nested) value into lower-case words."""
+
+    result: Set[str] = set()
+    if value is None:
+        return result
+    if isinstance(value, str):
+        for word in _WORD_SPLIT.split(value.lower()):
+            if word:
+                result.add(word)
+    elif isinstance(value, collections.abc.Mapping):
+        for v in value.values():
+            result.update(tokenize(v))
+    elif isinstance(value, collections.abc.Iterable):
+        for v in value:
+            result.update(tokenize(v))
+    elif isinstance(value, (int, float, bool)):
+        result.add(str(value).lower())
+    return result
+
+
+def _label_value(value: Any) -> str:
+
+    return str(value).lower()
+
+
+def extract_search_data(
+    pkg_name: str,
+    description: Mapping[str, Any],
+    versions_vars: Iterable[Mapping[str, Any]] = (),
+) -> Tuple[Set[str], Set[Tuple[str, str]], Mapping[str, Any]]:
+    """Extract the terms, label pairs and display details of a package.
+
+    Returns:
+        Tuple: a set of terms, a set of (key, value) label pairs, and a dict with details to display in search results
+    """
+
+    terms: Set[str] = set()
+    labels: Set[Tuple[str, str]] = set()
+
+    terms.update(tokenize(pkg_name))
+
+    info = description.get("info", None) or {}
+    if isinstance(info, str):
+        info = {"slug": info}
+    terms.update(tokenize(info))
+
+    tags = description.get("tags", None) or []
+    for tag in tags:
+        terms.update(tokenize(tag))
+        labels.add(("tag", _label_value(tag)))
+    for tag in info.get("tags", None) or []:
+        labels.add(("tag", _label_value(tag)))
+
+    for k, v in (description.get("labels", None) or {}).items():
+        labels.add((k.lower(), _label_value(v)))
+        terms.update(tokenize(v))
+
+    for arg_name, arg in (description.get("args", None) or {}).items():
+        if not isinstance(arg, collections.abc.Mapping):
+            continue
+        for v in arg.get("allowed", None) or []:
+            labels.add((arg_name.lower(), _label_value(v)))
+            terms.update(tokenize(v))
+
+    for id_vars in versions_vars:
+        for k, v in id_vars.items():
+            labels.add((k.lower(), _label_value(v)))
+            terms.update(tokenize(v))
+
+    details = {"slug": info.get("slug", None), "labels": dict(description.get("labels", None) or {})}
+
+    return terms, labels, details
+
+
+class SearchIndex(object):
+    """Inverted index of packages.
+
+    Args:
+        index_file (str): the file to persist the index to (or None, to keep it in memory only)
+    """
+
+    def __init__(self, index_file: Optional[str] = None):
+
+        self._index_file: Optional[str] = index_file
+
+        self._terms: Dict[str, Set[str]] = {}
+        self._labels: Dict[str, Dict[str, Set[str]]] = {}
+        # pkg_name -> details ('origin', 'source', 'state', 'terms', 'labels', 'details')
+        self._docs: Dict[str, Dict[str, Any]] = {}
+
+        self._sorted_terms: Optional[List[str]] = None
+        self._sorted_label_values: Dict[str, List[str]] = {}
+        self._dirty: bool = False
+
+        if self._index_file and os.path.exists(self._index_file):
+            self._load()
+
+    @classmethod
+    def for_sources(cls, *sources: str) -> "SearchIndex":
+        """Return the persistent index for a set of package files/folders/compiled indexes."""
+
+        paths = sorted(os.path.abspath(os.path.expanduser(s)) for s in sources)
+        digest = hashlib.sha1("\n".join(paths).encode("utf-8")).hexdigest()
+        return SearchIndex(index_file=os.path.join(BRING_SEARCH_INDEX_CACHE, f"{digest}.pickle"))
+
+    @property
+    def package_names(self) -> Iterable[str]:
+        return self._docs.keys()
+
+    def get_details(self, pkg_name: str) -> Mapping[str, Any]:
+        return self._docs[pkg_name]["details"]
+
+    def _load(self) -> None:
+
+        try:
+            with open(self._index_file, "rb") as f:  # type: ignore
+                data = pickle.load(f)
+        except Exception as e:
+            log.debug(f"Can't load search index '{self._index_file}', ignoring it: {e}")
+            return
+
+        if data.get("format_version", None) != SEARCH_INDEX_FORMAT_VERSION:
+            return
+
+        self._terms = data["terms"]
+        self._labels = data["labels"]
+        self._docs = data["docs"]
+
+    def save(self) -> None:
+
+        if not self._index_file or not self._dirty:
+            return
+
+        ensure_folder(os.path.dirname(self._index_file))
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(self._index_file), prefix=".search_")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(
+                    {
+                        "format_version": SEARCH_INDEX_FORMAT_VERSION,
+                        "terms": self._terms,
+                        "labels": self._labels,
+                        "docs": self._docs,
+                    },
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(temp_file, self._index_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.unlink(temp_file)
+        self._dirty = False
+
+    def add(
+        self,
+        pkg_name: str,
+        description: Mapping[str, Any],
+        versions_vars: Iterable[Mapping[str, Any]] = (),
+        source: Optional[str] = None,
+        state: Any = None,
+        origin: Optional[str] = None,
+    ) -> None:
+        """Add (or replace) a package.
+
+        Args:
+            pkg_name (str): the package name
+            description (Mapping): the package description
+            versions_vars (Iterable): the 'id_vars' of all versions of the package
+            source (str): the file the package was loaded from
+            state (Any): a value to detect whether the source changed since the package was indexed
+            origin (str): the set of sources the package belongs to (used to detect removed packages)
+        """
+
+        if pkg_name in self._docs.keys():
+            self.remove(pkg_name)
+
+        terms, labels, details = extract_search_data(pkg_name, description, versions_vars)
+
+        for t in terms:
+            self._terms.setdefault(t, set()).add(pkg_name)
+        for k, v in labels:
+            self._labels.setdefault(k, {}).setdefault(v, set()).add(pkg_name)
+
+        self._docs[pkg_name] = {
+            "origin": origin,
+            "source": source,
+            "state": state,
+            "terms": terms,
+            "labels": labels,
+            "details": details,
+        }
+        self._invalidate()
+
+    def remove(self, pkg_name: str) -> None:
+
+        doc = self._docs.pop(pkg_name, None)
+        if doc is None:
+            return
+
+        for t in doc["terms"]:
+            docs = self._terms.get(t, None)
+            if docs is not None:
+                docs.discard(pkg_name)
+                if not docs:
+                    self._terms.pop(t)
+        for k, v in doc["labels"]:
+            values = self._labels.get(k, {})
+            docs = values.get(v, None)
+            if docs is not None:
+                docs.discard(pkg_name)
+                if not docs:
+                    values.pop(v)
+            if not values:
+                self._labels.pop(k, None)
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+
+        self._dirty = True
+        self._sorted_terms = None
+        self._sorted_label_values = {}
+
+    async def update_from_files(
+        self, *paths: str, tingistry: Optional[Tingistry] = None
+    ) -> Mapping[str, int]:
+        """Re-index all package files that were added, changed or removed since the last update.
+
+        If a tingistry is provided, the version 'id_vars' of each (changed) package are indexed, too. This uses the
+        metadata cache, but might have to retrieve versions from the package source.
+        """
+
+        pkg_files = find_pkg_files(*paths)
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        for name, doc in list(self._docs.items()):
+            if doc["origin"] == PKG_FILES_ORIGIN and name not in pkg_files.keys():
+                self.remove(name)
+                stats["removed"] = stats["removed"] + 1
+
+        for name, path in pkg_files.items():
+            file_stat = os.stat(path)
+            state = (file_stat.st_mtime_ns, file_stat.st_size, tingistry is not None)
+            existing = self._docs.get(name, None)
+            if existing is not None and existing["source"] == path and existing["state"] == state:
+                stats["unchanged"] = stats["unchanged"] + 1
+                continue
+
+            description = await load_pkg_description(path)
+            versions_vars: List[Mapping[str, Any]] = []
+            if tingistry is not None:
+                try:
+                    pkg = ResolvePkg(tingistry=tingistry, **description)
+                    versions_vars = [v.id_vars for v in await pkg.get_versions()]
+                except Exception as e:
+                    log.debug(f"Can't retrieve versions for '{path}', not indexing version vars: {e}")
+
+            self.add(name, description, versions_vars, source=path, state=state, origin=PKG_FILES_ORIGIN)
+            key = "added" if existing is None else "updated"
+            stats[key] = stats[key] + 1
+
+        return stats
+
+    def update_from_compiled_index(self, index: CompiledIndex) -> Mapping[str, int]:
+        """Re-index all packages of a compiled index, if it changed since the last update."""
+
+        file_stat = os.stat(index.path)
+        state = (file_stat.st_mtime_ns, file_stat.st_size)
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+
+        for name, doc in list(self._docs.items()):
+            if doc["origin"] == index.path and name not in index:
+                self.remove(name)
+                stats["removed"] = stats["removed"] + 1
+
+        for name in index.package_names:
+            existing = self._docs.get(name, None)
+            if existing is not None and existing["source"] == index.path and existing["state"] == state:
+                stats["unchanged"] = stats["unchanged"] + 1
+                continue
+
+            versions_vars = [v.id_vars for v in index.get_versions(name)]
+            self.add(
+                name,
+                index.get_pkg_description(name),
+                versions_vars,
+                source=index.path,
+                state=state,
+                origin=index.path,
+            )
+            key = "added" if existing is None else "updated"
+            stats[key] = stats[key] + 1
+
+        return stats
+
+    def _get_sorted_terms(self) -> List[str]:
+
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._terms.keys())
+        return self._sorted_terms
+
+    def _get_sorted_label_values(self, key: str) -> List[str]:
+
+        if key not in self._sorted_label_values.keys():
+            self._sorted_label_values[key] = sorted(self._labels.get(key, {}).keys())
+        return self._sorted_label_values[key]
+
+    @staticmethod
+    def _prefix_range(sorted_values: List[str], prefix: str) -> List[str]:
+
+        start = bisect.bisect_left(sorted_values, prefix)
+        end = bisect.bisect_left(sorted_values, prefix + "\U0010ffff")
+        return sorted_values[start:end]
+
+    def _match_term(self, term: str) -> Set[str]:
+
+        term = term.lower()
+        if "=" in term:
+            key, value = term.split("=", 1)
+            values = self._labels.get(key, {})
+            if value.endswith("*"):
+                result: Set[str] = set()
+                for v in self._prefix_range(self._get_sorted_label_values(key), value[0:-1]):
+                    result.update(values[v])
+                return result
+            return set(values.get(value, set()))
+
+        if term.endswith("*"):
+            result = set()
+            for t in self._prefix_range(self._get_sorted_terms(), term[0:-1]):
+                result.update(self._terms[t])
+            return result
+
+        words = tokenize(term)
+        if not words:
+            return set(self._docs.keys())
+        result_set: Optional[Set[str]] = None
+        for w in words:
+            docs = self._terms.get(w, set())
+            result_set = set(docs) if result_set is None else result_set & docs
+        return result_set  # type: ignore
+
+    def search(self, *query: str) -> List[str]:
+        """Return the (sorted) names of all packages that match all of the query terms."""
+
+        if not query:
+            return sorted(self._docs.keys())
+
+        result: Optional[Set[str]] = None
+        for term in query:
+            matches = self._match_term(term)
+            result = matches if result is None else result & matches
+            if not result:
+                return []
+
+        return sorted(result)  # type: ignore
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import atexit
 import sys
-from typing import Iterable
+from typing import Any, Dict, Iterable, Optional
 
 import asyncclick as click
 
@@ -13,20 +13,43 @@ import asyncclick as click
 # except Exception:
 #     pass
 from bring.bring import Bring
+from bring.config.settings import set_setting
+from bring.utils.executors import ensure_stall_detection
 
 click.anyio_backend = "asyncio"
 
 
 @click.group()
+@click.option("--offline", is_flag=True, help="only use local caches, never the network")
 @click.pass_context
-async def cli(ctx):
+async def cli(ctx, offline):
 
     ctx.obj = {}
 
+    if offline:
+        set_setting("offline", True)
+
+    ensure_stall_detection()
+
     ctx.obj["bring"] = Bring()
 
 
+def version_input(version: Optional[str]) -> Dict[str, Any]:
+    """Return the input values for a '--version' option, empty if it wasn't used (so the package default applies)."""
+
+    if version is None:
+        return {}
+    return {"version": version}
+
+
 from bring.interfaces.cli.explain import explain
+from bring.interfaces.cli.index import index
+from bring.interfaces.cli.install import install
+from bring.interfaces.cli.pack import pack, unpack
+from bring.interfaces.cli.search import search
+from bring.interfaces.cli.stats import stats
+from bring.interfaces.cli.update import diff, update
+from bring.interfaces.cli.warm import warm
 
 
 if __name__ == "__main__":
@@ -1,14 +1,13 @@
-import sys
-from pathlib import Path
+import json
+from typing import Any, Mapping
 
-from bring.bring import Bring
-from bring.interfaces.cli import cli
 import asyncclick as click
 
-from bring.pkg import ResolvePkg, PkgVersion
-from bring.transform.pipeline import Pipeline
-from frkl.common.formats import INPUT_TYPE
-from frkl.common.formats.auto import AutoInput
+from bring.bring import Bring
+from bring.index.compiled import load_pkgs
+from bring.interfaces.cli import cli, version_input
+from bring.pkg import plan_installs
+from bring.utils.filesystem import format_bytes
 
 
 @cli.group()
@@ -17,41 +16,65 @@ def explain(ctx):
 
     pass
 
-@explain.command()
-@click.argument("pkg", nargs=1, required=True)
-@click.pass_context
-async def package(ctx, pkg):
 
-    ai = AutoInput(pkg)
-    if ai.input_type == INPUT_TYPE.string:
-        raise Exception("XXX")
+def _format_estimate(layer: Mapping[str, Any]) -> str:
 
-    content = await ai.get_content_async()
-    vt = await ai.get_value_type_async()
+    parts = []
+    for key, label in [("fetch_bytes", "to fetch"), ("copy_bytes", "to copy")]:
+        if layer.get(key, None):
+            parts.append(f"~{format_bytes(layer[key])} {label}")
+    if layer.get("seconds", None):
+        parts.append(f"~{layer['seconds']:.1f}s")
+    if layer.get("cached_steps", None):
+        parts.append(f"{layer['cached_steps']} step(s) cached")
+    return ", ".join(parts)
 
-    bring: Bring = ctx.obj["bring"]
 
-    pkg = ResolvePkg(tingistry=bring.tingistry, **content)
-    import pp
-    # pkg.to_dict()
-    # pp(pkg.to_dict())
+def _print_plan(name: str, plan: Mapping[str, Any]) -> None:
+
+    if "error" in plan.keys():
+        click.echo(f"{name}: error: {plan['error']}")
+        return
 
-    # path = await pkg.get_version_folder(version="latest", _read_only=False)
-    # print(path)
+    if plan["version"] is None:
+        click.echo(f"{name} (version: unknown, metadata not cached)")
+    else:
+        version = ", ".join(f"{k}={v}" for k, v in plan["version"].items())
+        click.echo(f"{name} ({version})")
 
-    result = await pkg.install(version="latest")
-    print(result)
+    for layer in plan["layers"]:
+        click.echo(f"  {layer['layer'].replace('_', ' '):<16}{layer['status']:<8}{_format_estimate(layer)}")
 
-    # version: PkgVersion = await pkg.find_matching_version(version="latest")
+    if plan["transform"]:
+        steps = ", ".join(f"{step['type']} ({step['status']})" for step in plan["transform"])
+        click.echo(f"  transform: {steps}")
 
-    # pipeline = Pipeline(tingistry=bring.tingistry, task_name="install_pkg")
-    #
-    # pipeline.add(*version.steps)
-    # print(pipeline)
-    #
-    # result = await pipeline.run_async(raise_exception=True)
-    # print(result.result_value)
+    if plan["needs_install"]:
+        click.echo(f"  estimated: {format_bytes(plan['fetch_bytes'])} to fetch, {format_bytes(plan['copy_bytes'])} to copy, {plan['seconds']:.1f}s")
+    else:
+        click.echo("  nothing to do")
 
 
+@explain.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--version", "-v", default=None, help="the version to plan the install for  [default: the default version of the package]")
+@click.option("--fetch-metadata", is_flag=True, help="retrieve package metadata that is not cached (contacts the package sources)")
+@click.option("--format", "-f", "output_format", type=click.Choice(["text", "json"]), default="text", help="the output format")
+@click.pass_context
+async def package(ctx, pkgs, version, fetch_metadata, output_format):
+    """Show what installing packages would do (cache hits and misses, estimated cost), without doing it.
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+    plans = await plan_installs(packages, fetch_metadata=fetch_metadata, **version_input(version))
 
+    if output_format == "json":
+        click.echo(json.dumps(plans, indent=2, default=str))
+        return
 
+    for name, plan in plans.items():
+        _print_plan(name, plan)
@@ -0,0 +1,40 @@
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import CompiledIndex, compile_index_from_files
+from bring.interfaces.cli import cli
+
+
+@cli.group()
+@click.pass_context
+def index(ctx):
+    """Manage compiled package indexes."""
+
+    pass
+
+
+@index.command(name="compile")
+@click.argument("paths", nargs=-1, required=True)
+@click.option("--output", "-o", required=True, help="the index name (or path, if absolute)")
+@click.pass_context
+async def compile_index(ctx, paths, output):
+    """Compile package description files (or folders containing them) into a single index file."""
+
+    bring: Bring = ctx.obj["bring"]
+
+    path = await compile_index_from_files(bring.tingistry, output, *paths)
+    click.echo(f"Index written to: {path}")
+
+
+@index.command()
+@click.argument("index_file", nargs=1, required=True)
+@click.pass_context
+async def show(ctx, index_file):
+    """List the packages in a compiled index."""
+
+    with CompiledIndex(index_file) as idx:
+        click.echo(f"created: {idx.created}")
+        click.echo(f"packages: {len(idx)}")
+        for name in sorted(idx.package_names):
+            entry = idx.get_toc_entry(name)
+            click.echo(f"  {name} ({entry['num_versions']} versions)")
@@ -0,0 +1,33 @@
+import os
+
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import load_pkgs
+from bring.interfaces.cli import cli, version_input
+from bring.pkg.link_farm import LINK_MODES
+
+
+@cli.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--target", "-t", required=True, help="the folder to install the packages into (as '<target>/<package_name>')", type=click.Path(file_okay=False))
+@click.option("--version", "-v", default=None, help="the version to install  [default: the default version of the package]")
+@click.option("--link-mode", "-l", default=None, help="how files are linked from the install cache  [default: setting 'target_link_mode']", type=click.Choice(LINK_MODES))
+@click.pass_context
+async def install(ctx, pkgs, target, version, link_mode):
+    """Install packages into a target folder, as links to the install cache.
+
+    Each package is installed as '<target>/<package_name>', a symbolic link to a folder of links to (or cheap copies of)
+    the package files in the install cache. Installing another version replaces the symbolic link atomically, switching
+    back to a recently installed version only replaces the symbolic link.
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+    for name, pkg in packages.items():
+        path = os.path.join(target, name)
+        farm_path = await pkg.install_to_target(path, name, link_mode=link_mode, **version_input(version))
+        click.echo(f"{name}: {path} -> {farm_path}")
@@ -0,0 +1,47 @@
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import load_pkgs
+from bring.interfaces.cli import cli, version_input
+from bring.pkg.archive import unpack_package
+from bring.pkg.binary_cache import add_to_binary_cache
+from bring.utils.executors import run_disk
+
+
+@cli.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--version", "-v", default=None, help="the version to pack  [default: the default version of the package]")
+@click.option("--output", "-o", default=".", help="the folder to write the archives into", show_default=True)
+@click.option("--binary-cache", is_flag=True, help="write archives (and signed manifests) in binary cache layout, so the output folder can be used as binary cache")
+@click.pass_context
+async def pack(ctx, pkgs, version, output, binary_cache):
+    """Build packages (unless they are in the install cache already), and write each into a portable archive.
+
+    Archives can be imported into the install cache of another node with 'bring unpack', or served from a binary cache
+    (setting: 'binary_caches').
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+    for name, pkg in packages.items():
+        if binary_cache:
+            # binary caches look packages up by package id only
+            archive_file = await pkg.pack(output, **version_input(version))
+            await run_disk(add_to_binary_cache, archive_file)
+        else:
+            archive_file = await pkg.pack(output, name=name, **version_input(version))
+        click.echo(f"{name}: {archive_file}")
+
+
+@cli.command()
+@click.argument("archives", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+async def unpack(ctx, archives):
+    """Import package archives (created with 'bring pack') into the install cache."""
+
+    for archive_file in archives:
+        package_cache_path = await unpack_package(archive_file)
+        click.echo(f"{archive_file}: {package_cache_path}")
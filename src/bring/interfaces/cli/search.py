@@ -0,0 +1,40 @@
+import os
+
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import INDEX_FILE_EXTENSION, CompiledIndex
+from bring.index.search import SearchIndex
+from bring.interfaces.cli import cli
+
+
+@cli.command()
+@click.argument("query", nargs=-1, required=False)
+@click.option("--source", "-s", "sources", multiple=True, required=True, help="package file, folder of package files, or compiled index (can be used multiple times)")
+@click.option("--versions/--no-versions", default=False, help="whether to index version variables of package files (might retrieve versions)")
+@click.pass_context
+async def search(ctx, query, sources, versions):
+    """Search packages by words, prefixes ('kube*') and label/variable filters ('os=linux')."""
+
+    bring: Bring = ctx.obj["bring"]
+
+    search_index = SearchIndex.for_sources(*sources)
+
+    pkg_paths = []
+    for source in sources:
+        if source.endswith(INDEX_FILE_EXTENSION) and os.path.isfile(source):
+            with CompiledIndex(source) as idx:
+                search_index.update_from_compiled_index(idx)
+        else:
+            pkg_paths.append(source)
+    if pkg_paths:
+        await search_index.update_from_files(*pkg_paths, tingistry=bring.tingistry if versions else None)
+
+    search_index.save()
+
+    for name in search_index.search(*query):
+        slug = search_index.get_details(name).get("slug", None)
+        if slug:
+            click.echo(f"{name}: {slug}")
+        else:
+            click.echo(name)
@@ -0,0 +1,52 @@
+import json
+
+import asyncclick as click
+
+from bring.interfaces.cli import cli
+from bring.utils.metrics import METRICS
+
+
+@cli.command()
+@click.option("--format", "-f", "output_format", type=click.Choice(["text", "prometheus", "json"]), default="text", help="the output format")
+@click.option("--output", "-o", required=False, help="write the Prometheus textfile export to this path")
+@click.option("--reset", is_flag=True, help="reset all counters")
+@click.pass_context
+async def stats(ctx, output_format, output, reset):
+    """Display cache and throughput metrics, collected across all runs."""
+
+    if reset:
+        METRICS.reset()
+        click.echo("Metrics reset.")
+        return
+
+    if output:
+        METRICS.write_prometheus_textfile(output)
+        click.echo(f"Metrics written to: {output}")
+        return
+
+    if output_format == "prometheus":
+        click.echo(METRICS.to_prometheus(), nl=False)
+        return
+
+    data = METRICS.to_dict()
+    if output_format == "json":
+        click.echo(json.dumps(data, indent=2))
+        return
+
+    for name, details in data.items():
+        click.echo(f"{name}: {details['doc']}")
+        if not details["values"]:
+            click.echo("    no data")
+            continue
+        for item in details["values"]:
+            labels = ", ".join(f"{k}={v}" for k, v in item["labels"].items())
+            value = item["value"]
+            if details["type"] == "histogram":
+                if value["count"]:
+                    value = f"count={value['count']}, sum={value['sum']}, avg={value['sum'] / value['count']:.3f}"
+                else:
+                    value = "count=0"
+            if labels:
+                click.echo(f"    [{labels}] {value}")
+            else:
+                click.echo(f"    {value}")
@@ -0,0 +1,59 @@
+from typing import Any, Mapping
+
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import load_pkgs
+from bring.interfaces.cli import cli, version_input
+from bring.utils.filesystem import format_bytes
+
+
+def _format_delta(delta: Mapping[str, Any]) -> str:
+
+    return (f"{len(delta['files_added'])} added, {len(delta['files_changed'])} changed, {len(delta['files_removed'])} removed, "
+            f"{len(delta['modes_changed'])} mode changes, "
+            f"{len(delta['links_added']) + len(delta['links_changed']) + len(delta['links_removed'])} link changes, "
+            f"{len(delta['unchanged'])} unchanged ({format_bytes(delta['copy_bytes'])} to copy)")
+
+
+@cli.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--from", "from_version", required=True, help="the version to compare from")
+@click.option("--to", "to_version", default=None, help="the version to compare to  [default: the default version of the package]")
+@click.pass_context
+async def diff(ctx, pkgs, from_version, to_version):
+    """Show the file-level changes between two versions of packages.
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+    for name, pkg in packages.items():
+        delta = await pkg.diff(version_input(from_version), **version_input(to_version))
+        click.echo(f"{name}: {_format_delta(delta)}")
+
+
+@cli.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--target", "-t", required=True, help="the folder to update", type=click.Path(file_okay=False))
+@click.option("--version", "-v", default=None, help="the version to update to  [default: the default version of the package]")
+@click.option("--force", is_flag=True, help="overwrite or remove files in the target folder that were changed locally")
+@click.pass_context
+async def update(ctx, pkgs, target, version, force):
+    """Update (or install) packages in a target folder, only changing the files that differ from the installed version.
+
+    Each update is applied as a whole or not at all (if bring dies during an update, the next update of the target
+    folder undoes its changes first), the version that is installed is recorded in the target folder (in
+    '.bring/<package_name>.json').
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+    for name, pkg in packages.items():
+        delta = await pkg.update_target(target, name, force=force, **version_input(version))
+        click.echo(f"{name}: {_format_delta(delta)}")
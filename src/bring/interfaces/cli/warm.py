@@ -0,0 +1,47 @@
+import time
+from typing import Any, Mapping
+
+import asyncclick as click
+
+from bring.bring import Bring
+from bring.index.compiled import load_pkgs
+from bring.interfaces.cli import cli, version_input
+from bring.pkg import warm_pkgs
+from bring.utils.filesystem import format_bytes
+from bring.utils.metrics import BYTES_CLONED
+
+
+@cli.command()
+@click.argument("pkgs", nargs=-1, required=True)
+@click.option("--version-folders", is_flag=True, help="also create the version folders, for the version selected with '--version'")
+@click.option("--version", "-v", default=None, help="the version to create version folders for  [default: the default version of the package]")
+@click.option("--concurrency", "-c", default=8, type=int, help="the maximum number of sources to warm at the same time", show_default=True)
+@click.pass_context
+async def warm(ctx, pkgs, version_folders, version, concurrency):
+    """Fill the metadata and git checkout caches for packages, so later calls don't have to wait for them.
+
+    PKGS can be package files, folders containing package files, or compiled index files.
+    """
+
+    bring: Bring = ctx.obj["bring"]
+
+    packages = await load_pkgs(bring.tingistry, *pkgs)
+
+    def progress(result: Mapping[str, Any], done: int, total: int):
+
+        status = "ok" if result["success"] else f"failed: {result['error']}"
+        click.echo(f"[{done}/{total}] {', '.join(result['pkgs'])}: {status} ({result['seconds']:.1f}s)")
+
+    start = time.time()
+    cloned_before = BYTES_CLONED.total()
+
+    results = await warm_pkgs(packages, version_folders=version_folders, max_concurrency=concurrency, progress=progress, **version_input(version))
+
+    failed = [r for r in results if not r["success"]]
+    click.echo()
+    click.echo(f"Warmed {len(results) - len(failed)} of {len(results)} sources ({len(packages)} packages) in {time.time() - start:.1f}s, {format_bytes(BYTES_CLONED.total() - cloned_before)} cloned.")
+    for result in failed:
+        click.echo(f"  failed: {', '.join(result['pkgs'])}: {result['error']}")
+
+    if failed:
+        ctx.exit(1)
@@ -1,35 +1,49 @@
 import atexit
 import collections
 import json
+import logging
 import os
 import shutil
+import time
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
 from pathlib import Path
-from typing import Mapping, Any, Optional, Iterable, Union, Dict, List, Sequence
+from typing import Mapping, Any, Optional, Iterable, Union, Dict, List, Sequence, Callable
 
 from deepdiff import DeepHash
 from tzlocal import get_localzone
 
-from anyio import open_file
+from anyio import create_semaphore, create_task_group, open_file
 
 from bring.defaults import BRING_PKG_INSTALL_FOLDER, \
     BRING_PKG_DATA_FOLDER_NAME
+from bring.pkg.archive import ARCHIVE_EXTENSION, pack_package
+from bring.pkg.binary_cache import fetch_from_binary_caches, get_binary_caches, plan_binary_caches
+from bring.pkg.delta import compute_delta, update_target
+from bring.pkg.link_farm import install_to_target
+from bring.pkg.manifest import create_manifest, get_manifest_path, publish_package, read_manifest, write_manifest
 from bring.pkg.versions import PkgVersion, get_version_sources_factory, VersionSource
 from bring.transform.pipeline import Pipeline
+from bring.transform.step_cache import StepCache, calculate_base_key, calculate_step_keys
 from bring.transform.transformer import explode_transform_value
-from bring.transform.transformers.folder_content import convert_content_spec_items
+from bring.transform.transformers.folder_content import convert_content_spec_items, FROM_KEY
+from bring.utils.executors import run_disk
+from bring.utils.locks import cache_lock
+from bring.utils.metrics import INSTALL_CACHE_HITS, INSTALL_CACHE_MISSES, INSTALL_SECONDS, VERSIONS_RETRIEVAL_SECONDS
 from frkl.args.hive import ArgHive
 from frkl.common.async_utils import wrap_async_task
 from frkl.common.dicts import get_seeded_dict
 from frkl.common.doc import Doc
 from frkl.common.exceptions import FrklException
-from frkl.common.filesystem import ensure_folder
+from frkl.common.strings import from_camel_case
 from frkl.targets.target import Target
 from frkl.types.plugins import PluginFactory
 from tings.tingistry import Tingistry
 
 
+log = logging.getLogger("bring")
+
+
 def calculate_package_id(pkg: "Pkg", version: PkgVersion) -> str:
 
     return f"{version.id}_{pkg.transform_hash}"
@@ -125,6 +139,29 @@ class Pkg(metaclass=ABCMeta):
     def transform(self) -> Sequence[Mapping[str, Any]]:
         return self._transform
 
+    @property
+    def content_paths(self) -> Optional[List[str]]:
+        """The paths of a version folder the transform pipeline reads, or None if it might read all of them.
+
+        This is only known if the first transform step is 'folder_content', with a content spec that lists
+        the source paths explicitly.
+        """
+
+        if not self._transform or self._transform[0]["type"] != "folder_content":
+            return None
+
+        content_spec = self._transform[0].get("content_spec", None)
+        if not content_spec:
+            return None
+
+        paths = set()
+        for item in convert_content_spec_items(content_spec):
+            if not item.get(FROM_KEY, None):
+                return None
+            paths.add(item[FROM_KEY])
+
+        return sorted(paths)
+
     @property
     def transform_hash(self) -> str:
 
@@ -181,6 +218,7 @@ class ResolvePkg(Pkg):
 
             version_sources_factory: PluginFactory = get_version_sources_factory(self._tingistry.arg_hive)
             self._version_source = version_sources_factory.create_plugin(pkg_type, tingistry=self._tingistry, **pkg_data)
+            self._version_source.aliases = self._pkg_aliases
 
         return self._version_source
 
@@ -188,38 +226,346 @@ class ResolvePkg(Pkg):
 
         return  await self.version_source.get_versions()
 
+    def calculate_package_cache_path(self, version: PkgVersion) -> str:
+        """Return the path of a version of this package in the install cache."""
+
+        package_base_path = self.version_source.calculate_version_folder_base_path(version, version_base_dir=BRING_PKG_INSTALL_FOLDER)
+        return os.path.join(package_base_path, self.transform_hash, BRING_PKG_DATA_FOLDER_NAME)
+
     async def install(self, **input_values: Any) -> str:
 
         version = await self.version_source.find_matching_version(**input_values)
 
-        package_base_path = self.version_source.calculate_version_folder_base_path(version, version_base_dir=BRING_PKG_INSTALL_FOLDER)
-
-        package_cache_path = os.path.join(package_base_path, self.transform_hash, BRING_PKG_DATA_FOLDER_NAME)
-        package_metadata_file = os.path.join(package_base_path, self.transform_hash, f"{self.transform_hash}.json")
+        package_cache_path = self.calculate_package_cache_path(version)
 
         if not os.path.exists(package_cache_path):
+            async with cache_lock(package_cache_path):
+                # another node might have installed the package while we were waiting for the lock
+                if not os.path.exists(package_cache_path):
+                    INSTALL_CACHE_MISSES.inc()
+                    start = time.time()
+
+                    # a prebuilt package from a binary cache saves creating the version folder and transforming it
+                    prebuilt = await fetch_from_binary_caches(calculate_package_id(self, version), version.id, self.transform_hash, install_folder=BRING_PKG_INSTALL_FOLDER)
+                    if prebuilt is None:
+                        folder_path = await self._run_transform(version)
+                        manifest = await run_disk(create_manifest, folder_path, version.to_dict(), self.transform_hash)
+                        await run_disk(publish_package, folder_path, package_cache_path, manifest)
+
+                    INSTALL_SECONDS.observe(time.time() - start)
+                    return package_cache_path
+
+        INSTALL_CACHE_HITS.inc()
+        return package_cache_path
+
+    async def pack(self, target_folder: str, name: Optional[str] = None, **input_values: Any) -> str:
+        """Install a package version (unless it's in the install cache already), and write it into a package archive.
+
+        Archives can be imported into the install cache of another node with 'bring.pkg.archive.unpack_package'.
+
+        Args:
+            target_folder (str): the folder to write the archive into
+            name (str): the name of the package, used as prefix for the archive file name
+            input_values: the input to select the package version (e.g. 'version="latest"')
+
+        Returns:
+            str: the path of the archive
+        """
+
+        version = await self.version_source.find_matching_version(**input_values)
+        package_cache_path = await self.install(**input_values)
+        manifest = await self._get_manifest(version, package_cache_path)
+
+        file_name = calculate_package_id(self, version)
+        if name:
+            file_name = f"{name}_{file_name}"
+        target_file = os.path.join(target_folder, f"{file_name}{ARCHIVE_EXTENSION}")
+
+        return await run_disk(pack_package, package_cache_path, manifest, target_file)
+
+    async def _get_manifest(self, version: PkgVersion, package_cache_path: str) -> Dict[str, Any]:
+
+        manifest_path = get_manifest_path(package_cache_path)
+        if os.path.exists(manifest_path):
+            return await run_disk(read_manifest, manifest_path)
+
+        # installed before manifests were written
+        manifest = await run_disk(create_manifest, package_cache_path, version.to_dict(), self.transform_hash)
+        await run_disk(write_manifest, manifest, manifest_path)
+        return manifest
+
+    async def diff(self, from_values: Mapping[str, Any], **input_values: Any) -> Dict[str, Any]:
+        """Compute the file-level changes between two versions of this package (check 'bring.pkg.delta.compute_delta').
+
+        Both versions are installed first, unless they are in the install cache already.
+
+        Args:
+            from_values (Mapping): the input to select the version to compare from (e.g. '{"version": "1.0.0"}')
+            input_values: the input to select the version to compare to
+        """
+
+        old_version = await self.version_source.find_matching_version(**from_values)
+        old_manifest = await self._get_manifest(old_version, await self.install(**from_values))
+
+        version = await self.version_source.find_matching_version(**input_values)
+        manifest = await self._get_manifest(version, await self.install(**input_values))
+
+        return compute_delta(old_manifest, manifest)
+
+    async def update_target(self, target_folder: str, name: str, force: bool = False, **input_values: Any) -> Dict[str, Any]:
+        """Install a package version, and update a target folder to it, only changing files that differ from the
+        version that was installed there before (check 'bring.pkg.delta' for details).
+
+        Args:
+            target_folder (str): the folder to update
+            name (str): the name of the package, several packages can be installed into the same target folder
+            force (bool): overwrite or remove files in the target folder that were changed locally
+            input_values: the input to select the package version (e.g. 'version="latest"')
+
+        Returns:
+            Dict: the delta that was applied
+        """
+
+        version = await self.version_source.find_matching_version(**input_values)
+        package_cache_path = await self.install(**input_values)
+        manifest = await self._get_manifest(version, package_cache_path)
+
+        return await run_disk(update_target, package_cache_path, manifest, target_folder, name, force=force)
+
+    async def install_to_target(self, target: str, name: str, link_mode: Optional[str] = None, **input_values: Any) -> str:
+        """Install a package version, and make it available at a target path, without copying it out of the install cache.
 
+        The target path becomes a symbolic link to a link farm of the package version, switching versions replaces the
+        symbolic link atomically (check 'bring.pkg.link_farm' for details).
+
+        Args:
+            target (str): the target path
+            name (str): the name of the package
+            link_mode (str): how files are linked from the install cache (default: setting 'target_link_mode')
+            input_values: the input to select the package version (e.g. 'version="latest"')
+
+        Returns:
+            str: the path of the link farm the target path points to
+        """
+
+        version = await self.version_source.find_matching_version(**input_values)
+        package_cache_path = await self.install(**input_values)
+        manifest = await self._get_manifest(version, package_cache_path)
+
+        return await run_disk(install_to_target, package_cache_path, manifest, target, name, link_mode=link_mode)
+
+    async def plan_install(self, fetch_metadata: bool = False, **input_values: Any) -> Dict[str, Any]:
+        """Report what 'install' would do for the provided input, without doing it.
+
+        For every cache layer an install goes through (metadata cache, binary cache, git cache, version folder, transform
+        step cache, install cache), the plan contains whether it would be a hit or a miss. Sizes and durations of work that would
+        have to be done are estimated from the metrics of earlier runs (if there are any).
+
+        Resolving the version needs the package metadata. If it is not cached, the version is only resolved (which
+        means contacting the package source) if 'fetch_metadata' is True.
+
+        Returns:
+            Dict: the plan, with the keys 'version' (or None, if unresolved), 'install_path', 'layers', 'transform',
+                'fetch_bytes', 'copy_bytes', 'seconds' (the estimates) and 'needs_install'
+        """
+
+        source = self.version_source
+        source_type = from_camel_case(source.__class__.__name__)
+
+        metadata_layer: Dict[str, Any] = {"layer": "metadata_cache", "status": source.get_metadata_cache_status(), "path": source._get_cache_path()}
+        if metadata_layer["status"] == "miss":
+            metadata_layer["seconds"] = VERSIONS_RETRIEVAL_SECONDS.mean(source_type=source_type)
+
+        layers: List[Dict[str, Any]] = [metadata_layer]
+        transform: List[Dict[str, Any]] = [{"type": step["type"], "status": "unknown"} for step in self.transform]
+        plan: Dict[str, Any] = {"input": dict(input_values), "version": None, "install_path": None, "layers": layers, "transform": transform, "needs_install": True}
+
+        if metadata_layer["status"] == "miss" and not fetch_metadata:
+            return self._sum_plan_estimates(plan)
+
+        version = await source.find_matching_version(**input_values)
+        plan["version"] = dict(version.id_vars)
+        package_cache_path = self.calculate_package_cache_path(version)
+        plan["install_path"] = package_cache_path
+
+        install_layer: Dict[str, Any] = {"layer": "install_cache", "path": package_cache_path}
+        binary_cache_layer: Optional[Dict[str, Any]] = None
+        if not os.path.exists(package_cache_path) and get_binary_caches():
+            binary_cache_layer = await run_disk(plan_binary_caches, calculate_package_id(self, version))
+            layers.append(binary_cache_layer)
+
+        if os.path.exists(package_cache_path):
+            install_layer["status"] = "hit"
+            plan["needs_install"] = False
+            for step in transform:
+                step["status"] = "skip"
+        elif binary_cache_layer is not None and binary_cache_layer["status"] == "hit":
+            install_layer["status"] = "miss"
+            for step in transform:
+                step["status"] = "skip"
+        else:
+            install_layer.update({"status": "miss", "seconds": INSTALL_SECONDS.mean()})
+
+            base_key = calculate_base_key(version.id, version_metadata=version.metadata, content_paths=self.content_paths)
+            step_keys = calculate_step_keys(base_key, self.transform)
+            cached_steps = 0
+            if len(step_keys) > 1:
+                # the result of the last step is never in the step cache
+                cached_steps = await run_disk(StepCache().get_cached_prefix_length, step_keys[:-1])
+
+            if not cached_steps:
+                layers.extend(await source.plan_version_folder(version, read_only=False, content_paths=self.content_paths))
+            if len(step_keys) > 1:
+                layers.append({"layer": "step_cache", "status": "hit" if cached_steps else "miss", "cached_steps": cached_steps})
+
+            for index, step in enumerate(transform):
+                step["status"] = "cached" if index < cached_steps else "run"
+
+        layers.append(install_layer)
+
+        return self._sum_plan_estimates(plan)
+
+    def _sum_plan_estimates(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+
+        for key in ["fetch_bytes", "copy_bytes", "seconds"]:
+            plan[key] = sum(layer.get(key, None) or 0 for layer in plan["layers"])
+        return plan
+
+    async def _run_transform(self, version: PkgVersion) -> str:
+        """Run the transform steps for a version, and return the path to the (disposable) result folder.
+
+        The results of all steps but the last are kept in the transform step cache (the result of the last step ends up
+        in the install cache anyway), so only the steps after the longest cached prefix have to run.
+        """
+
+        steps = self.transform
+        step_cache = StepCache()
+        base_key = calculate_base_key(version.id, version_metadata=version.metadata, content_paths=self.content_paths)
+        step_keys = calculate_step_keys(base_key, steps)
+
+        start_index = 0
+        folder_path: Optional[str] = None
+        if len(steps) > 1:
+            start_index, folder_path = await run_disk(step_cache.find_longest_prefix, step_keys[:-1])
+
+        if folder_path is None:
             # create the version folder if necessary, then create a disposable copy
-            version_folder = await self.version_source.get_version_folder(version, read_only=False)
+            version_folder = await self.version_source.get_version_folder(version, read_only=False, content_paths=self.content_paths)
             def delete_version_folder():
                 shutil.rmtree(version_folder, ignore_errors=True)
             atexit.register(delete_version_folder)
+            folder_path = version_folder
+        else:
+            log.debug(f"Using cached result for {start_index} transform step(s), running {len(steps) - start_index}.")
+
+        cacheable = True
+        for index in range(start_index, len(steps)):
 
             pipeline = Pipeline(tingistry=self.tingistry, task_name="install_pkg")
-            pipeline.add(self._transform)
-            pipeline.set_input(folder_path=version_folder)
+            transformer = pipeline.create_transformer(**steps[index])
+            pipeline.add_transformer(transformer)
+            pipeline.set_input(folder_path=folder_path)
 
             pipeline_result = await pipeline.run_async(raise_exception=True)
-
             folder_path = pipeline_result.result_value["folder_path"]
 
-            ensure_folder(os.path.dirname(package_cache_path))
+            # once a step can't be cached, the results of the steps after it can't be either
+            cacheable = cacheable and transformer.cacheable
+            if cacheable and index < len(steps) - 1:
+                folder_path = await run_disk(step_cache.add, step_keys[index], folder_path, steps[index])
 
-            # TODO: write metadata
-            shutil.move(folder_path, package_cache_path)
+        return folder_path  # type: ignore
 
-        return package_cache_path
 
+async def plan_installs(pkgs: Mapping[str, ResolvePkg], fetch_metadata: bool = False, max_concurrency: int = 8, **input_values: Any) -> Dict[str, Dict[str, Any]]:
+    """Create install plans for many packages (check 'ResolvePkg.plan_install' for details).
 
+    Plans are created concurrently (at most 'max_concurrency' at a time). If a plan can't be created for a package, its
+    value contains the error message (under the 'error' key).
 
+    Args:
+        pkgs (Mapping): a map with package names as keys, and packages as values
+        fetch_metadata (bool): whether to retrieve package metadata that is not cached
+        max_concurrency (int): the maximum number of plans to create at the same time
+        input_values: the input for every package (e.g. 'version="latest"')
+
+    Returns:
+        Dict: a map with package names as keys, and plans as values (in the same order as 'pkgs')
+    """
+
+    results: Dict[str, Dict[str, Any]] = {}
+    semaphore = create_semaphore(max_concurrency)
+
+    async def plan(name: str, pkg: ResolvePkg):
+        async with semaphore:
+            try:
+                results[name] = await pkg.plan_install(fetch_metadata=fetch_metadata, **input_values)
+            except Exception as e:
+                log.debug(f"Can't create install plan for package '{name}'.", exc_info=True)
+                results[name] = {"error": str(e)}
+
+    async with create_task_group() as tg:
+        for name, pkg in pkgs.items():
+            await tg.spawn(plan, name, pkg)
+
+    return {name: results[name] for name in pkgs.keys()}
+
+
+async def warm_pkgs(pkgs: Mapping[str, ResolvePkg], version_folders: bool = False, max_concurrency: int = 8, progress: Optional[Callable[[Mapping[str, Any], int, int], None]] = None, **input_values: Any) -> List[Dict[str, Any]]:
+    """Fill the caches for many packages, so later calls don't have to retrieve metadata or clone repositories.
+
+    Packages that share a source (same 'get_unique_source_id') are only warmed once. Sources are warmed concurrently
+    (at most 'max_concurrency' at a time), a failure for one source doesn't stop the others.
+
+    Args:
+        pkgs (Mapping): a map with package names as keys, and packages as values
+        version_folders (bool): whether to also create the version folder for the version that matches 'input_values'
+        max_concurrency (int): the maximum number of sources to warm at the same time
+        progress (Callable): called with the result for a source, the number of finished sources, and the total number
+        input_values: the input to select the version (only used if 'version_folders' is True)
+
+    Returns:
+        List: one result per source (in order of completion), with the keys 'source_id', 'pkgs' (the package names),
+            'success', 'error' and 'seconds'
+    """
 
+    results: List[Dict[str, Any]] = []
+    sources: Dict[str, List[str]] = {}
+    for name, pkg in pkgs.items():
+        try:
+            source_id = pkg.version_source.get_unique_source_id()
+        except Exception as e:
+            log.debug(f"Can't create version source for package '{name}'.", exc_info=True)
+            results.append({"source_id": None, "pkgs": [name], "success": False, "error": str(e), "seconds": 0.0})
+            continue
+        sources.setdefault(source_id, []).append(name)
+
+    total = len(sources) + len(results)
+    semaphore = create_semaphore(max_concurrency)
+
+    async def warm(source_id: str, names: List[str]):
+
+        version_source = pkgs[names[0]].version_source
+        result: Dict[str, Any] = {"source_id": source_id, "pkgs": names, "success": True, "error": None}
+        async with semaphore:
+            start = time.time()
+            try:
+                version = None
+                if version_folders:
+                    version = await version_source.find_matching_version(**input_values)
+                await version_source.warm(version=version)
+            except Exception as e:
+                log.debug(f"Can't warm caches for source '{source_id}'.", exc_info=True)
+                result["success"] = False
+                result["error"] = str(e)
+            result["seconds"] = time.time() - start
+
+        results.append(result)
+        if progress is not None:
+            progress(result, len(results), total)
+
+    async with create_task_group() as tg:
+        for source_id, names in sources.items():
+            await tg.spawn(warm, source_id, names)
+
+    return results
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Portable archives of packages in the install cache.
+
+An archive is a gzipped tar file that contains the manifest of a package (as first member, 'manifest.json'), and the
+package folder ('package_data/...'). Importing an archive on another node puts the package into the same location of
+that node's install cache, so installing the package version there is a cache hit.
+
+Every file is verified against the sha256 in the manifest while it is extracted, and the package only becomes visible
+in the install cache once all of it is extracted and verified.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from typing import Any, Dict, Mapping
+
+from bring.defaults import BRING_PKG_DATA_FOLDER_NAME, BRING_PKG_INSTALL_FOLDER, BRING_PKG_MANIFEST_FILE_NAME
+from bring.pkg.manifest import parse_manifest, publish_package
+from bring.utils.executors import run_disk
+from bring.utils.locks import cache_lock
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+
+
+log = logging.getLogger("bring")
+
+ARCHIVE_EXTENSION = ".bring.tar.gz"
+
+_CHUNK_SIZE = 256 * 1024
+
+
+def pack_package(package_cache_path: str, manifest: Mapping[str, Any], target_file: str) -> str:
+    """Write a package folder from the install cache, and its manifest, into an archive."""
+
+    ensure_folder(os.path.dirname(os.path.abspath(target_file)))
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_file)), prefix=".tmp_")
+    os.close(fd)
+
+    try:
+        with tarfile.open(temp_file, "w:gz") as tar:
+            manifest_data = json.dumps(manifest).encode("utf-8")
+            info = tarfile.TarInfo(BRING_PKG_MANIFEST_FILE_NAME)
+            info.size = len(manifest_data)
+            tar.addfile(info, io.BytesIO(manifest_data))
+
+            for rel_path in list(manifest["folders"]) + list(manifest["files"].keys()) + list(manifest["links"].keys()):
+                path = os.path.join(package_cache_path, *rel_path.split("/"))
+                tar.add(path, arcname=f"{BRING_PKG_DATA_FOLDER_NAME}/{rel_path}", recursive=False)
+
+        os.replace(temp_file, target_file)
+    finally:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+
+    return target_file
+
+
+def _get_relative_path(member: tarfile.TarInfo, archive_file: str) -> str:
+
+    prefix = f"{BRING_PKG_DATA_FOLDER_NAME}/"
+    if not member.name.startswith(prefix):
+        raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Unexpected archive member: {member.name}")
+
+    rel_path = member.name[len(prefix):].rstrip("/")
+    parts = rel_path.split("/")
+    if not rel_path or any(p in ["", ".", ".."] for p in parts):
+        raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Invalid path in archive: {member.name}")
+    return rel_path
+
+
+def _extract_package(archive_file: str, target_folder: str, manifest: Mapping[str, Any]) -> None:
+
+    files: Mapping[str, Mapping[str, Any]] = manifest["files"]
+    links: Mapping[str, str] = manifest["links"]
+    extracted = set()
+    pending_links: Dict[str, str] = {}
+
+    with tarfile.open(archive_file, "r:gz") as tar:
+        for member in tar:
+            if member.name == BRING_PKG_MANIFEST_FILE_NAME:
+                continue
+            rel_path = _get_relative_path(member, archive_file)
+            path = os.path.join(target_folder, *rel_path.split("/"))
+
+            if member.isdir():
+                ensure_folder(path)
+            elif member.issym():
+                if links.get(rel_path, None) != member.linkname:
+                    raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Symbolic link not in manifest: {rel_path}")
+                # created last, so no file can be written through a link
+                pending_links[rel_path] = member.linkname
+            elif member.isfile():
+                expected = files.get(rel_path, None)
+                if expected is None:
+                    raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"File not in manifest: {rel_path}")
+
+                ensure_folder(os.path.dirname(path))
+                hasher = hashlib.sha256()
+                source = tar.extractfile(member)
+                with open(path, "wb") as f:
+                    while True:
+                        chunk = source.read(_CHUNK_SIZE)  # type: ignore
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        f.write(chunk)
+                if hasher.hexdigest() != expected["sha256"]:
+                    raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Checksum mismatch for file: {rel_path}")
+                os.chmod(path, expected["mode"])
+                extracted.add(rel_path)
+            else:
+                raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Unsupported archive member type: {member.name}")
+
+    missing = set(files.keys()) - extracted
+    if missing or set(links.keys()) != set(pending_links.keys()):
+        raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Archive is incomplete, missing: {', '.join(sorted(missing | (set(links.keys()) - set(pending_links.keys()))))}")
+
+    for rel_path, link_target in pending_links.items():
+        path = os.path.join(target_folder, *rel_path.split("/"))
+        ensure_folder(os.path.dirname(path))
+        os.symlink(link_target, path)
+
+
+def read_archive_manifest(archive_file: str) -> Dict[str, Any]:
+    """Return the manifest of a package archive."""
+
+    with tarfile.open(archive_file, "r:gz") as tar:
+        member = tar.next()
+        if member is None or member.name != BRING_PKG_MANIFEST_FILE_NAME or not member.isfile():
+            raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Not a package archive, '{BRING_PKG_MANIFEST_FILE_NAME}' must be the first member.")
+        try:
+            data = json.load(tar.extractfile(member))  # type: ignore
+        except ValueError as e:
+            raise FrklException(msg=f"Can't import package archive: {archive_file}", reason=f"Invalid manifest: {e}")
+
+    return parse_manifest(data, archive_file)
+
+
+def get_install_path(manifest: Mapping[str, Any], install_folder: str = BRING_PKG_INSTALL_FOLDER) -> str:
+    """Return the location of the package a manifest describes in the install cache."""
+
+    return os.path.join(install_folder, manifest["version_id"], manifest["transform_hash"], BRING_PKG_DATA_FOLDER_NAME)
+
+
+async def unpack_package(archive_file: str, install_folder: str = BRING_PKG_INSTALL_FOLDER) -> str:
+    """Import a package archive into the install cache, and return the path of the package folder.
+
+    Nothing is changed if the package is already in the install cache.
+    """
+
+    manifest = await run_disk(read_archive_manifest, archive_file)
+    package_cache_path = get_install_path(manifest, install_folder=install_folder)
+
+    if os.path.exists(package_cache_path):
+        return package_cache_path
+
+    async with cache_lock(package_cache_path):
+        if not os.path.exists(package_cache_path):
+            await run_disk(import_package, archive_file, manifest, package_cache_path)
+
+    log.debug(f"Imported package archive '{archive_file}': {package_cache_path}")
+    return package_cache_path
+
+
+def import_package(archive_file: str, manifest: Mapping[str, Any], package_cache_path: str) -> None:
+    """Extract a package archive into the install cache, verifying every file against the provided manifest.
+
+    Callers need to hold the lock for the package path (check 'bring.utils.locks.cache_lock').
+    """
+
+    parent_folder = os.path.dirname(package_cache_path)
+    ensure_folder(parent_folder)
+    temp_folder = tempfile.mkdtemp(dir=parent_folder, prefix=".tmp_")
+    try:
+        _extract_package(archive_file, temp_folder, manifest)
+    except Exception:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+        raise
+    publish_package(temp_folder, package_cache_path, manifest)
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Binary caches: locations that serve prebuilt packages, so nodes don't have to build them.
+
+A binary cache is a local folder (e.g. on a shared filesystem) or a plain http(s) server that serves a folder, with two
+files per package, named after the package id ('calculate_package_id'):
+
+- '<package id>.manifest.json': the package manifest (check 'bring.pkg.manifest'), with the sha256 of the archive
+  ('archive_sha256') and, optionally, a signature ('signature')
+- '<package id>.bring.tar.gz': the package archive (check 'bring.pkg.archive')
+
+Binary cache folders can be filled with 'bring pack --binary-cache'.
+
+The binary caches to use are configured with the 'binary_caches' setting (a comma-separated list of folders and urls),
+and are tried in that order. If the 'binary_cache_key' setting is set, manifests must carry a valid HMAC-SHA256
+signature created with that key, and packages with a missing or invalid signature are ignored. In any case, every file
+is verified against the manifest when the archive is extracted.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import tempfile
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Mapping, Optional
+
+from bring.config.settings import get_setting
+from bring.pkg.archive import ARCHIVE_EXTENSION, get_install_path, import_package, read_archive_manifest
+from bring.pkg.manifest import hash_file, parse_manifest
+from bring.utils.downloads import DOWNLOAD_TIMEOUT, download_file
+from bring.utils.executors import run_disk
+from bring.utils.metrics import BINARY_CACHE_HITS, BINARY_CACHE_MISSES
+from frkl.common.exceptions import FrklException
+
+
+log = logging.getLogger("bring")
+
+MANIFEST_EXTENSION = ".manifest.json"
+
+
+def get_binary_caches() -> List[str]:
+    """Return the configured binary cache locations (setting: 'binary_caches'), in the order they are tried."""
+
+    value = get_setting("binary_caches")
+    return [location.strip() for location in value.split(",") if location.strip()]
+
+
+def _is_remote(location: str) -> bool:
+
+    return location.startswith("http://") or location.startswith("https://")
+
+
+def _join(location: str, file_name: str) -> str:
+
+    if _is_remote(location):
+        return f"{location.rstrip('/')}/{file_name}"
+    return os.path.join(os.path.expanduser(location), file_name)
+
+
+def _canonical(manifest: Mapping[str, Any]) -> bytes:
+
+    data = {k: v for k, v in manifest.items() if k != "signature"}
+    return json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def sign_manifest(manifest: Mapping[str, Any], key: str) -> str:
+
+    return hmac.new(key.encode("utf-8"), _canonical(manifest), hashlib.sha256).hexdigest()
+
+
+def verify_manifest_signature(manifest: Mapping[str, Any], key: Optional[str] = None) -> bool:
+    """Check the signature of a binary cache manifest (with the 'binary_cache_key' setting, unless a key is provided).
+
+    Returns True if no key is configured, since signatures are optional in that case.
+    """
+
+    if key is None:
+        key = get_setting("binary_cache_key")
+    if not key:
+        return True
+
+    signature = manifest.get("signature", None)
+    if not isinstance(signature, str):
+        return False
+    return hmac.compare_digest(signature, sign_manifest(manifest, key))
+
+
+def add_to_binary_cache(archive_file: str) -> str:
+    """Write the binary cache manifest for a package archive (signed, if 'binary_cache_key' is set) next to it.
+
+    The archive needs to be named '<package id>.bring.tar.gz'.
+
+    Returns:
+        str: the path of the manifest
+    """
+
+    if not archive_file.endswith(ARCHIVE_EXTENSION):
+        raise FrklException(msg=f"Can't add package archive to binary cache: {archive_file}", reason=f"File name must end with '{ARCHIVE_EXTENSION}'.")
+
+    manifest = read_archive_manifest(archive_file)
+    manifest["archive_sha256"] = hash_file(archive_file)
+    key = get_setting("binary_cache_key")
+    if key:
+        manifest["signature"] = sign_manifest(manifest, key)
+
+    manifest_file = f"{archive_file[0:-len(ARCHIVE_EXTENSION)]}{MANIFEST_EXTENSION}"
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(manifest_file)), prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_file, manifest_file)
+
+    return manifest_file
+
+
+def _read_manifest(location: str, package_id: str) -> Optional[Any]:
+
+    manifest_url = _join(location, f"{package_id}{MANIFEST_EXTENSION}")
+    if _is_remote(location):
+        try:
+            with urllib.request.urlopen(manifest_url, timeout=DOWNLOAD_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    try:
+        with open(manifest_url, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+async def _fetch_package(location: str, package_id: str, version_id: str, transform_hash: str, install_folder: str) -> Optional[str]:
+
+    data = await run_disk(_read_manifest, location, package_id)
+    if data is None:
+        return None
+
+    manifest = parse_manifest(data, location)
+    if manifest["version_id"] != version_id or manifest["transform_hash"] != transform_hash:
+        raise FrklException(msg=f"Can't use package '{package_id}' from binary cache: {location}", reason="Manifest is for a different package.")
+    if not verify_manifest_signature(manifest):
+        raise FrklException(msg=f"Can't use package '{package_id}' from binary cache: {location}", reason="Missing or invalid manifest signature.", solution="Check that the 'binary_cache_key' setting matches the key the package was signed with.")
+
+    archive_url = _join(location, f"{package_id}{ARCHIVE_EXTENSION}")
+    if _is_remote(location):
+        archive_file = await download_file(archive_url, sha256=manifest.get("archive_sha256", None))
+    else:
+        archive_file = archive_url
+
+    # files are verified against the (trusted) binary cache manifest, not the one inside the archive
+    package_cache_path = get_install_path(manifest, install_folder=install_folder)
+    await run_disk(import_package, archive_file, manifest, package_cache_path)
+    return package_cache_path
+
+
+async def fetch_from_binary_caches(package_id: str, version_id: str, transform_hash: str, install_folder: str, locations: Optional[List[str]] = None) -> Optional[str]:
+    """Try to import a prebuilt package from the binary caches into the install cache.
+
+    Callers need to hold the lock for the package path (check 'bring.utils.locks.cache_lock').
+
+    Locations are tried in order, a location that fails (unreachable, invalid signature, corrupt archive, ...) is
+    skipped. Remote locations are not used in offline mode.
+
+    Args:
+        package_id (str): the package id ('calculate_package_id')
+        version_id (str): the id of the package version
+        transform_hash (str): the transform hash of the package
+        install_folder (str): the install cache folder
+        locations (List): the binary cache locations (default: setting 'binary_caches')
+
+    Returns:
+        str: the path of the package in the install cache, or None if no binary cache has it
+    """
+
+    if locations is None:
+        locations = get_binary_caches()
+    if not locations:
+        return None
+
+    for location in locations:
+        if _is_remote(location) and get_setting("offline"):
+            continue
+        try:
+            path = await _fetch_package(location, package_id, version_id, transform_hash, install_folder)
+        except Exception as e:
+            log.warning(f"Can't use binary cache '{location}' for package '{package_id}': {e}")
+            continue
+        if path is not None:
+            log.debug(f"Using package '{package_id}' from binary cache: {location}")
+            BINARY_CACHE_HITS.inc()
+            return path
+
+    BINARY_CACHE_MISSES.inc()
+    return None
+
+
+def plan_binary_caches(package_id: str, locations: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Report whether a package is available from the binary caches, without downloading anything.
+
+    Only local binary caches are checked, so the status is 'unknown' if a remote binary cache would have to be asked.
+    """
+
+    if locations is None:
+        locations = get_binary_caches()
+
+    unknown = False
+    for location in locations:
+        if _is_remote(location):
+            unknown = unknown or not get_setting("offline")
+            continue
+        manifest = _read_manifest(location, package_id)
+        if manifest is not None:
+            return {"layer": "binary_cache", "status": "hit", "path": location, "copy_bytes": manifest.get("size", None)}
+
+    return {"layer": "binary_cache", "status": "unknown" if unknown else "miss"}
+
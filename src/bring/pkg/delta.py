@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""File-level deltas between packages, to update target folders in time proportional to the change.
+
+A delta is computed from two package manifests (check 'bring.pkg.manifest'), so only the hashes, sizes and modes of
+files are compared, nothing is read from disk. It lists the folders, files and symbolic links that were added, changed or
+removed, and the files that only changed their mode.
+
+Applying a delta to a target folder is a transaction:
+
+- every file the delta touches is verified against the old manifest first (so local changes are not overwritten
+  silently), nothing is changed if that fails
+- new content is copied into a staging folder inside the target folder (from the new package in the install cache,
+  verified against the new manifest)
+- changes are then applied with renames; replaced and removed files are moved into a backup folder, and if anything
+  fails, every change is undone in reverse order
+- every change is written to a journal (in the staging folder) before it is made, and the transaction is marked as
+  committed in the journal once all changes are made: if the process dies in between, the next update of the target
+  folder undoes the changes of the unfinished transaction first (but there is no protection against power loss, since
+  nothing is synced to disk)
+
+Only one update of a target folder can run at a time (there is a lock in '<target>/.bring/'). Files in the target folder
+that are not part of the delta are never touched, so several packages can be installed into the same target folder, as
+long as they don't share paths; a package folder that is replaced by a file or symbolic link is a conflict if it
+contains anything else. Which package version is installed into a target folder is recorded in
+'<target>/.bring/<package name>.json' (the manifest of the package), which is updated as part of the transaction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+from bring.defaults import BRING_TARGET_STATE_FOLDER_NAME
+from bring.utils.locks import LOCK_FILE_EXTENSION, FileLease
+from frkl.common.exceptions import FrklException
+
+
+log = logging.getLogger("bring")
+
+_CHUNK_SIZE = 256 * 1024
+
+_WORK_FOLDER_PREFIX = ".tmp_bring_delta_"
+_JOURNAL_FILE_NAME = "journal"
+
+
+def compute_delta(old_manifest: Optional[Mapping[str, Any]], new_manifest: Mapping[str, Any]) -> Dict[str, Any]:
+    """Compute the changes from one package to another, using their manifests.
+
+    Args:
+        old_manifest (Mapping): the manifest of the package to update from (None: an empty folder)
+        new_manifest (Mapping): the manifest of the package to update to
+
+    Returns:
+        Dict: the delta, with the keys 'from', 'to', 'folders_added', 'folders_removed', 'files_added', 'files_changed',
+            'files_removed', 'modes_changed', 'links_added', 'links_changed', 'links_removed', 'previous' (the old
+            manifest entries of changed files), 'unchanged' (the number of files and links that stay the same) and
+            'copy_bytes'
+    """
+
+    if old_manifest is None:
+        old_manifest = {"folders": [], "files": {}, "links": {}}
+
+    old_folders = set(old_manifest["folders"])
+    new_folders = set(new_manifest["folders"])
+    old_files: Mapping[str, Mapping[str, Any]] = old_manifest["files"]
+    new_files: Mapping[str, Mapping[str, Any]] = new_manifest["files"]
+    old_links: Mapping[str, str] = old_manifest["links"]
+    new_links: Mapping[str, str] = new_manifest["links"]
+
+    files_added: Dict[str, Mapping[str, Any]] = {}
+    files_changed: Dict[str, Mapping[str, Any]] = {}
+    modes_changed: Dict[str, Mapping[str, Any]] = {}
+    unchanged = 0
+    for rel_path, entry in new_files.items():
+        old_entry = old_files.get(rel_path, None)
+        if old_entry is None:
+            files_added[rel_path] = entry
+        elif old_entry["sha256"] != entry["sha256"] or old_entry["size"] != entry["size"]:
+            files_changed[rel_path] = entry
+        elif old_entry["mode"] != entry["mode"]:
+            modes_changed[rel_path] = entry
+        else:
+            unchanged = unchanged + 1
+
+    links_added: Dict[str, str] = {}
+    links_changed: Dict[str, str] = {}
+    for rel_path, link_target in new_links.items():
+        if rel_path not in old_links.keys():
+            links_added[rel_path] = link_target
+        elif old_links[rel_path] != link_target:
+            links_changed[rel_path] = link_target
+        else:
+            unchanged = unchanged + 1
+
+    return {
+        "from": None if "version_id" not in old_manifest.keys() else {"version_id": old_manifest["version_id"], "transform_hash": old_manifest["transform_hash"]},
+        "to": {"version_id": new_manifest["version_id"], "transform_hash": new_manifest["transform_hash"]},
+        # parents first when adding, children first when removing
+        "folders_added": sorted(new_folders - old_folders),
+        "folders_removed": sorted(old_folders - new_folders, reverse=True),
+        "files_added": files_added,
+        "files_changed": files_changed,
+        "files_removed": {k: v for k, v in old_files.items() if k not in new_files.keys()},
+        "modes_changed": modes_changed,
+        "links_added": links_added,
+        "links_changed": links_changed,
+        "links_removed": {k: v for k, v in old_links.items() if k not in new_links.keys()},
+        "previous": {k: old_files[k] for k in list(files_changed.keys()) + list(modes_changed.keys())},
+        "unchanged": unchanged,
+        "copy_bytes": sum(e["size"] for e in files_added.values()) + sum(e["size"] for e in files_changed.values()),
+    }
+
+
+def is_empty_delta(delta: Mapping[str, Any]) -> bool:
+
+    return not any(delta[key] for key in ["folders_added", "folders_removed", "files_added", "files_changed", "files_removed", "modes_changed", "links_added", "links_changed", "links_removed"])
+
+
+def _get_path(folder: str, rel_path: str) -> str:
+
+    parts = rel_path.split("/")
+    if not rel_path or any(p in ["", ".", ".."] for p in parts):
+        raise FrklException(msg=f"Can't apply package delta to: {folder}", reason=f"Invalid path: {rel_path}")
+    return os.path.join(folder, *parts)
+
+
+def _matches(path: str, entry: Mapping[str, Any]) -> bool:
+
+    try:
+        details = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(details.st_mode) or details.st_size != entry["size"]:
+        return False
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest() == entry["sha256"]
+
+
+def _check_target(delta: Mapping[str, Any], target_folder: str) -> List[str]:
+    """Return the paths of the target folder that don't have the state the delta expects."""
+
+    conflicts = []
+    for rel_path, entry in list(delta["files_removed"].items()) + list(delta["previous"].items()):
+        if not _matches(_get_path(target_folder, rel_path), entry):
+            conflicts.append(rel_path)
+    for rel_path, link_target in list(delta["links_removed"].items()) + list(delta["links_changed"].items()):
+        path = _get_path(target_folder, rel_path)
+        if not os.path.islink(path):
+            conflicts.append(rel_path)
+        elif rel_path in delta["links_removed"].keys() and os.readlink(path) != link_target:
+            conflicts.append(rel_path)
+    # paths that change their type (e.g. from symbolic link to file) are removed before they are added
+    removed = set(delta["files_removed"].keys()) | set(delta["links_removed"].keys()) | set(delta["folders_removed"])
+    for rel_path in list(delta["files_added"].keys()) + list(delta["links_added"].keys()):
+        path = _get_path(target_folder, rel_path)
+        if rel_path not in removed:
+            if os.path.lexists(path):
+                conflicts.append(rel_path)
+        elif os.path.isdir(path) and not os.path.islink(path):
+            # a folder that is replaced must not contain anything that isn't removed with it
+            for root, dirs, files in os.walk(path):
+                for name in dirs + files:
+                    child = os.path.relpath(os.path.join(root, name), target_folder).replace(os.sep, "/")
+                    if child not in removed:
+                        conflicts.append(child)
+
+    return sorted(conflicts)
+
+
+class _Transaction(object):
+    """Changes to a folder that can be undone, with staging and backup folders inside it (so renames are atomic).
+
+    Every change is recorded in a journal before it is made, so it can also be undone by another process
+    ('recover_target'). Undoing a change checks whether it was made, so that is safe for the last journal entry too.
+    """
+
+    def __init__(self, target_folder: str):
+
+        self._target_folder: str = target_folder
+        self._work_folder: str = tempfile.mkdtemp(dir=target_folder, prefix=_WORK_FOLDER_PREFIX)
+        self._journal = open(os.path.join(self._work_folder, _JOURNAL_FILE_NAME), "w")
+        self._undo: List[Tuple[str, str, Any]] = []
+        self._counter: int = 0
+
+    def _temp_path(self) -> str:
+
+        self._counter = self._counter + 1
+        return os.path.join(self._work_folder, str(self._counter))
+
+    def _record(self, action: str, path: str, arg: Any) -> None:
+
+        self._journal.write(json.dumps([action, path, arg]) + "\n")
+        self._journal.flush()
+        self._undo.append((action, path, arg))
+
+    def stage_file(self, source: str, entry: Mapping[str, Any]) -> str:
+
+        staged = self._temp_path()
+        hasher = hashlib.sha256()
+        with open(source, "rb") as src, open(staged, "wb") as dst:
+            while True:
+                chunk = src.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                dst.write(chunk)
+        if hasher.hexdigest() != entry["sha256"]:
+            raise FrklException(msg=f"Can't apply package delta to: {self._target_folder}", reason=f"Checksum mismatch for source file: {source}")
+        os.chmod(staged, entry["mode"])
+        return staged
+
+    def stage_link(self, link_target: str) -> str:
+
+        staged = self._temp_path()
+        os.symlink(link_target, staged)
+        return staged
+
+    def stage_data(self, data: bytes) -> str:
+
+        staged = self._temp_path()
+        with open(staged, "wb") as f:
+            f.write(data)
+        return staged
+
+    def remove(self, path: str) -> None:
+
+        if not os.path.lexists(path):
+            return
+        if os.path.isdir(path) and not os.path.islink(path):
+            # whatever is left in it is not part of the package
+            raise FrklException(msg=f"Can't apply package delta to: {self._target_folder}", reason=f"Folder contains files that are not part of the package: {path}")
+        backup = self._temp_path()
+        self._record("restore", path, backup)
+        os.rename(path, backup)
+
+    def put(self, staged: str, path: str) -> None:
+
+        self.remove(path)
+        self._record("remove", path, staged)
+        os.rename(staged, path)
+
+    def mkdir(self, path: str) -> None:
+
+        if os.path.isdir(path):
+            return
+        self._record("rmdir", path, None)
+        os.mkdir(path)
+
+    def rmdir(self, path: str) -> None:
+
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            return
+        self._record("mkdir", path, mode)
+        try:
+            os.rmdir(path)
+        except OSError:
+            log.warning(f"Not removing folder that contains files which are not part of the package: {path}")
+
+    def chmod(self, path: str, mode: int) -> None:
+
+        old_mode = stat.S_IMODE(os.stat(path).st_mode)
+        self._record("chmod", path, old_mode)
+        os.chmod(path, mode)
+
+    def commit(self) -> None:
+
+        self._journal.write(json.dumps(["commit", None, None]) + "\n")
+        self._journal.flush()
+        self._undo = []
+
+    def rollback(self) -> None:
+
+        _undo_changes(self._undo)
+        self._undo = []
+
+    def cleanup(self) -> None:
+
+        self._journal.close()
+        shutil.rmtree(self._work_folder, ignore_errors=True)
+
+
+def _undo_changes(changes: List[Tuple[str, str, Any]]) -> None:
+
+    for action, path, arg in reversed(changes):
+        try:
+            if action == "restore":
+                # arg: the backup, only exists if the original was moved
+                if os.path.lexists(arg) and not os.path.lexists(path):
+                    os.rename(arg, path)
+            elif action == "remove":
+                # arg: the staged path, only gone if it was moved into place
+                if not os.path.lexists(arg) and os.path.lexists(path):
+                    os.unlink(path)
+            elif action == "rmdir":
+                if os.path.isdir(path):
+                    os.rmdir(path)
+            elif action == "mkdir":
+                if not os.path.lexists(path):
+                    os.mkdir(path, arg)
+            elif action == "chmod":
+                if os.path.lexists(path):
+                    os.chmod(path, arg)
+        except Exception as e:
+            log.error(f"Can't undo change to '{path}' ({action}): {e}")
+
+
+def recover_target(target_folder: str) -> int:
+    """Undo the changes of updates of a target folder that didn't finish (e.g. because the process died).
+
+    Must only be called while holding the update lock of the target folder.
+
+    Returns:
+        int: the number of transactions that were rolled back
+    """
+
+    try:
+        names = os.listdir(target_folder)
+    except FileNotFoundError:
+        return 0
+
+    recovered = 0
+    for name in sorted(names):
+        if not name.startswith(_WORK_FOLDER_PREFIX):
+            continue
+        work_folder = os.path.join(target_folder, name)
+
+        changes: List[Tuple[str, str, Any]] = []
+        committed = False
+        try:
+            with open(os.path.join(work_folder, _JOURNAL_FILE_NAME), "r") as f:
+                for line in f:
+                    try:
+                        action, path, arg = json.loads(line)
+                    except ValueError:
+                        # partially written last entry, the change was not made
+                        break
+                    if action == "commit":
+                        committed = True
+                        break
+                    changes.append((action, path, arg))
+        except FileNotFoundError:
+            pass
+
+        if not committed and changes:
+            log.warning(f"Rolling back unfinished update of target folder: {target_folder}")
+            _undo_changes(changes)
+            recovered = recovered + 1
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    return recovered
+
+
+@contextmanager
+def _lock_target(target_folder: str) -> Iterator[None]:
+
+    lock = FileLease(os.path.join(target_folder, BRING_TARGET_STATE_FOLDER_NAME, f"update{LOCK_FILE_EXTENSION}"))
+    if not lock.try_acquire():
+        lease = lock.read_lease() or {}
+        raise FrklException(
+            msg=f"Can't update target folder: {target_folder}",
+            reason=f"Another update is in progress (node: {lease.get('node')}, pid: {lease.get('pid')}).",
+            solution="Wait for the other update to finish. If it has died, its lock expires after 'lease_seconds'.",
+        )
+    try:
+        recover_target(target_folder)
+        yield
+    finally:
+        lock.release()
+
+
+def get_target_state_path(target_folder: str, name: str) -> str:
+    """Return the path of the file that records which version of a package is installed into a target folder."""
+
+    if not name or "/" in name or os.sep in name or name in [".", ".."]:
+        raise FrklException(msg=f"Can't use package name for target folder: {target_folder}", reason=f"Invalid name: {name}")
+    return os.path.join(target_folder, BRING_TARGET_STATE_FOLDER_NAME, f"{name}.json")
+
+
+def read_target_state(target_folder: str, name: str) -> Optional[Dict[str, Any]]:
+    """Return the manifest of the package version that is installed into a target folder, or None."""
+
+    path = get_target_state_path(target_folder, name)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise FrklException(msg=f"Can't read state of target folder: {target_folder}", reason=f"Invalid file '{path}': {e}")
+
+
+def apply_delta(delta: Mapping[str, Any], source_folder: str, target_folder: str, force: bool = False, state: Optional[Tuple[str, Mapping[str, Any]]] = None) -> None:
+    """Apply a delta to a target folder, as a transaction: either all changes are applied, or none.
+
+    If the process dies while the delta is applied, the changes are undone by the next update of the target folder.
+
+    Args:
+        delta (Mapping): the delta ('compute_delta')
+        source_folder (str): the folder of the new package (e.g. in the install cache), new content is copied from there
+        target_folder (str): the folder to update
+        force (bool): overwrite or remove files in the target folder even if they don't match what the delta expects
+        state (Tuple): the package name and the new manifest, to record in the target folder
+    """
+
+    os.makedirs(target_folder, exist_ok=True)
+    with _lock_target(target_folder):
+        _apply_delta(delta, source_folder, target_folder, force=force, state=state)
+
+
+def _apply_delta(delta: Mapping[str, Any], source_folder: str, target_folder: str, force: bool, state: Optional[Tuple[str, Mapping[str, Any]]]) -> None:
+
+    if not force:
+        conflicts = _check_target(delta, target_folder)
+        if conflicts:
+            listed = ", ".join(conflicts[0:10]) + (", ..." if len(conflicts) > 10 else "")
+            raise FrklException(
+                msg=f"Can't apply package delta to: {target_folder}",
+                reason=f"Files in the target folder were changed, or don't belong to the package: {listed}",
+                solution="Restore the files, or force the update to overwrite them.",
+            )
+
+    transaction = _Transaction(target_folder)
+    try:
+        # stage first, so nothing is changed if the new content can't be read
+        staged: Dict[str, str] = {}
+        for key in ["files_added", "files_changed"]:
+            for rel_path, entry in delta[key].items():
+                staged[rel_path] = transaction.stage_file(_get_path(source_folder, rel_path), entry)
+        for key in ["links_added", "links_changed"]:
+            for rel_path, link_target in delta[key].items():
+                staged[rel_path] = transaction.stage_link(link_target)
+        if state is not None:
+            name, manifest = state
+            staged_state = transaction.stage_data(json.dumps(manifest).encode("utf-8"))
+
+        for rel_path in list(delta["files_removed"].keys()) + list(delta["links_removed"].keys()):
+            transaction.remove(_get_path(target_folder, rel_path))
+        for rel_path in delta["folders_removed"]:
+            transaction.rmdir(_get_path(target_folder, rel_path))
+
+        for rel_path in delta["folders_added"]:
+            transaction.mkdir(_get_path(target_folder, rel_path))
+        for rel_path, staged_path in staged.items():
+            path = _get_path(target_folder, rel_path)
+            # the folder might only exist in the target folder of a forced update
+            if force:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            transaction.put(staged_path, path)
+
+        for rel_path, entry in delta["modes_changed"].items():
+            path = _get_path(target_folder, rel_path)
+            if os.stat(path).st_nlink > 1:
+                # don't change the mode of files this one is hard-linked to (e.g. in the install cache)
+                transaction.put(transaction.stage_file(path, entry), path)
+            else:
+                transaction.chmod(path, entry["mode"])
+
+        if state is not None:
+            state_path = get_target_state_path(target_folder, name)
+            transaction.mkdir(os.path.dirname(state_path))
+            transaction.put(staged_state, state_path)
+
+        transaction.commit()
+    except BaseException:
+        transaction.rollback()
+        raise
+    finally:
+        transaction.cleanup()
+
+
+def update_target(package_cache_path: str, manifest: Mapping[str, Any], target_folder: str, name: str, force: bool = False) -> Dict[str, Any]:
+    """Update a target folder to a package, changing only what differs from the version that was installed there before.
+
+    Args:
+        package_cache_path (str): the package folder in the install cache
+        manifest (Mapping): the manifest of the package
+        target_folder (str): the folder to update (it is created if it doesn't exist)
+        name (str): the name of the package (several packages can be installed into the same target folder)
+        force (bool): overwrite or remove files in the target folder even if they don't match the installed version
+
+    Returns:
+        Dict: the delta that was applied
+    """
+
+    os.makedirs(target_folder, exist_ok=True)
+    with _lock_target(target_folder):
+        old_manifest = read_target_state(target_folder, name)
+        delta = compute_delta(old_manifest, manifest)
+
+        if is_empty_delta(delta) and old_manifest is not None and delta["from"] == delta["to"]:
+            return delta
+
+        _apply_delta(delta, package_cache_path, target_folder, force=force, state=(name, manifest))
+    return delta
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Installation of packages into target paths as link farms, switched between versions by replacing a symbolic link.
+
+Instead of copying a package out of the install cache, a 'link farm' is created for it next to the target path (in
+'<parent>/.bring/versions/<target name>/'): a folder with the same structure as the package, whose files are links to
+(or cheap copies of) the files in the install cache. The target path itself is a symbolic link to the link farm of the
+installed version, and is replaced atomically to switch versions, so processes only ever see one complete version.
+Link farms of previously installed versions are kept (setting: 'target_keep_versions'), switching back to one of
+those only replaces the symbolic link, no matter how large the package is.
+
+Link modes:
+
+- 'symlink': files are symbolic links to the install cache (the install cache must not be cleaned up while the package
+  is in use)
+- 'hardlink': files share their content with the install cache (the install cache and the target must be on the same
+  filesystem; files must not be modified in place, since that would change the install cache as well)
+- 'reflink': copy-on-write clones of the files in the install cache (Linux, on filesystems that support it, e.g.
+  btrfs or xfs)
+- 'copy': regular copies
+- 'auto' (default): reflinks, falling back to hardlinks, falling back to copies, whatever the filesystems support
+"""
+
+import errno
+import json
+import logging
+import os
+import shutil
+import sys
+import uuid
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from bring.config.settings import get_setting
+from bring.defaults import BRING_TARGET_STATE_FOLDER_NAME
+from bring.pkg.delta import get_target_state_path
+from bring.utils.filesystem import publish_path
+from frkl.common.exceptions import FrklException
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+
+log = logging.getLogger("bring")
+
+LINK_MODES = ["auto", "symlink", "hardlink", "reflink", "copy"]
+
+_FICLONE = 0x40049409
+"""Linux ioctl to clone a file (copy-on-write)."""
+
+
+def _reflink_file(source: str, target: str, mode: int) -> None:
+
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+
+    with open(source, "rb") as src:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+        try:
+            fcntl.ioctl(fd, _FICLONE, src.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(target)
+            raise
+        os.close(fd)
+    os.chmod(target, mode)
+
+
+def _hardlink_file(source: str, target: str, mode: int) -> None:
+
+    os.link(source, target)
+
+
+def _symlink_file(source: str, target: str, mode: int) -> None:
+
+    os.symlink(os.path.abspath(source), target)
+
+
+def _copy_file(source: str, target: str, mode: int) -> None:
+
+    shutil.copyfile(source, target)
+    os.chmod(target, mode)
+
+
+_LINK_FUNCTIONS: Mapping[str, Callable[[str, str, int], None]] = {
+    "symlink": _symlink_file,
+    "hardlink": _hardlink_file,
+    "reflink": _reflink_file,
+    "copy": _copy_file,
+}
+
+_AUTO_LINK_MODES = ["reflink", "hardlink", "copy"]
+
+
+def _get_link_mode(link_mode: Optional[str]) -> str:
+
+    if link_mode is None:
+        link_mode = get_setting("target_link_mode")
+    if link_mode not in LINK_MODES:
+        raise FrklException(msg=f"Invalid link mode: {link_mode}", reason=f"Valid link modes: {', '.join(LINK_MODES)}")
+    return link_mode
+
+
+def get_link_farms_folder(target: str) -> str:
+    """Return the folder that contains the link farms of a target path."""
+
+    target = os.path.abspath(target)
+    return os.path.join(os.path.dirname(target), BRING_TARGET_STATE_FOLDER_NAME, "versions", os.path.basename(target))
+
+
+def get_link_farm_path(target: str, manifest: Mapping[str, Any], link_mode: str) -> str:
+    """Return the path of the link farm of a package version for a target path."""
+
+    return os.path.join(get_link_farms_folder(target), f"{manifest['version_id']}_{manifest['transform_hash']}_{link_mode}")
+
+
+def create_link_farm(package_cache_path: str, manifest: Mapping[str, Any], farm_path: str, name: str, link_mode: str) -> None:
+    """Create the link farm for a package in the install cache (does nothing if it exists already).
+
+    The farm is created in a temporary folder and published with a rename, so it is either complete, or doesn't exist.
+
+    Args:
+        package_cache_path (str): the package folder in the install cache
+        manifest (Mapping): the manifest of the package
+        farm_path (str): the path of the link farm
+        name (str): the name of the package, to record the installed version in the link farm
+        link_mode (str): how files are created (check the module documentation), 'auto' falls back per filesystem
+    """
+
+    if os.path.exists(farm_path):
+        return
+
+    modes: List[str] = list(_AUTO_LINK_MODES) if link_mode == "auto" else [link_mode]
+
+    temp_path = os.path.join(os.path.dirname(farm_path), f".tmp_{uuid.uuid4().hex}")
+    os.makedirs(temp_path)
+    try:
+        for rel_path in sorted(manifest["folders"]):
+            os.makedirs(os.path.join(temp_path, rel_path), exist_ok=True)
+
+        for rel_path, entry in manifest["files"].items():
+            source = os.path.join(package_cache_path, rel_path)
+            target = os.path.join(temp_path, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            while True:
+                try:
+                    _LINK_FUNCTIONS[modes[0]](source, target, entry["mode"])
+                    break
+                except OSError as e:
+                    if len(modes) == 1:
+                        raise FrklException(
+                            msg=f"Can't create link farm: {farm_path}",
+                            reason=f"Can't {modes[0]} '{source}': {e}",
+                            solution="Use another link mode (e.g. 'copy').",
+                        ) from e
+                    # not supported by the filesystem(s), no need to try again for the other files
+                    log.debug(f"Can't {modes[0]} '{source}', falling back to '{modes[1]}': {e}")
+                    modes.pop(0)
+
+        for rel_path, link_target in manifest["links"].items():
+            path = os.path.join(temp_path, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.symlink(link_target, path)
+
+        state_path = get_target_state_path(temp_path, name)
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        with open(state_path, "w") as f:
+            json.dump(manifest, f)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+    # another process might have published the same link farm in the meantime, which is just as good
+    publish_path(temp_path, farm_path)
+
+
+def _check_target(target: str) -> None:
+
+    if os.path.lexists(target) and not os.path.islink(target):
+        raise FrklException(
+            msg=f"Can't install package into: {target}",
+            reason="Path exists, and is not a symbolic link to a link farm.",
+            solution="Remove or move it, or use 'bring update' to update a folder in place.",
+        )
+
+
+def switch_target(target: str, farm_path: str) -> None:
+    """Point a target path to a link farm, atomically.
+
+    Raises:
+        FrklException: if the target path exists, and is not a symbolic link
+    """
+
+    target = os.path.abspath(target)
+    _check_target(target)
+
+    parent_folder = os.path.dirname(target)
+    temp_path = os.path.join(parent_folder, f".tmp_{uuid.uuid4().hex}")
+    os.symlink(os.path.relpath(farm_path, parent_folder), temp_path)
+    try:
+        # replaces the symbolic link itself, not what it points to
+        os.replace(temp_path, target)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    # mark as most recently used, so it is kept when older link farms are removed
+    os.utime(farm_path)
+
+
+def get_target_farm(target: str) -> Optional[str]:
+    """Return the link farm a target path points to, or None."""
+
+    target = os.path.abspath(target)
+    if not os.path.islink(target):
+        return None
+    return os.path.normpath(os.path.join(os.path.dirname(target), os.readlink(target)))
+
+
+def prune_link_farms(target: str, keep: Optional[int] = None) -> List[str]:
+    """Delete the least recently used link farms of a target path, except the one it points to.
+
+    Args:
+        target (str): the target path
+        keep (int): the number of link farms to keep (including the current one), default: setting 'target_keep_versions'
+
+    Returns:
+        List: the paths of the deleted link farms
+    """
+
+    if keep is None:
+        keep = get_setting("target_keep_versions")
+
+    farms_folder = get_link_farms_folder(target)
+    try:
+        names = os.listdir(farms_folder)
+    except FileNotFoundError:
+        return []
+
+    current = get_target_farm(target)
+    farms: Dict[str, float] = {}
+    for name in names:
+        if name.startswith(".tmp_"):
+            continue
+        path = os.path.join(farms_folder, name)
+        if path == current:
+            continue
+        try:
+            farms[path] = os.stat(path).st_mtime
+        except FileNotFoundError:
+            pass
+
+    keep_others = max(keep - (1 if current else 0), 0)
+    remove = sorted(farms.keys(), key=lambda p: farms[p], reverse=True)[keep_others:]
+    for path in remove:
+        shutil.rmtree(path, ignore_errors=True)
+    return remove
+
+
+def install_to_target(package_cache_path: str, manifest: Mapping[str, Any], target: str, name: str, link_mode: Optional[str] = None) -> str:
+    """Install a package from the install cache into a target path, as link farm.
+
+    Args:
+        package_cache_path (str): the package folder in the install cache
+        manifest (Mapping): the manifest of the package
+        target (str): the target path (must not exist, or be a symbolic link created by this function)
+        name (str): the name of the package
+        link_mode (str): how files are created, default: setting 'target_link_mode' (check the module documentation)
+
+    Returns:
+        str: the path of the link farm the target now points to
+    """
+
+    link_mode = _get_link_mode(link_mode)
+    # before creating a link farm that would never be used
+    _check_target(os.path.abspath(target))
+    farm_path = get_link_farm_path(target, manifest, link_mode)
+
+    create_link_farm(package_cache_path, manifest, farm_path, name, link_mode)
+    switch_target(target, farm_path)
+    prune_link_farms(target)
+
+    return farm_path
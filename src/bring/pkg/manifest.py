@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Manifests of packages in the install cache.
+
+A manifest lists every folder, file (with size, sha256 and permission bits) and symbolic link (with its target) of a
+package, using relative, '/'-separated paths, together with the version and transform hash the package was built from.
+It is written next to the package folder when the package is added to the install cache
+('<install cache>/<version id>/<transform hash>/manifest.json'), and is part of package archives (check
+'bring.pkg.archive').
+"""
+
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+from typing import Any, Dict, Mapping
+
+from bring.defaults import BRING_PKG_MANIFEST_FILE_NAME
+from bring.utils.filesystem import publish_path
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+
+
+MANIFEST_FORMAT = 1
+"""Increase this when the manifest structure changes in an incompatible way."""
+
+_CHUNK_SIZE = 256 * 1024
+
+
+def hash_file(path: str) -> str:
+
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def create_manifest(folder: str, version: Mapping[str, Any], transform_hash: str) -> Dict[str, Any]:
+    """Create the manifest for a package folder (this reads every file in it).
+
+    Args:
+        folder (str): the package folder
+        version (Mapping): the version the package was built from ('PkgVersion.to_dict()')
+        transform_hash (str): the hash of the transform configuration of the package
+    """
+
+    folders = []
+    files: Dict[str, Dict[str, Any]] = {}
+    links: Dict[str, str] = {}
+
+    for root, dir_names, file_names in os.walk(folder):
+        rel_root = os.path.relpath(root, folder)
+        for name in dir_names + file_names:
+            path = os.path.join(root, name)
+            rel_path = name if rel_root == "." else f"{rel_root.replace(os.sep, '/')}/{name}"
+            details = os.lstat(path)
+            if stat.S_ISLNK(details.st_mode):
+                links[rel_path] = os.readlink(path)
+            elif stat.S_ISDIR(details.st_mode):
+                folders.append(rel_path)
+            elif stat.S_ISREG(details.st_mode):
+                files[rel_path] = {"size": details.st_size, "sha256": hash_file(path), "mode": stat.S_IMODE(details.st_mode)}
+            else:
+                raise FrklException(msg=f"Can't create manifest for package folder: {folder}", reason=f"Unsupported file type: {rel_path}")
+
+    return {
+        "format": MANIFEST_FORMAT,
+        "version_id": version["id"],
+        "version": version,
+        "transform_hash": transform_hash,
+        "created": time.time(),
+        "size": sum(f["size"] for f in files.values()),
+        "folders": sorted(folders),
+        "files": {k: files[k] for k in sorted(files.keys())},
+        "links": {k: links[k] for k in sorted(links.keys())},
+    }
+
+
+def get_manifest_path(package_cache_path: str) -> str:
+    """Return the path of the manifest for a package folder in the install cache."""
+
+    return os.path.join(os.path.dirname(package_cache_path), BRING_PKG_MANIFEST_FILE_NAME)
+
+
+def parse_manifest(data: Any, source: str) -> Dict[str, Any]:
+    """Check that (deserialized) manifest data has the expected format, and return it."""
+
+    if not isinstance(data, Mapping) or data.get("format", None) != MANIFEST_FORMAT:
+        raise FrklException(msg=f"Can't read package manifest: {source}", reason=f"Invalid or unsupported manifest format (supported: {MANIFEST_FORMAT}).")
+
+    for key in ["version_id", "transform_hash"]:
+        value = data.get(key, None)
+        if not isinstance(value, str) or not value or value in [".", ".."] or "/" in value or os.sep in value:
+            raise FrklException(msg=f"Can't read package manifest: {source}", reason=f"Invalid value for '{key}': {value}")
+
+    return dict(data)
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except ValueError as e:
+        raise FrklException(msg=f"Can't read package manifest: {path}", reason=str(e))
+
+    return parse_manifest(data, path)
+
+
+def write_manifest(manifest: Mapping[str, Any], path: str) -> None:
+
+    ensure_folder(os.path.dirname(path))
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_file, path)
+
+
+def publish_package(folder: str, package_cache_path: str, manifest: Mapping[str, Any]) -> bool:
+    """Add a package folder and its manifest to the install cache.
+
+    The manifest is written first, so every package folder in the install cache has one.
+
+    Returns:
+        bool: False if the package was already in the install cache (in which case 'folder' is deleted)
+    """
+
+    if os.path.exists(package_cache_path):
+        return publish_path(folder, package_cache_path)
+
+    write_manifest(manifest, get_manifest_path(package_cache_path))
+    return publish_path(folder, package_cache_path)
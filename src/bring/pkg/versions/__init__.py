@@ -4,19 +4,31 @@ import pathlib
 import pickle
 import shutil
 import tempfile
+import time
 from abc import ABCMeta, abstractmethod
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from typing import Optional, Iterable, Mapping, Any, Set, Dict, List, MutableMapping, Union, Tuple
 import logging
+import anyio
 import arrow
 from anyio import open_file
 from deepdiff import DeepHash
 from tzlocal import get_localzone
 
-from bring.defaults import BRING_TEMP_CACHE, BRING_VERSIONS_DEFAULT_CACHE_CONFIG, \
+from bring.config.settings import get_setting
+from bring.defaults import BRING_VERSIONS_DEFAULT_CACHE_CONFIG, \
     BRING_PKG_VERSION_CACHE, BRING_VERSION_METADATA_FILE_NAME, BRING_RESULTS_FOLDER, BRING_PKG_VERSION_DATA_FOLDER_NAME, \
     BRING_PKG_METADATA_CACHE
 from bring.transform.pipeline import Pipeline
+from bring.utils.executors import run_cpu, run_disk
+from bring.utils.filesystem import get_folder_size, publish_path
+from bring.utils.locks import LOCK_FILE_EXTENSION, FileLease, cache_lock
+from bring.utils.lru import SizeLimitedLRU
+from bring.utils.metrics import VERSIONS_CACHE_HITS, VERSIONS_CACHE_MISSES, VERSIONS_MEMORY_CACHE_HITS, VERSIONS_RETRIEVALS_COALESCED, VERSIONS_RETRIEVAL_SECONDS, \
+    BYTES_COPIED, VERSION_FOLDER_SIZE
+from bring.utils.aliases import AliasTable
+from bring.utils.version_index import VersionIndex, is_range_constraint
+from bring.utils.version_resolver import VersionCandidate, VersionResolver
 from frkl.args.arg import RecordArg, explode_arg_dict
 from frkl.args.hive import ArgHive
 from frkl.common.async_utils import wrap_async_task
@@ -37,6 +49,36 @@ except:
 
 log = logging.getLogger("bring")
 
+RELEASE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+def get_release_date(metadata: Mapping[str, Any]) -> Optional[datetime]:
+    """Return the release date in the metadata of a version, as timezone-aware datetime (or None if it has none).
+
+    Version sources store the release date as 'release_time' (seconds since the epoch) and 'release_timezone' (offset
+    to UTC in seconds). Metadata cached by older versions of *bring* contains a 'release_date' string instead.
+    """
+
+    release_time = metadata.get("release_time", None)
+    if release_time is not None:
+        tz = timezone(timedelta(seconds=metadata.get("release_timezone", 0)))
+        return datetime.fromtimestamp(release_time, tz)
+
+    release_date = metadata.get("release_date", None)
+    if release_date is not None:
+        return arrow.get(release_date).datetime
+
+    return None
+
+
+def format_release_date(metadata: Mapping[str, Any], format: str = RELEASE_DATE_FORMAT) -> Optional[str]:
+    """Format the release date in the metadata of a version for display (or return None if it has none)."""
+
+    release_date = get_release_date(metadata)
+    if release_date is None:
+        return None
+    return release_date.strftime(format)
+
 
 class PkgVersion(object):
     def __init__(
@@ -85,6 +127,11 @@ class PkgVersion(object):
     def id_vars_names(self) -> Iterable[str]:
         return self.id_vars.keys()
 
+    @property
+    def aliases(self) -> Mapping[str, Mapping[Any, Any]]:
+        """Return the value aliases of this version (e.g. 'latest'), per variable name."""
+        return self._aliases
+
     @property
     def metadata(self) -> Mapping[str, Any]:
         return self._metadata
@@ -109,26 +156,15 @@ class PkgVersion(object):
         return self._steps_hash
 
     def match_score(self, **version_input: Any) -> int:
+        """Return the number of id vars that match the input (or 0 if any of them doesn't).
 
-        if not self._aliases:
-            translated_input = version_input
-        else:
-            translated_input = {}
-            for k, v in version_input.items():
-                if k not in self._aliases.keys():
-                    translated_input[k] = v
-                    continue
-
-                if v not in self._aliases[k].keys():
-                    translated_input[k] = v
-                    continue
-
-                translated_input[k] = self._aliases[k][v]
+        Aliases are not translated here, the input needs to be translated beforehand (check 'VersionSource.get_alias_table').
+        """
 
         score = 0
         for k, v in self.id_vars.items():
-            if k in translated_input.keys():
-                if v != translated_input[k]:
+            if k in version_input.keys():
+                if v != version_input[k]:
                     return 0
                 else:
                     score = score + 1
@@ -162,6 +198,36 @@ class PkgVersion(object):
         return result
 
 
+class _VersionsRetrieval(object):
+    """A version retrieval in progress, that other callers for the same package source wait for."""
+
+    def __init__(self):
+
+        self.event = anyio.create_event()
+        self.result: Optional[_LoadedVersions] = None
+        self.error: Optional[Exception] = None
+
+
+# version retrievals in progress in this process, by metadata cache path
+_RETRIEVALS: Dict[str, _VersionsRetrieval] = {}
+
+
+class _LoadedVersions(object):
+    """Versions loaded from a metadata cache file, shared by all version sources for the same package source."""
+
+    def __init__(self, versions: Iterable[PkgVersion], args: Mapping[str, Mapping[str, Any]], generation: Tuple[int, int]):
+
+        self.versions: Iterable[PkgVersion] = versions
+        self.args: Mapping[str, Mapping[str, Any]] = args
+        # (mtime_ns, size) of the cache file
+        self.generation: Tuple[int, int] = generation
+        self.version_indexes: Dict[str, VersionIndex] = {}
+
+
+# loaded versions by metadata cache path, the size of an entry is the size of its cache file
+_LOADED_VERSIONS = SizeLimitedLRU(max_size=lambda: get_setting("versions_memory_cache_max_size"))
+
+
 def get_version_sources_factory(tingistry: Tingistry):
 
     _pkg_type_conf: MutableMapping[str, Any] = {}
@@ -179,7 +245,13 @@ def get_version_sources_factory(tingistry: Tingistry):
 
 
 class VersionSource(metaclass=ABCMeta):
-    """Model to manage package source details."""
+    """Model to manage package source details.
+
+    Set the '_offline_capable' class attribute to True if '_retrieve_pkg_versions' only uses local data (or caches that
+    respect the 'offline' setting), so it can be used in offline mode when there is no cached metadata.
+    """
+
+    _offline_capable: bool = False
 
     def __init__(self, tingistry: Tingistry, **pkg_input_values: Any):
 
@@ -193,13 +265,18 @@ class VersionSource(metaclass=ABCMeta):
 
         self._versions: Optional[Iterable[PkgVersion]] = None
         self._version_args_dict: Optional[Mapping[str, Mapping[str, Any]]] = None
+        # lookup tables (version indexes per version variable, compiled aliases, id var index), only valid for the versions they were created from
+        self._lookup_versions: Optional[Iterable[PkgVersion]] = None
+        self._version_indexes: Dict[str, VersionIndex] = {}
+        self._alias_table: Optional[AliasTable] = None
+        self._version_resolver: Optional[VersionResolver] = None
 
         self._source_args: Optional[RecordArg] = None
 
         # self._version_var_names: Optional[Set[str]] = None
         # self._all_var_names: Optional[Set[str]] = None
 
-        self._aliases: Optional[Mapping[str, Mapping[Any, Any]]] = None
+        self._aliases: Mapping[str, Mapping[Any, Any]] = {}
         self._cache_config: Optional[Mapping[str, Any]]=None
 
         self._cache_dir = os.path.join(
@@ -234,40 +311,117 @@ class VersionSource(metaclass=ABCMeta):
             self._validated_pkg_input_values = self.pkg_args.validate(self.pkg_input_values, raise_exception=True)
         return self._validated_pkg_input_values
 
+    def set_versions(self, versions: Iterable[PkgVersion], version_args_dict: Mapping[str, Mapping[str, Any]]) -> None:
+        """Use pre-loaded versions (e.g. from a compiled index) instead of the metadata cache or the source itself."""
+
+        self._versions = versions
+        self._version_args_dict = version_args_dict
+        self._lookup_versions = None
+
     async def get_versions(self) -> Iterable[PkgVersion]:
 
         if self._versions is not None:
             return self._versions
 
-        cached_versions = await self.get_cached_versions(
+        # in offline mode, cached metadata is used no matter how old it is
+        offline = get_setting("offline")
+        cached_versions = await self._load_cached_versions(
             cache_config=self._cache_config,
+            skip_validity_check=offline,
         )
+        source_type = from_camel_case(self.__class__.__name__)
         if cached_versions:
-            self._versions, self._version_args_dict = cached_versions
+            VERSIONS_CACHE_HITS.inc(source_type=source_type)
+            self._use_loaded_versions(cached_versions)
 
         else:
+            if offline and not self._offline_capable:
+                raise FrklException(
+                    msg=f"Can't retrieve versions for package source '{self.get_unique_source_id()}'.",
+                    reason=f"Offline mode is enabled, and there is no cached metadata for this source: {self._get_cache_path()}",
+                    solution="Run 'bring warm' for the package while online, or disable offline mode.",
+                )
+
+            # only one retrieval per package source at a time, concurrent callers wait for its result
+            cache_path = self._get_cache_path()
+            while True:
+                retrieval = _RETRIEVALS.get(cache_path, None)
+                if retrieval is None:
+                    retrieval = _VersionsRetrieval()
+                    _RETRIEVALS[cache_path] = retrieval
+                    try:
+                        retrieval.result = await self._retrieve_and_cache_versions()
+                    except Exception as e:
+                        retrieval.error = e
+                        raise e
+                    finally:
+                        _RETRIEVALS.pop(cache_path, None)
+                        await retrieval.event.set()
+                    break
+
+                log.debug(f"Waiting for versions retrieval in progress: {cache_path}")
+                await retrieval.event.wait()
+                if retrieval.result is not None:
+                    VERSIONS_RETRIEVALS_COALESCED.inc(source_type=source_type)
+                    break
+                if retrieval.error is not None:
+                    raise FrklException(msg=f"Can't retrieve versions for package source '{self.get_unique_source_id()}'.", reason=str(retrieval.error)) from retrieval.error
+                # the caller that retrieved the versions was cancelled, try again
+                log.debug(f"Versions retrieval was cancelled, retrying: {cache_path}")
+
+            self._use_loaded_versions(retrieval.result)
+
+        return self._versions
+
+    def _use_loaded_versions(self, loaded: "_LoadedVersions") -> None:
+
+        self._versions = loaded.versions
+        self._version_args_dict = loaded.args
+        # version indexes only depend on the versions, so they are shared as well
+        self._lookup_versions = loaded.versions
+        self._version_indexes = loaded.version_indexes
+        self._alias_table = None
+        self._version_resolver = None
 
+    async def _retrieve_and_cache_versions(self) -> "_LoadedVersions":
+
+        source_type = from_camel_case(self.__class__.__name__)
+        cache_path = self._get_cache_path()
+
+        # other processes that need the same versions wait for the lock, and then read the cache file written here
+        async with FileLease(f"{cache_path}{LOCK_FILE_EXTENSION}"):
+
+            cached_versions = await self._load_cached_versions(cache_config=self._cache_config, skip_validity_check=get_setting("offline"))
+            if cached_versions:
+                log.debug(f"Versions were retrieved by another process: {cache_path}")
+                VERSIONS_RETRIEVALS_COALESCED.inc(source_type=source_type)
+                return cached_versions
+
+            # only counted here, callers that wait for this retrieval are counted as coalesced
+            VERSIONS_CACHE_MISSES.inc(source_type=source_type)
             try:
+                start = time.time()
                 result = await self._retrieve_pkg_versions(**self.validated_pkg_input_values)
+                VERSIONS_RETRIEVAL_SECONDS.observe(time.time() - start, source_type=source_type)
 
                 if not isinstance(result, Tuple):
-                    self._versions = result
+                    versions = result
                     args_dict = {}
                 else:
                     if not result:
-                        self._versions = []
+                        versions = []
                         args_dict = {}
                     elif isinstance(result[-1], PkgVersion):
-                        self._versions = list(result)
+                        versions = list(result)
                         args_dict = {}
                     else:
-                        self._versions = result[0]
+                        versions = result[0]
                         args_dict = result[1]
 
-                self._version_args_dict = explode_arg_dict(args_dict)
+                version_args_dict = explode_arg_dict(args_dict)
 
                 # TODO: validate against args?
-                await self.write_versions_cache(self._versions, self._version_args_dict)
+                loaded = await self.write_versions_cache(versions, version_args_dict)
 
             except (Exception) as e:
                 log.debug(f"Can't retrieve versions for pkg: {e}")
@@ -277,26 +431,170 @@ class VersionSource(metaclass=ABCMeta):
                 )
                 raise e
 
-        return self._versions
+        return loaded
+
+    def get_metadata_cache_status(self) -> str:
+        """Return whether 'get_versions' can work without contacting the package source.
+
+        Returns:
+            str: 'loaded' (versions are already available, e.g. from a compiled index), 'hit' (valid metadata cache) or 'miss'
+        """
+
+        if self._versions is not None:
+            return "loaded"
+
+        if get_setting("offline"):
+            valid = self._get_cache_details()["exists"]
+        else:
+            valid = self.metadata_is_valid(cache_config=self._get_cache_config())
+
+        return "hit" if valid else "miss"
+
+    def _get_cache_config(self) -> Mapping[str, Any]:
+
+        if self._cache_config is None:
+            return BRING_VERSIONS_DEFAULT_CACHE_CONFIG
+        return get_seeded_dict(BRING_VERSIONS_DEFAULT_CACHE_CONFIG, self._cache_config)
+
+    async def _warm_metadata_cache(self) -> None:
+
+        preloaded = self._versions is not None
+        versions = await self.get_versions()
+        if preloaded and not self.metadata_is_valid(cache_config=self._get_cache_config()):
+            await self.write_versions_cache(versions, self._version_args_dict)  # type: ignore
+
+    async def warm(self, version: Optional[PkgVersion] = None) -> None:
+        """Fill the caches of this source, so later calls don't have to contact the source.
+
+        The version metadata cache is always filled (also from versions that were pre-loaded, e.g. from a compiled
+        index), the version folder only if a version is provided.
+        """
+
+        await self._warm_metadata_cache()
+
+        if version is not None:
+            await self.get_version_folder(version, read_only=True)
+
+    @property
+    def aliases(self) -> Mapping[str, Mapping[Any, Any]]:
+        """The package level value aliases (e.g. from the 'aliases' key of a package description)."""
+
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, aliases: Mapping[str, Mapping[Any, Any]]) -> None:
+
+        self._aliases = aliases
+        self._alias_table = None
+        self._version_resolver = None
+
+    def _check_lookup_tables(self, versions: Iterable[PkgVersion]) -> None:
+
+        if self._lookup_versions is not versions:
+            self._lookup_versions = versions
+            self._version_indexes = {}
+            self._alias_table = None
+            self._version_resolver = None
+
+    def get_version_index(self, versions: Iterable[PkgVersion], var_name: str = "version") -> VersionIndex:
+        """Return the index of the values of a version variable (e.g. all tags), sorted by version.
+
+        The index is created once per list of versions.
+        """
+
+        self._check_lookup_tables(versions)
+        if var_name not in self._version_indexes.keys():
+            self._version_indexes[var_name] = VersionIndex(v.id_vars[var_name] for v in versions if isinstance(v.id_vars.get(var_name, None), str))
+        return self._version_indexes[var_name]
+
+    def get_alias_table(self, versions: Iterable[PkgVersion]) -> AliasTable:
+        """Return the compiled package and version aliases.
+
+        The table is compiled once per list of versions.
+        """
+
+        self._check_lookup_tables(versions)
+        if self._alias_table is None:
+            self._alias_table = AliasTable(pkg_aliases=self._aliases, version_aliases=(v.aliases for v in versions))
+        return self._alias_table
+
+    def get_version_resolver(self, versions: Iterable[PkgVersion]) -> VersionResolver:
+        """Return the index of the id vars of all versions, with the defaults of the version args.
+
+        The index is created once per list of versions.
+        """
+
+        self._check_lookup_tables(versions)
+        if self._version_resolver is None:
+            defaults = {}
+            for var_name, arg in (self._version_args_dict or {}).items():
+                if isinstance(arg, Mapping) and arg.get("default", None) is not None:
+                    defaults[var_name] = arg["default"]
+            defaults = self.get_alias_table(versions).translate(defaults)
+            self._version_resolver = VersionResolver(versions, defaults=defaults)
+        return self._version_resolver
+
+    def _resolve_range_constraints(self, versions: Iterable[PkgVersion], input_values: Mapping[str, Any]) -> Mapping[str, Any]:
+
+        result: Optional[Dict[str, Any]] = None
+        for var_name, value in input_values.items():
+            if not isinstance(value, str) or not is_range_constraint(value):
+                continue
+            # e.g. a branch called '3.x', which isn't a version, so it's not in the version index
+            if self.get_version_resolver(versions).has_value(var_name, value):
+                continue
+
+            index = self.get_version_index(versions, var_name=var_name)
+            resolved = index.resolve(value)
+            if resolved is None:
+                raise FrklException(msg=f"Can't find matching package version for input values: {input_values}", reason=f"No version matches '{var_name}' range: {value}")
+            if result is None:
+                result = dict(input_values)
+            result[var_name] = resolved
+
+        return input_values if result is None else result
+
+    def _translate_input(self, versions: Iterable[PkgVersion], input_values: Mapping[str, Any]) -> Mapping[str, Any]:
+
+        input_values = self.get_alias_table(versions).translate(input_values)
+        return self._resolve_range_constraints(versions, input_values)
+
+    async def find_candidates(self, **input_values: Any) -> List[VersionCandidate]:
+        """Return the versions of this package that match the provided (possibly partial) input, best match first.
+
+        Aliases in the input values are translated first. Input values can be range constraints (e.g.
+        'version=">=3.1,<3.2"', check 'bring.utils.version_index' for the syntax), which resolve to the highest matching
+        version. Variables that are not part of the input are filled with the defaults of the version args, where
+        possible (check 'bring.utils.version_resolver' for details on the ranking).
+        """
+
+        versions = await self.get_versions()
+        return self.get_version_resolver(versions).find_candidates(self._translate_input(versions, input_values))
 
     async def find_matching_version(self, **input_values: Any) -> Optional[PkgVersion]:
-        """Find the version of this package that matches the provided input."""
+        """Find the version of this package that matches the provided input.
 
-        matches: Dict[int, List[PkgVersion]] = {}
-        for version in await self.get_versions():
-            match_score = version.match_score(**input_values)
-            matches.setdefault(match_score, []).append(version)
+        Raises an exception that explains why if no version matches, or if more than one version matches equally well.
+        """
 
-        max_match = max(matches.keys())
+        versions = await self.get_versions()
+        translated = self._translate_input(versions, input_values)
+        resolver = self.get_version_resolver(versions)
 
-        if not max_match:
-            raise NotImplementedError()
+        candidates = resolver.find_candidates(translated)
+        if not candidates:
+            raise FrklException(msg=f"Can't find matching package version for input values: {input_values}", reason=resolver.explain(translated))
 
-        _v = matches[max_match]
-        if len(_v) != 1:
-            raise FrklException(msg=f"Can't find matchig package version for input values: {input_values}", reason=f"More than one matches found: {_v}")
+        ambiguous_vars = resolver.get_ambiguous_vars(candidates)
+        if ambiguous_vars:
+            best = [c.version.id_vars for c in candidates if c[1:] == candidates[0][1:]]
+            raise FrklException(
+                msg=f"Can't find matching package version for input values: {input_values}",
+                reason=f"More than one version matches: {best[0:5]}{' ...' if len(best) > 5 else ''}",
+                solution=f"Specify a value for: {', '.join(ambiguous_vars)}",
+            )
 
-        return _v[0]
+        return candidates[0].version
 
     async def find_version_and_get_folder(self, _read_only: bool=False, _version_base_dir: Optional[str]=None, **input_values: Any) -> str:
 
@@ -312,7 +610,7 @@ class VersionSource(metaclass=ABCMeta):
 
         return os.path.join(version_base_dir, version.id)
 
-    async def get_version_folder(self, version: PkgVersion, read_only: bool = False) -> str:
+    async def get_version_folder(self, version: PkgVersion, read_only: bool = False, content_paths: Optional[Iterable[str]] = None) -> str:
         """Get the path to a local folder that contains all files for the specified version of a package.
 
         This method should work for all child classes, but can be overwritten if necessary (e.g. to save disk-space (check out 'git_repo' for an example).
@@ -322,9 +620,13 @@ class VersionSource(metaclass=ABCMeta):
         If 'read_only' is set, you can't rely on the folder to be available
         after *bring* finished. Set to True if that is necessary.
 
+        'content_paths' is a hint which (relative) paths the caller is going to use. Implementations can use it to
+        only materialize those, but are free to ignore it and return the complete version folder.
+
         Args:
             version (PkgVersion): the version object
             read_only (bool): indicate whether the resulting folder will be written to or not
+            content_paths (Iterable): if provided, only those paths (files or folders) of the version are required
 
         Returns:
             str: the path to the version folder
@@ -335,52 +637,105 @@ class VersionSource(metaclass=ABCMeta):
 
         if not os.path.exists(version_path):
 
-            # install that version
-            pipeline = Pipeline(tingistry=self.tingistry, task_name="create_version_folder")
-            pipeline.add(*version.steps)
+            async with cache_lock(version_path):
+                # another node might have created the version folder while we were waiting for the lock
+                if not os.path.exists(version_path):
+                    await self._create_version_folder(version, version_base_path, version_path)
 
-            pipeline_result = await pipeline.run_async(raise_exception=True)
-            path = pipeline_result.result_value["folder_path"]
+        if read_only:
+            return version_path
 
-            ensure_folder(version_base_path)
-            shutil.move(path, version_path)
+        def copy_version_folder() -> str:
+            # the workspace might have been cleaned since the version folder was created
+            ensure_folder(BRING_RESULTS_FOLDER)
+            result_base = tempfile.mkdtemp(prefix=f"{version.id}_", dir=BRING_RESULTS_FOLDER)
+            result_dir = os.path.join(result_base, "data")
 
-            # write metadata
-            md_file = os.path.join(version_base_path, BRING_VERSION_METADATA_FILE_NAME)
-            tz = get_localzone()
-            created = str(tz.localize(datetime.now()))
-            md = version.to_dict()
-            md["created"] = created
-            async with await open_file(md_file, "w") as f:
-                await f.write(json.dumps(md))
+            shutil.copytree(version_path, result_dir)
+            BYTES_COPIED.inc(get_folder_size(result_dir))
+            return result_dir
 
-        if read_only:
-            return version_path
+        return await run_disk(copy_version_folder)
 
-        result_base = tempfile.mkdtemp(prefix=f"{version.id}_", dir=BRING_RESULTS_FOLDER)
-        result_dir = os.path.join(result_base, "data")
+    async def _create_version_folder(self, version: PkgVersion, version_base_path: str, version_path: str) -> None:
 
-        shutil.copytree(version_path, result_dir)
-        return result_dir
+        pipeline = Pipeline(tingistry=self.tingistry, task_name="create_version_folder")
+        pipeline.add(*version.steps)
 
-    async def write_versions_cache(self, versions: Iterable[PkgVersion], args: Mapping[str, Mapping[str, Any]]):
+        pipeline_result = await pipeline.run_async(raise_exception=True)
+        path = pipeline_result.result_value["folder_path"]
+
+        # write metadata
+        md_file = os.path.join(version_base_path, BRING_VERSION_METADATA_FILE_NAME)
+        tz = get_localzone()
+        created = str(tz.localize(datetime.now()))
+        md = version.to_dict()
+        md["created"] = created
+        ensure_folder(version_base_path)
+        async with await open_file(md_file, "w") as f:
+            await f.write(json.dumps(md))
+
+        await run_disk(publish_path, path, version_path)
+        VERSION_FOLDER_SIZE.observe(await run_disk(get_folder_size, version_path), source_type=from_camel_case(self.__class__.__name__))
+
+    async def plan_version_folder(self, version: PkgVersion, read_only: bool = False, content_paths: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Report which cache layers 'get_version_folder' would use for a version, without creating anything.
+
+        Sizes of things that don't exist yet are estimated from earlier runs (or None, if there is no data yet).
+
+        Returns:
+            List: one dict per layer, with the keys 'layer', 'status' ('hit' or 'miss') and 'path', and optionally the
+                estimated 'fetch_bytes' and 'copy_bytes'
+        """
+
+        version_base_path = self.calculate_version_folder_base_path(version, version_base_dir=None)
+        version_path = os.path.join(version_base_path, BRING_PKG_VERSION_DATA_FOLDER_NAME)
+
+        if os.path.exists(version_path):
+            layer: Dict[str, Any] = {"layer": "version_folder", "status": "hit", "path": version_path}
+            size: Optional[float] = await run_disk(get_folder_size, version_path)
+        else:
+            size = VERSION_FOLDER_SIZE.mean(source_type=from_camel_case(self.__class__.__name__))
+            layer = {"layer": "version_folder", "status": "miss", "path": version_path, "steps": [s["type"] for s in version.steps], "fetch_bytes": size}
+
+        if not read_only:
+            layer["copy_bytes"] = size
+
+        return [layer]
+
+    async def write_versions_cache(self, versions: Iterable[PkgVersion], args: Mapping[str, Mapping[str, Any]]) -> "_LoadedVersions":
+        """Write versions to the metadata cache file (and keep them in memory, for other sources of the same package)."""
 
         metadata_file = self._get_cache_path()
 
-        ensure_folder(BRING_TEMP_CACHE)
-        temp_file = tempfile.mkstemp(dir=BRING_TEMP_CACHE)[1]
+        def create_temp_file() -> str:
+            # in the same folder as the cache file, so it can be replaced atomically (also on NFS)
+            ensure_folder(os.path.dirname(metadata_file))
+            fd, path = tempfile.mkstemp(dir=os.path.dirname(metadata_file), prefix=".tmp_")
+            os.close(fd)
+            return path
+
+        temp_file = await run_disk(create_temp_file)
+
+        pickled = await run_cpu(pickle.dumps, (versions, args))
+
+        def move_cache_file() -> os.stat_result:
+            os.replace(temp_file, metadata_file)
+            return os.stat(metadata_file)
 
-        pickled = pickle.dumps((versions, args))
         try:
             async with await open_file(temp_file, "wb") as f:
                 await f.write(pickled)
 
-            ensure_folder(os.path.dirname(metadata_file))
-            shutil.move(temp_file, metadata_file)
+            file_stat = await run_disk(move_cache_file)
         finally:
             if os.path.exists(temp_file):
                 os.unlink(temp_file)
 
+        loaded = _LoadedVersions(versions, args, generation=(file_stat.st_mtime_ns, file_stat.st_size))
+        _LOADED_VERSIONS.put(metadata_file, loaded, file_stat.st_size)
+        return loaded
+
 
     async def get_version_args_dict(self) -> Mapping[str, Mapping[str, Any]]:
 
@@ -455,6 +810,7 @@ class VersionSource(metaclass=ABCMeta):
 
         result["exists"] = True
         result["size"] = file_size
+        result["mtime_ns"] = file_stat.st_mtime_ns
         modification_time = datetime.fromtimestamp(file_stat.st_mtime)
         tz = get_localzone()
         result["modified"] = tz.localize(modification_time)
@@ -467,6 +823,17 @@ class VersionSource(metaclass=ABCMeta):
         skip_validity_check: bool = False,
     ) -> Optional[Tuple[Iterable[PkgVersion], Mapping[str, Mapping[str, Any]]]]:
 
+        loaded = await self._load_cached_versions(cache_config=cache_config, skip_validity_check=skip_validity_check)
+        if loaded is None:
+            return None
+        return (loaded.versions, loaded.args)
+
+    async def _load_cached_versions(
+        self,
+        cache_config: Optional[Mapping[str, Any]]=None,
+        skip_validity_check: bool = False,
+    ) -> Optional["_LoadedVersions"]:
+
         if not skip_validity_check:
 
             if cache_config is None:
@@ -485,12 +852,21 @@ class VersionSource(metaclass=ABCMeta):
             return None
 
         path = details["path"]
+        generation = (details["mtime_ns"], details["size"])
+
+        # unless the cache file changed, the versions another source loaded can be used
+        loaded: Optional[_LoadedVersions] = _LOADED_VERSIONS.get(path)
+        if loaded is not None and loaded.generation == generation:
+            VERSIONS_MEMORY_CACHE_HITS.inc(source_type=from_camel_case(self.__class__.__name__))
+            return loaded
 
         async with await open_file(path, "rb") as f:
             content = await f.read()
 
-        cached_data: Tuple[Iterable[PkgVersion], Mapping[str, Mapping[str, Any]]] = pickle.loads(content)
-        return cached_data
+        cached_data: Tuple[Iterable[PkgVersion], Mapping[str, Mapping[str, Any]]] = await run_cpu(pickle.loads, content)
+        loaded = _LoadedVersions(cached_data[0], cached_data[1], generation=generation)
+        _LOADED_VERSIONS.put(path, loaded, details["size"])
+        return loaded
 
     def metadata_is_valid(
         self,
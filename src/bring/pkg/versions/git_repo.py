@@ -1,19 +1,24 @@
+import hashlib
 import json
 import os
 import shutil
 import tempfile
 from collections import OrderedDict
 from datetime import datetime
-from typing import Mapping, Any, Iterable, MutableMapping, Optional, Dict, Tuple
+from typing import Mapping, Any, Iterable, MutableMapping, Optional, Dict, List, Tuple
 
-import arrow
 from anyio import open_file
-from dateutil.parser import parser
 
 from bring.defaults import VERSION_ARG, BRING_PKG_VERSION_DATA_FOLDER_NAME, BRING_VERSION_METADATA_FILE_NAME, \
     BRING_RESULTS_FOLDER, BRING_WORKSPACE_FOLDER
 from bring.transform.pipeline import Pipeline
-from bring.utils.git_python import get_repo_info, ensure_repo_cloned, clone_local_repo_async
+from bring.utils.executors import run_disk
+from bring.utils.filesystem import get_folder_size, publish_path
+from bring.utils.git_backend import GIT_CLONE_STRATEGIES, get_clone_requirement_for_version, get_clone_strategy, \
+    get_git_backend, get_git_cache_path, is_commit_hash
+from bring.utils.locks import get_node_id, is_shared_cache
+from bring.utils.metrics import CLONE_SIZE, VERSION_FOLDER_SIZE
+from bring.utils.version_index import VersionIndex
 import logging
 # import git
 # from pydriller import GitRepository, Commit
@@ -22,27 +27,29 @@ from tzlocal import get_localzone
 
 from bring.pkg.versions import PkgVersion, VersionSource
 from frkl.common.filesystem import ensure_folder
-from frkl.common.strings import generate_valid_identifier
+from frkl.common.strings import from_camel_case, generate_valid_identifier
 
 log = logging.getLogger("bring")
 
 
-def get_metadata_from_commit(**commit_data: Any):
+def get_metadata_from_commit(ref_type: Optional[str]=None, **commit_data: Any):
+    """Create version metadata from commit metadata (check 'bring.pkg.versions.format_release_date' to display the date)."""
 
-    timestamp = str(commit_data["author_date"])
-    timestamp_tz = commit_data["author_timezone"]
-
-    t = arrow.get(f"{timestamp} {timestamp_tz}", 'ddd MMM DD YYYY HH:mm:ss Z')
-
-    return {
-        "release_date": str(t.datetime)
+    result = {
+        "release_time": commit_data["author_time"],
+        "release_timezone": commit_data["author_timezone"]
     }
+    if ref_type is not None:
+        result["ref_type"] = ref_type
+    return result
 
 
 class GitRepoSource(VersionSource):
     """VersionSource that retrieves package versions from git metadata."""
 
     _plugin_name = "git_repo"
+    # in offline mode, versions are read from the git checkout cache
+    _offline_capable = True
 
     def get_pkg_args(self) -> Mapping[str, Any]:
 
@@ -54,8 +61,60 @@ class GitRepoSource(VersionSource):
                 "default": False,
                 "doc": "Whether to use commit hashes as version strings.",
             },
+            "clone_strategy": {
+                "type": "string",
+                "required": False,
+                "default": "auto",
+                "allowed": ["auto"] + list(GIT_CLONE_STRATEGIES),
+                "doc": "How to populate the git checkout cache ('auto' picks the cheapest strategy that works for this package, and the git backend supports).",
+            },
+            "clone_depth": {
+                "type": "integer",
+                "required": False,
+                "default": 1,
+                "doc": "The number of commits to fetch per ref, for the 'shallow' and 'tags' clone strategies.",
+            },
         }
 
+    def get_clone_requirement(self, version: Optional[PkgVersion] = None) -> Tuple[str, Optional[int]]:
+        """Calculate the clone strategy (and depth) to use for the git checkout cache.
+
+        If no version is provided, the requirement to retrieve the version metadata is returned.
+
+        The full history is only required to retrieve the metadata of packages that use commits as versions, and for
+        commit versions. With 'auto', a 'blobless' clone is used for those if the git backend supports it, since it
+        contains the whole history, but only the file contents of the versions that are actually exported.
+        """
+
+        source_input = self.validated_pkg_input_values
+        strategy = source_input.get("clone_strategy", "auto")
+        depth = source_input.get("clone_depth", 1)
+        use_commits_as_versions = source_input.get("use_commits_as_versions", False)
+
+        if version is not None:
+            ref_type = version.metadata.get("ref_type", None)
+            needs_history = ref_type == "commit" or (ref_type is None and is_commit_hash(version.steps[0]["version"]))
+        else:
+            needs_history = use_commits_as_versions
+
+        if strategy != "auto":
+            if needs_history and strategy not in ["full", "blobless"]:
+                log.debug(f"Clone strategy '{strategy}' doesn't contain the history that commit versions need, using 'full' instead.")
+                return ("full", None)
+            return (strategy, depth)
+
+        if needs_history:
+            return self._get_history_requirement()
+        if version is not None:
+            return get_clone_requirement_for_version(version.steps[0]["version"], ref_type=version.metadata.get("ref_type", None), depth=depth)
+        return ("shallow", depth)
+
+    def _get_history_requirement(self) -> Tuple[str, Optional[int]]:
+
+        if get_git_backend().supports_strategy("blobless"):
+            return ("blobless", None)
+        return ("full", None)
+
     def _get_unique_source_type_id(self):
 
         # TODO: this is not 100% secure, there is a small chance some ids could overlap, should be all right though
@@ -71,9 +130,11 @@ class GitRepoSource(VersionSource):
 
         tz = get_localzone()
         metadata_timestamp =  tz.localize(datetime.now())
-        cache_path = await ensure_repo_cloned(url=url, update=True)
+        strategy, depth = self.get_clone_requirement()
+        git_backend = get_git_backend()
+        cache_path = await git_backend.ensure_repo_cloned(url=url, update=True, strategy=strategy, depth=depth)
 
-        repo_info = get_repo_info(cache_path)
+        repo_info = await git_backend.get_repo_info(cache_path, include_history=use_commits_as_version)
 
         commits: Mapping[str, Mapping[str, Any]] = repo_info["commits"]
         tags: Mapping[str, str] = repo_info["tags"]
@@ -81,20 +142,30 @@ class GitRepoSource(VersionSource):
 
         versions = []
 
-        latest: Optional[str] = None
-        for k in tags.keys():
-
-            aliases = None
-            if latest is None:
-                latest = k
-                aliases = {"version": {"latest": k}}
-
-            _remove = []
+        for k in list(tags.keys()):
             if tags[k] not in commits.keys():
                 log.warning(f"Ignoring tag '{k}': can't find commit hash '{tags[k]}'")
-                _remove.append(k)
-            for r in _remove:
-                tags.pop(r)
+                tags.pop(k)
+
+        tag_index = VersionIndex(tags.keys())
+        latest: Optional[str] = tag_index.latest
+        latest_stable: Optional[str] = tag_index.latest_stable
+        if latest is None and tags:
+            # no tag looks like a version, use the first one (in reverse ref name order)
+            latest = next(iter(tags.keys()))
+
+        # highest versions first, then the tags that don't look like versions
+        indexed_tags = set(tag_index.versions)
+        sorted_tags = list(reversed(tag_index.versions)) + [t for t in tags.keys() if t not in indexed_tags]
+
+        for k in sorted_tags:
+
+            version_aliases = {}
+            if k == latest:
+                version_aliases["latest"] = k
+            if k == latest_stable:
+                version_aliases["latest-stable"] = k
+            aliases = {"version": version_aliases} if version_aliases else None
 
             c_data = commits[tags[k]]
 
@@ -102,7 +173,7 @@ class GitRepoSource(VersionSource):
                 steps=steps,
                 id_vars={"version": k},
                 aliases=aliases,
-                metadata=get_metadata_from_commit(**c_data),
+                metadata=get_metadata_from_commit(ref_type="tag", **c_data),
                 metadata_timestamp=metadata_timestamp
             )
             versions.append(_v)
@@ -126,7 +197,7 @@ class GitRepoSource(VersionSource):
                 steps=steps,
                 id_vars={"version": "master"},
                 aliases=aliases,
-                metadata=get_metadata_from_commit(**c_data),
+                metadata=get_metadata_from_commit(ref_type="branch", **c_data),
                 metadata_timestamp=metadata_timestamp,
             )
             versions.append(_v)
@@ -140,7 +211,7 @@ class GitRepoSource(VersionSource):
             _v = PkgVersion(
                 steps=steps,
                 id_vars={"version": b},
-                metadata=get_metadata_from_commit(**c_data),
+                metadata=get_metadata_from_commit(ref_type="branch", **c_data),
                 metadata_timestamp=metadata_timestamp
             )
             versions.append(_v)
@@ -151,13 +222,16 @@ class GitRepoSource(VersionSource):
                 _v = PkgVersion(
                     steps=steps,
                     id_vars={"version": c_hash},
-                    metadata=get_metadata_from_commit(**c_data),
+                    metadata=get_metadata_from_commit(ref_type="commit", **c_data),
                     metadata_timestamp=metadata_timestamp
                 )
                 versions.append(_v)
 
         version_arg = dict(VERSION_ARG)
-        if latest:
+        # don't install pre-releases unless asked to
+        if latest_stable:
+            version_arg["default"] = latest_stable
+        elif latest:
             version_arg["default"] = latest
 
         args_dict = {
@@ -166,12 +240,42 @@ class GitRepoSource(VersionSource):
 
         return versions, args_dict
 
-    async def get_version_folder(self, version: PkgVersion, read_only: bool = False) -> str:
+    async def warm(self, version: Optional[PkgVersion] = None) -> None:
+        """Fill the version metadata cache and the git checkout cache.
+
+        Version folders are exported from the git checkout cache when they are needed, so for a provided version only
+        the clone is made sure to contain it (e.g. the full history for a commit).
+        """
+
+        await self._warm_metadata_cache()
+
+        # the metadata might have been cached while the git checkout cache was not (or was cleaned)
+        strategy, depth = self.get_clone_requirement(version)
+        await get_git_backend().ensure_repo_cloned(self.validated_pkg_input_values["url"], update=False, strategy=strategy, depth=depth)
+
+    def _calculate_export_path(self, version: PkgVersion, target_base_path: str, content_paths: Optional[Iterable[str]] = None) -> str:
+
+        if content_paths is None:
+            folder_name = version.id
+        else:
+            content_paths = sorted(set(content_paths))
+            paths_hash = hashlib.sha1("\n".join(content_paths).encode("utf-8")).hexdigest()[0:16]
+            folder_name = f"{version.id}_{paths_hash}"
+
+        if is_shared_cache():
+            # exports are disposable and deleted by the process that uses them, so nodes must not share them
+            return os.path.join(target_base_path, BRING_PKG_VERSION_DATA_FOLDER_NAME, get_node_id(), folder_name)
+
+        return os.path.join(target_base_path, BRING_PKG_VERSION_DATA_FOLDER_NAME, folder_name)
+
+    async def get_version_folder(self, version: PkgVersion, read_only: bool = False, content_paths: Optional[Iterable[str]] = None) -> str:
 
         git_url = version.steps[0]["url"]
         repo_version = version.steps[0]["version"]
 
-        git_repo_path = await ensure_repo_cloned(git_url, update=False)
+        strategy, depth = self.get_clone_requirement(version)
+        git_backend = get_git_backend()
+        git_repo_path = await git_backend.ensure_repo_cloned(git_url, update=False, strategy=strategy, depth=depth)
 
         version_base_path = self.calculate_version_folder_base_path(version, version_base_dir=None)
 
@@ -185,7 +289,7 @@ class GitRepoSource(VersionSource):
             md["created"] = created
             md["cached_git_repo_path"] = git_repo_path
 
-            ensure_folder(version_base_path)
+            await run_disk(ensure_folder, version_base_path)
             async with await open_file(md_file, "w") as f:
                 await f.write(json.dumps(md))
 
@@ -193,11 +297,47 @@ class GitRepoSource(VersionSource):
         else:
             target_base_path = BRING_RESULTS_FOLDER
 
-        target_path = os.path.join(target_base_path, BRING_PKG_VERSION_DATA_FOLDER_NAME, version.id)
-        ensure_folder(os.path.dirname(target_path))
+        target_path = self._calculate_export_path(version, target_base_path, content_paths)
+        await run_disk(ensure_folder, os.path.dirname(target_path))
 
         if not os.path.exists(target_path):
 
-            await clone_local_repo_async(git_repo_path, target_path, version=repo_version)
+            # if content paths are provided, only write the files the package actually uses, instead of the whole tree
+            temp_path = os.path.join(os.path.dirname(target_path), f".tmp_{generate_valid_identifier()}")
+            await git_backend.export_tree(git_repo_path, temp_path, version=repo_version, paths=content_paths)
+            await run_disk(publish_path, temp_path, target_path)
+            VERSION_FOLDER_SIZE.observe(await run_disk(get_folder_size, target_path), source_type=from_camel_case(self.__class__.__name__))
 
         return target_path
+
+    async def plan_version_folder(self, version: PkgVersion, read_only: bool = False, content_paths: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+
+        git_url = version.steps[0]["url"]
+        strategy, depth = self.get_clone_requirement(version)
+        cache_path = get_git_cache_path(git_url)
+
+        git_layer: Dict[str, Any] = {"layer": "git_cache", "path": cache_path}
+        if os.path.exists(cache_path):
+            try:
+                existing = await run_disk(get_clone_strategy, cache_path)
+            except FileNotFoundError:
+                # old, non-bare cache layout, will be migrated
+                existing = ("full", None)
+            usable = get_git_backend().can_use_clone(existing, (strategy, depth))
+        else:
+            usable = False
+        if usable:
+            git_layer["status"] = "hit"
+        else:
+            git_layer.update({"status": "miss", "clone_strategy": strategy, "fetch_bytes": CLONE_SIZE.mean()})
+
+        version_base_path = self.calculate_version_folder_base_path(version, version_base_dir=None)
+        target_base_path = BRING_RESULTS_FOLDER if os.path.exists(version_base_path) else BRING_WORKSPACE_FOLDER
+        target_path = self._calculate_export_path(version, target_base_path, content_paths)
+
+        if os.path.exists(target_path):
+            folder_layer: Dict[str, Any] = {"layer": "version_folder", "status": "hit", "path": target_path, "copy_bytes": 0}
+        else:
+            folder_layer = {"layer": "version_folder", "status": "miss", "path": target_path, "copy_bytes": VERSION_FOLDER_SIZE.mean(source_type=from_camel_case(self.__class__.__name__))}
+
+        return [git_layer, folder_layer]
@@ -21,6 +21,7 @@ class TemplateUrlResolver(VersionSource):
 
     _plugin_name: str = "template_url"
     _plugin_supports: str = "template_url"
+    _offline_capable: bool = True
 
     def __init__(self, **config: Any):
         super().__init__(**config)
@@ -46,16 +47,25 @@ class TemplateUrlResolver(VersionSource):
                 "required": True,
                 "doc": "The templated url string, using '{{' and '}}' as template markers.",
             },
+            "sha256": {
+                "type": "string",
+                "required": False,
+                "doc": "The sha256 checksum of the file, if known (downloads are verified against it, and skipped if a file with this checksum is already cached).",
+            },
         }
 
     async def _retrieve_pkg_versions(self, **source_input) -> Iterable[PkgVersion]:
 
         url = source_input["url"]
 
-        steps = [
-            {"type": "download", "url": url}
-        ]
-        version = PkgVersion(steps=steps, id_vars={})
+        download: Dict[str, Any] = {"type": "download", "url": url}
+        sha256 = source_input.get("sha256", None)
+        if sha256:
+            download["sha256"] = sha256
+        steps = [download]
+        version = PkgVersion(steps=steps, id_vars={}, metadata={"url": url})
+
+        return [version]
 
         # template_values = source_details["template_values"]
         #
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Cache for the results of single transform steps.
+
+Every step of a transform pipeline gets a key: the hash of the step configuration (which includes its type) and the key
+of the step before it. The first step is keyed on the identity of the version folder it reads. So the key of a step
+changes whenever its configuration, or anything upstream of it, changes, and two pipelines that start with the same
+steps share the cached results of those steps.
+
+Entries are removed when:
+
+- they are older than the 'step_cache_max_age' setting (in seconds, 0: no age limit)
+- the cache grows larger than the 'step_cache_max_size' setting (in bytes), least recently used entries first
+
+Setting 'step_cache_max_size' to 0 disables the cache. In a shared cache (setting: 'shared_cache'), removed entries are
+kept (hidden) for 'retired_grace_seconds', since processes on other nodes might still be reading them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+
+from bring.config.settings import get_setting
+from bring.defaults import BRING_STEP_CACHE
+from bring.utils.filesystem import get_folder_size, purge_retired, retire_path
+from bring.utils.metrics import STEP_CACHE_HITS, STEP_CACHE_MISSES
+from frkl.common.filesystem import ensure_folder
+from frkl.common.strings import generate_valid_identifier
+
+
+log = logging.getLogger("bring")
+
+STEP_CACHE_FORMAT = 1
+"""Part of every key, increase this to invalidate all existing entries."""
+
+_DATA_FOLDER_NAME = "data"
+_METADATA_FILE_NAME = "step.json"
+
+
+def _hash(data: Any) -> str:
+
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def calculate_base_key(version_id: str, version_metadata: Optional[Mapping[str, Any]] = None, content_paths: Optional[Iterable[str]] = None) -> str:
+    """Calculate the key that identifies the version folder a pipeline starts with."""
+
+    return _hash([STEP_CACHE_FORMAT, version_id, version_metadata, sorted(content_paths) if content_paths is not None else None])
+
+
+def calculate_step_key(upstream_key: str, step: Mapping[str, Any]) -> str:
+    """Calculate the key for the result of a transform step, using the key of the step (or version folder) before it."""
+
+    return _hash([STEP_CACHE_FORMAT, upstream_key, step])
+
+
+def calculate_step_keys(base_key: str, steps: Iterable[Mapping[str, Any]]) -> List[str]:
+
+    result = []
+    key = base_key
+    for step in steps:
+        key = calculate_step_key(key, step)
+        result.append(key)
+    return result
+
+
+class StepCache(object):
+    """A folder that holds the result folders of transform steps, one sub-folder per step key.
+
+    Result folders must not be modified once they are added.
+    """
+
+    def __init__(self, base_path: str = BRING_STEP_CACHE, max_size: Optional[int] = None, max_age: Optional[int] = None):
+
+        self._base_path: str = base_path
+        if max_size is None:
+            max_size = get_setting("step_cache_max_size")
+        self._max_size: int = max_size
+        if max_age is None:
+            max_age = get_setting("step_cache_max_age")
+        self._max_age: int = max_age
+
+    @property
+    def base_path(self) -> str:
+        return self._base_path
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def _entry_path(self, key: str) -> str:
+
+        return os.path.join(self._base_path, key)
+
+    def _is_expired(self, entry_path: str, now: float) -> bool:
+
+        if self._max_age <= 0:
+            return False
+
+        try:
+            with open(os.path.join(entry_path, _METADATA_FILE_NAME), "r") as f:
+                created = json.load(f)["created"]
+        except Exception:
+            return True
+
+        return now - created > self._max_age
+
+    def _find_entry(self, key: str, now: float) -> Optional[str]:
+
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(os.path.join(entry_path, _DATA_FOLDER_NAME)):
+            return None
+        if self._is_expired(entry_path, now):
+            return None
+        return entry_path
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the path to the (read-only) result folder for a step key, or None if there is no valid entry."""
+
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        entry_path = self._find_entry(key, now)
+        if entry_path is None:
+            if os.path.isdir(self._entry_path(key)):
+                self._remove_entry(self._entry_path(key))
+            return None
+
+        # the modification time of the entry folder records the last use
+        try:
+            os.utime(entry_path, (now, now))
+        except OSError:
+            pass
+
+        return os.path.join(entry_path, _DATA_FOLDER_NAME)
+
+    def get_cached_prefix_length(self, keys: List[str]) -> int:
+        """Return how many steps of a chain of step keys would be skipped, without using (or changing) the cache."""
+
+        if not self.enabled:
+            return 0
+
+        now = time.time()
+        for index in reversed(range(len(keys))):
+            if self._find_entry(keys[index], now) is not None:
+                return index + 1
+        return 0
+
+    def find_longest_prefix(self, keys: List[str]) -> Tuple[int, Optional[str]]:
+        """Find the last step in a chain of step keys that has a cached result.
+
+        Returns:
+            Tuple: the number of steps that don't need to run, and the result folder of the last of them (or None)
+        """
+
+        if self.enabled:
+            for index in reversed(range(len(keys))):
+                data_path = self.get(keys[index])
+                if data_path is not None:
+                    STEP_CACHE_HITS.inc()
+                    return (index + 1, data_path)
+
+        STEP_CACHE_MISSES.inc()
+        return (0, None)
+
+    def add(self, key: str, folder: str, step: Mapping[str, Any]) -> str:
+        """Move the result folder of a step into the cache, and return its new location.
+
+        If the cache is disabled, the folder is left where it is.
+        """
+
+        if not self.enabled:
+            return folder
+
+        entry_path = self._entry_path(key)
+        ensure_folder(self._base_path)
+        temp_path = os.path.join(self._base_path, f".tmp_{generate_valid_identifier()}")
+        ensure_folder(temp_path)
+
+        shutil.move(folder, os.path.join(temp_path, _DATA_FOLDER_NAME))
+        size = get_folder_size(temp_path)
+        with open(os.path.join(temp_path, _METADATA_FILE_NAME), "w") as f:
+            json.dump({"key": key, "type": step.get("type", None), "created": time.time(), "size": size}, f)
+
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            # another process was faster
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        self.prune(keep=key)
+
+        return os.path.join(entry_path, _DATA_FOLDER_NAME)
+
+    def _remove_entry(self, entry_path: str) -> None:
+
+        # the entry disappears atomically, and (in a shared cache) stays readable for processes that still use it
+        retire_path(entry_path)
+
+    def prune(self, keep: Optional[str] = None) -> int:
+        """Remove expired entries, and the least recently used ones if the cache is larger than allowed.
+
+        Args:
+            keep: the key of an entry that should not be removed (e.g. the one that was just added)
+
+        Returns:
+            int: the number of removed entries
+        """
+
+        if not os.path.isdir(self._base_path):
+            return 0
+
+        purge_retired(self._base_path)
+
+        now = time.time()
+        removed = 0
+        entries = []
+        for name in os.listdir(self._base_path):
+            if name.startswith("."):
+                continue
+            entry_path = self._entry_path(name)
+            if name != keep and self._is_expired(entry_path, now):
+                self._remove_entry(entry_path)
+                removed = removed + 1
+                continue
+
+            try:
+                last_used = os.stat(entry_path).st_mtime
+                with open(os.path.join(entry_path, _METADATA_FILE_NAME), "r") as f:
+                    size = json.load(f)["size"]
+            except Exception:
+                size = get_folder_size(entry_path)
+                last_used = 0
+            entries.append((last_used, name, size))
+
+        total = sum(e[2] for e in entries)
+        for last_used, name, size in sorted(entries):
+            if total <= self._max_size:
+                break
+            if name == keep:
+                continue
+            log.debug(f"Removing transform step cache entry: {name}")
+            self._remove_entry(self._entry_path(name))
+            total = total - size
+            removed = removed + 1
+
+        return removed
@@ -46,8 +46,14 @@ class Transformer(Task, SimpleTing):
     Currently there is not much validation whether Transformers that are put together fit each others input/output arguments,
     but that will be implemented at some stage. So, for now, it's the users responsibility to assemble transformer
     pipelines that make sense.
+
+    Transformers whose result only depends on their input (and that don't modify their input folder) can have their
+    result cached between runs, see 'bring.transform.step_cache'. Set the '_cacheable' class attribute to False if
+    that is not the case.
     """
 
+    _cacheable: bool = True
+
     def __init__(self, name: str, meta: TingMeta, **kwargs) -> None:
 
         self._working_dir: Optional[str] = None
@@ -77,6 +83,11 @@ class Transformer(Task, SimpleTing):
         tempdir = tempfile.mkdtemp(prefix=f"{prefix}_", dir=self.working_dir)
         return tempdir
 
+    @property
+    def cacheable(self) -> bool:
+
+        return self.__class__._cacheable
+
     def get_msg(self) -> str:
 
         transformer_name = get_plugin_name(self.__class__)
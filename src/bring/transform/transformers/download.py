@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+from typing import Any, Mapping
+from urllib.parse import urlparse
+
+from bring.transform.transformer import SimpleTransformer
+from bring.utils.downloads import download_file
+from bring.utils.executors import run_disk
+from bring.utils.metrics import BYTES_COPIED
+
+
+class Download(SimpleTransformer):
+    """Download a file (via the content addressed download cache), and provide a folder that contains it."""
+
+    _plugin_name: str = "download"
+
+    _requires: Mapping[str, str] = {"url": "string", "sha256": "string?", "target_file_name": "string?"}
+    _provides: Mapping[str, str] = {"folder_path": "string"}
+
+    @property
+    def cacheable(self) -> bool:
+
+        # the content behind a url can change, unless it's pinned by its checksum
+        return self.get_user_input("sha256", None) is not None
+
+    def get_msg(self) -> str:
+
+        url = self.user_input.get("url", "[dynamic url]")
+        return f"downloading '{url}'"
+
+    async def retrieve(self, *value_names: str, **requirements) -> Mapping[str, Any]:
+
+        result = {}
+
+        if "folder_path" in value_names:
+            url = requirements["url"]
+
+            cache_path = await download_file(url, sha256=requirements.get("sha256", None) or None)
+
+            target_file_name = requirements.get("target_file_name", None)
+            if not target_file_name:
+                target_file_name = os.path.basename(urlparse(url).path) or "download"
+
+            temp_folder = self.create_temp_dir("download")
+            target_file = os.path.join(temp_folder, target_file_name)
+
+            def copy_download():
+                # the cached file is shared, later steps must not be able to modify it
+                shutil.copyfile(cache_path, target_file)
+                BYTES_COPIED.inc(os.path.getsize(target_file))
+
+            await run_disk(copy_download)
+
+            result["folder_path"] = temp_folder
+
+        return result
@@ -7,6 +7,8 @@ from pathlib import Path
 from typing import Any, Iterable, Mapping, MutableMapping, Optional, Union, Dict, List
 
 from bring.transform.transformer import SimpleTransformer
+from bring.utils.executors import run_disk
+from bring.utils.metrics import BYTES_COPIED
 from frkl.common.exceptions import FrklException
 from frkl.common.filesystem import ensure_folder
 from frkl.common.types import isinstance_or_subclass
@@ -169,6 +171,20 @@ class ContentSpec(object):
         return result
 
 
+def _merge_file(source: str, target_path: str, move_method: str = "copy", mode: Optional[int] = None) -> None:
+
+    ensure_folder(os.path.dirname(target_path))
+
+    if move_method == "move":
+        shutil.move(source, target_path)
+    else:
+        shutil.copy2(source, target_path)
+        BYTES_COPIED.inc(os.path.getsize(target_path))
+
+    if mode is not None:
+        os.chmod(target_path, mode)
+
+
 class PkgContentLocalFolder(LocalFolder):
     def __init__(self, path: Union[str, Path], content_spec: Any):
 
@@ -211,23 +227,19 @@ class PkgContentLocalFolder(LocalFolder):
             #             reason=f"Package is marked as single file, and target path '{self.path}' already contains a child.",
             #         )
 
-            ensure_folder(os.path.dirname(target_path))
-
             move_method = merge_config.get("move_method", "copy")
-            if move_method == "move":
-                shutil.move(item, target_path)
-            elif move_method == "copy":
-                shutil.copy2(item, target_path)
-            else:
+            if move_method not in ["move", "copy"]:
                 raise ValueError(f"Invalid 'move_method' value: {move_method}")
 
+            mode: Optional[int] = None
             if "mode" in item_details.keys():
                 mode_value = item_details["mode"]
                 if not isinstance(mode_value, str):
                     mode_value = str(mode_value)
 
                 mode = int(mode_value, base=8)
-                os.chmod(target_path, mode)
+
+            await run_disk(_merge_file, item, target_path, move_method=move_method, mode=mode)
 
             self._merged_items[target_path] = MetadataFileItem(
                 id=target_path, parent=self, metadata=item_metadata
@@ -4,15 +4,17 @@ import shutil
 from typing import Any, Mapping
 
 from bring.transform.transformer import SimpleTransformer
-from bring.utils.git_python import ensure_repo_cloned, clone_local_repo_async, clone_local_repo
+from bring.utils.git_backend import get_clone_requirement_for_version, get_git_backend
 from frkl.common.subprocesses import GitProcess
 
 
 class GitClone(SimpleTransformer):
 
     _plugin_name: str = "git_clone"
+    # branches move, so the same input doesn't always produce the same result
+    _cacheable: bool = False
 
-    _requires: Mapping[str, str] = {"url": "string", "version": "string"}
+    _requires: Mapping[str, str] = {"url": "string", "version": "string", "content_paths": "list?"}
     _provides: Mapping[str, str] = {"folder_path": "string"}
 
     def get_msg(self) -> str:
@@ -35,7 +37,9 @@ class GitClone(SimpleTransformer):
             url = requirements["url"]
             version = requirements["version"]
 
-            cache_path = await ensure_repo_cloned(url=url, update=False)
+            strategy, depth = get_clone_requirement_for_version(version)
+            git_backend = get_git_backend()
+            cache_path = await git_backend.ensure_repo_cloned(url=url, update=False, strategy=strategy, depth=depth)
             temp_folder = self.create_temp_dir("git_repo")
 
             repo_name = os.path.basename(url)
@@ -43,7 +47,8 @@ class GitClone(SimpleTransformer):
                 repo_name = repo_name[0:-4]
             target_folder = os.path.join(temp_folder, repo_name)
 
-            clone_local_repo(cache_path, target_path=target_folder, version=version)
+            content_paths = requirements.get("content_paths", None) or None
+            await git_backend.export_tree(cache_path, target_folder, version=version, paths=content_paths)
 
             result["folder_path"] = target_folder
 
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Translation of value aliases (e.g. 'arch: x86_64' -> 'arch: amd64', or 'version: latest' -> 'version: v1.2.3').
+
+Aliases come from two places: the package description ('aliases' key of a '.pkg.br' file, applies to all versions),
+and the versions themselves (e.g. 'latest', added by the version source). Both are compiled into one table per
+package, once per list of versions:
+
+- package aliases take precedence over version aliases for the same value
+- chained aliases are resolved when the table is compiled ('x64 -> x86_64 -> amd64' becomes 'x64 -> amd64')
+- cycles ('a -> b -> a') and version aliases that translate the same value differently are errors
+
+Input values are then translated with a single lookup per value.
+"""
+
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, MutableMapping, Optional
+
+from frkl.common.exceptions import FrklException
+
+
+def is_hashable(value: Any) -> bool:
+
+    if not isinstance(value, Hashable):
+        return False
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _resolve_chain(var_name: str, alias: Any, aliases: Mapping[Any, Any]) -> Any:
+
+    chain: List[Any] = [alias]
+    value = aliases[alias]
+    while is_hashable(value) and value in aliases.keys() and aliases[value] != value:
+        if value in chain:
+            cycle = " -> ".join(str(x) for x in chain[chain.index(value):] + [value])
+            raise FrklException(msg=f"Invalid aliases for '{var_name}'.", reason=f"Alias cycle: {cycle}")
+        chain.append(value)
+        value = aliases[value]
+    return value
+
+
+class AliasTable(object):
+    """Compiled value aliases of a package.
+
+    Args:
+        pkg_aliases (Mapping): the package aliases (per variable name, a map of alias to value)
+        version_aliases (Iterable): the aliases of each version of the package
+    """
+
+    def __init__(self, pkg_aliases: Optional[Mapping[str, Mapping[Any, Any]]] = None, version_aliases: Iterable[Mapping[str, Mapping[Any, Any]]] = ()):
+
+        merged: Dict[str, Dict[Any, Any]] = {}
+        for aliases in version_aliases:
+            for var_name, values in aliases.items():
+                var_aliases = merged.setdefault(var_name, {})
+                for alias, value in values.items():
+                    if var_aliases.get(alias, value) != value:
+                        raise FrklException(msg=f"Invalid aliases for '{var_name}'.", reason=f"Alias '{alias}' is used for different values: {var_aliases[alias]}, {value}")
+                    var_aliases[alias] = value
+
+        if pkg_aliases:
+            for var_name, values in pkg_aliases.items():
+                merged.setdefault(var_name, {}).update(values)
+
+        self._table: Dict[str, Dict[Any, Any]] = {}
+        for var_name, var_aliases in merged.items():
+            self._table[var_name] = {alias: _resolve_chain(var_name, alias, var_aliases) for alias in var_aliases.keys()}
+
+    @property
+    def table(self) -> Mapping[str, Mapping[Any, Any]]:
+        """The compiled table, per variable name a map of alias to the final value."""
+
+        return self._table
+
+    def translate(self, input_values: Mapping[str, Any]) -> Mapping[str, Any]:
+        """Replace aliases in the input values, returns the input values unchanged if there is nothing to replace."""
+
+        result: Optional[MutableMapping[str, Any]] = None
+        for var_name, value in input_values.items():
+            var_aliases = self._table.get(var_name, None)
+            if not var_aliases or not is_hashable(value) or value not in var_aliases.keys():
+                continue
+            if result is None:
+                result = dict(input_values)
+            result[var_name] = var_aliases[value]
+
+        return input_values if result is None else result
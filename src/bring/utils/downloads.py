@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Content addressed cache for downloaded files.
+
+Downloads are hashed while they are written to disk, and stored once under the hash of their content
+('<download cache>/by_hash/sha256/<first 2 chars>/<hash>'), no matter how many urls (e.g. mirrors) they were downloaded
+from. For every url, an alias file ('<download cache>/by_url/<url path>.json') records the hash of the content it
+served last.
+
+Since files are only ever stored under the hash that was calculated while downloading them, a file that exists under
+the expected hash doesn't need to be read again to verify it. So if the checksum of a download is known in advance, a
+cache hit doesn't need the network at all.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib.request
+from typing import Any, Mapping, Optional, Tuple
+
+from bring.config.settings import get_setting
+from bring.defaults import BRING_DOWNLOAD_CACHE
+from bring.utils.executors import run_disk
+from bring.utils.filesystem import publish_path
+from bring.utils.locks import cache_lock, is_shared_cache
+from bring.utils.metrics import BYTES_DOWNLOADED, DOWNLOAD_CACHE_HITS, DOWNLOAD_CACHE_MISSES
+from frkl.common.downloads.cache import calculate_cache_path
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+
+
+log = logging.getLogger("bring")
+
+HASH_ALGORITHM = "sha256"
+CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+
+def get_hash_path(checksum: str, base_path: str = BRING_DOWNLOAD_CACHE) -> str:
+    """Return the path a file with the provided (sha256) checksum is stored under."""
+
+    checksum = checksum.lower()
+    return os.path.join(base_path, "by_hash", HASH_ALGORITHM, checksum[0:2], checksum)
+
+
+def get_url_alias_path(url: str, base_path: str = BRING_DOWNLOAD_CACHE) -> str:
+
+    return f"{calculate_cache_path(base_path=os.path.join(base_path, 'by_url'), url=url)}.json"
+
+
+def read_url_alias(url: str, base_path: str = BRING_DOWNLOAD_CACHE) -> Optional[Mapping[str, Any]]:
+    """Return what is known about the last download from a url (keys: 'url', 'sha256', 'size', 'downloaded'), or None."""
+
+    try:
+        with open(get_url_alias_path(url, base_path=base_path), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_url_alias(url: str, checksum: str, size: int, base_path: str) -> None:
+
+    alias_path = get_url_alias_path(url, base_path=base_path)
+    ensure_folder(os.path.dirname(alias_path))
+
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(alias_path), prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"url": url, HASH_ALGORITHM: checksum, "size": size, "downloaded": time.time()}, f)
+    os.replace(temp_file, alias_path)
+
+
+def find_cached_download(url: str, sha256: Optional[str] = None, base_path: str = BRING_DOWNLOAD_CACHE) -> Optional[str]:
+    """Return the path of the cached content for a download, or None.
+
+    If 'sha256' is provided, only content with that checksum is returned (no matter which url it was downloaded from),
+    otherwise the content the url served the last time it was downloaded.
+    """
+
+    if sha256 is None:
+        alias = read_url_alias(url, base_path=base_path)
+        if alias is None:
+            return None
+        sha256 = alias[HASH_ALGORITHM]
+
+    hash_path = get_hash_path(sha256, base_path=base_path)  # type: ignore
+    if not os.path.isfile(hash_path):
+        return None
+    return hash_path
+
+
+def _download_to_file(url: str, target_file: str) -> Tuple[str, int]:
+
+    hasher = hashlib.sha256()
+    size = 0
+    with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as response, open(target_file, "wb") as f:
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            f.write(chunk)
+            size = size + len(chunk)
+
+    BYTES_DOWNLOADED.inc(size)
+    return (hasher.hexdigest(), size)
+
+
+def _download(url: str, sha256: Optional[str], base_path: str) -> str:
+
+    temp_folder = os.path.join(base_path, "by_hash", HASH_ALGORITHM)
+    ensure_folder(temp_folder)
+    fd, temp_file = tempfile.mkstemp(dir=temp_folder, prefix=".tmp_")
+    os.close(fd)
+
+    try:
+        try:
+            checksum, size = _download_to_file(url, temp_file)
+        except Exception as e:
+            raise FrklException(msg=f"Can't download '{url}'.", reason=str(e)) from e
+
+        if sha256 is not None and checksum != sha256:
+            raise FrklException(msg=f"Can't download '{url}'.", reason=f"Checksum mismatch, expected {HASH_ALGORITHM} '{sha256}', got '{checksum}'.", solution="Check the url, and the checksum in the package description.")
+
+        hash_path = get_hash_path(checksum, base_path=base_path)
+        if not publish_path(temp_file, hash_path):
+            log.debug(f"Content of '{url}' already in download cache: {hash_path}")
+    finally:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+
+    _write_url_alias(url, checksum, size, base_path=base_path)
+    return hash_path
+
+
+async def download_file(url: str, sha256: Optional[str] = None, update: bool = False, base_path: Optional[str] = None) -> str:
+    """Download a file into the download cache (unless its content is already cached), and return its (read-only) path.
+
+    Args:
+        url (str): the url to download
+        sha256 (str): the expected checksum, if known, in which case a cache hit doesn't need the network
+        update (bool): download again, even if the url was downloaded before (has no effect if 'sha256' is provided and
+            the content is cached)
+        base_path (str): the download cache folder (default: the bring download cache)
+
+    Returns:
+        str: the path of the downloaded file
+    """
+
+    if base_path is None:
+        base_path = BRING_DOWNLOAD_CACHE
+
+    if sha256 is not None:
+        sha256 = sha256.lower()
+
+    if sha256 is not None or not update:
+        cached = await run_disk(find_cached_download, url, sha256, base_path)
+        if cached is not None:
+            DOWNLOAD_CACHE_HITS.inc()
+            return cached
+
+    if get_setting("offline"):
+        raise FrklException(msg=f"Can't download '{url}'.", reason="Offline mode is enabled, and the file is not in the download cache.", solution="Run 'bring warm --version-folders' for the package while online, or disable offline mode.")
+
+    async with cache_lock(get_url_alias_path(url, base_path=base_path)):
+
+        if is_shared_cache() and (sha256 is not None or not update):
+            # another node might have downloaded the file while we were waiting for the lock
+            cached = await run_disk(find_cached_download, url, sha256, base_path)
+            if cached is not None:
+                DOWNLOAD_CACHE_HITS.inc()
+                return cached
+
+        DOWNLOAD_CACHE_MISSES.inc()
+        return await run_disk(_download, url, sha256, base_path)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Thread pools for blocking work, so it doesn't stall the event loop.
+
+There are two pools: one for disk (and other I/O-bound) work like copying files or git operations, and one for
+CPU-bound work like (de-)serializing metadata. Their sizes are configured with the 'disk_threads' and 'cpu_threads'
+settings.
+
+If the 'debug_loop_stalls' setting is enabled, callbacks that block the event loop for longer than
+'loop_stall_threshold' seconds are logged (and counted in the 'bring_event_loop_stalls_total' metric).
+"""
+
+import asyncio
+import atexit
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import sniffio
+from anyio import run_sync_in_worker_thread
+
+from bring.config.settings import get_setting
+from bring.utils.metrics import LOOP_STALLS
+
+
+log = logging.getLogger("bring")
+
+T = TypeVar("T")
+
+DISK = "disk"
+CPU = "cpu"
+
+_EXECUTORS: Dict[str, ThreadPoolExecutor] = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def _get_pool_size(kind: str) -> int:
+
+    if kind == DISK:
+        size = get_setting("disk_threads")
+    else:
+        size = get_setting("cpu_threads")
+
+    if size <= 0:
+        size = os.cpu_count() or 1
+    return size
+
+
+def get_executor(kind: str) -> ThreadPoolExecutor:
+    """Return the (lazily created) thread pool for 'disk' or 'cpu' work."""
+
+    if kind not in [DISK, CPU]:
+        raise ValueError(f"Invalid executor type '{kind}', allowed: {DISK}, {CPU}")
+
+    executor = _EXECUTORS.get(kind, None)
+    if executor is not None:
+        return executor
+
+    with _EXECUTORS_LOCK:
+        if kind not in _EXECUTORS.keys():
+            if not _EXECUTORS:
+                atexit.register(shutdown_executors)
+            _EXECUTORS[kind] = ThreadPoolExecutor(max_workers=_get_pool_size(kind), thread_name_prefix=f"bring_{kind}")
+        return _EXECUTORS[kind]
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """Shut down all thread pools (they are re-created on demand, with the current settings)."""
+
+    with _EXECUTORS_LOCK:
+        executors = list(_EXECUTORS.values())
+        _EXECUTORS.clear()
+
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+
+async def _run_in_executor(kind: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+
+    if kwargs:
+        func = functools.partial(func, **kwargs)
+
+    ensure_stall_detection()
+
+    future: Future = get_executor(kind).submit(func, *args)
+    if sniffio.current_async_library() == "asyncio":
+        return await asyncio.wrap_future(future)
+
+    # other event loops: wait for the result in a (cheap, idle) anyio worker thread
+    return await run_sync_in_worker_thread(future.result)
+
+
+async def run_disk(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking, I/O-bound function (filesystem, git, ...) in the disk thread pool."""
+
+    return await _run_in_executor(DISK, func, *args, **kwargs)
+
+
+async def run_cpu(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking, CPU-bound function (hashing, (de-)serializing, ...) in the cpu thread pool."""
+
+    return await _run_in_executor(CPU, func, *args, **kwargs)
+
+
+class _StallLogHandler(logging.Handler):
+    """Forwards asyncio's 'slow callback' warnings to the bring logger, and counts them."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+
+        if not isinstance(record.msg, str) or not record.msg.startswith("Executing "):
+            return
+
+        LOOP_STALLS.inc()
+        log.warning(f"Event loop stalled: {record.getMessage()}")
+
+
+_STALL_HANDLER: Optional[_StallLogHandler] = None
+
+
+def ensure_stall_detection(loop: Optional[asyncio.AbstractEventLoop] = None) -> bool:
+    """Enable detection of event loop stalls for the current event loop, if the 'debug_loop_stalls' setting is enabled.
+
+    Only supported for asyncio event loops (using asyncio's debug mode).
+
+    Returns:
+        bool: whether stall detection is enabled
+    """
+
+    global _STALL_HANDLER
+
+    if not get_setting("debug_loop_stalls"):
+        return False
+
+    if loop is None:
+        try:
+            if sniffio.current_async_library() != "asyncio":
+                return False
+            loop = asyncio.get_running_loop()
+        except (sniffio.AsyncLibraryNotFoundError, RuntimeError):
+            return False
+
+    if not loop.get_debug():
+        loop.set_debug(True)
+    loop.slow_callback_duration = get_setting("loop_stall_threshold")
+
+    if _STALL_HANDLER is None:
+        _STALL_HANDLER = _StallLogHandler(level=logging.WARNING)
+        logging.getLogger("asyncio").addHandler(_STALL_HANDLER)
+
+    return True
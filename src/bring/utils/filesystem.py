@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import time
+import uuid
+from typing import Optional
+
+from bring.config.settings import get_setting
+
+
+RETIRED_PREFIX = ".retired_"
+"""Prefix for (hidden) entries in cache folders that were replaced or evicted, but might still be read."""
+
+
+def get_folder_size(path: str) -> int:
+    """Return the combined size (in bytes) of all files below the provided folder.
+
+    Symbolic links are not followed, and the size of a single file is returned if 'path' points to a file.
+    """
+
+    if not os.path.exists(path):
+        return 0
+
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total = total + os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def format_bytes(size: float) -> str:
+    """Format a number of bytes for display (e.g. '1.5 MB')."""
+
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            if unit == "B":
+                return f"{int(size)} {unit}"
+            return f"{size:.1f} {unit}"
+        size = size / 1024
+    return f"{size:.1f} TB"
+
+
+def publish_path(source: str, target: str) -> bool:
+    """Move a file or folder into its final location, so that other processes either see all of it, or nothing.
+
+    The source is moved into a temporary location next to the target first (which might involve copying, if it's on
+    another filesystem), and is then renamed to the target, which is atomic (also on NFS) within the same folder.
+
+    Returns:
+        bool: False if the target already existed (e.g. another process published it first), in which case the source
+            is deleted and the target left alone
+    """
+
+    parent_folder = os.path.dirname(target)
+    os.makedirs(parent_folder, exist_ok=True)
+
+    if os.path.exists(target):
+        _delete_path(source)
+        return False
+
+    temp_path = os.path.join(parent_folder, f".tmp_{uuid.uuid4().hex}")
+    shutil.move(source, temp_path)
+
+    if os.path.isdir(temp_path):
+        try:
+            # fails if the target is a non-empty folder
+            os.rename(temp_path, target)
+            return True
+        except OSError:
+            if not os.path.exists(target):
+                _delete_path(temp_path)
+                raise
+    else:
+        try:
+            # unlike 'rename', this never replaces an existing file
+            os.link(temp_path, target)
+            os.unlink(temp_path)
+            return True
+        except FileExistsError:
+            pass
+
+    _delete_path(temp_path)
+    return False
+
+
+def _delete_path(path: str) -> None:
+
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+def retire_path(path: str) -> None:
+    """Remove a file or folder from a cache, in a way that is safe for processes that are still reading it.
+
+    The path is renamed first, so it disappears atomically. If the cache is shared with other nodes (setting:
+    'shared_cache'), it is only deleted after 'retired_grace_seconds' (by 'purge_retired'), since processes on other
+    nodes might still be using it, and deleting files that are open on another NFS client makes them fail.
+    """
+
+    parent_folder = os.path.dirname(path)
+    retired_path = os.path.join(parent_folder, f"{RETIRED_PREFIX}{int(time.time())}_{uuid.uuid4().hex}")
+    try:
+        os.rename(path, retired_path)
+    except FileNotFoundError:
+        return
+
+    if get_setting("shared_cache"):
+        purge_retired(parent_folder)
+    else:
+        _delete_path(retired_path)
+
+
+def purge_retired(folder: str, grace_seconds: Optional[float] = None) -> int:
+    """Delete entries in a folder that were retired longer than 'grace_seconds' ago (default: setting 'retired_grace_seconds').
+
+    Returns:
+        int: the number of deleted entries
+    """
+
+    if grace_seconds is None:
+        grace_seconds = get_setting("retired_grace_seconds")
+
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return 0
+
+    now = time.time()
+    purged = 0
+    for name in names:
+        if not name.startswith(RETIRED_PREFIX):
+            continue
+        try:
+            retired = int(name[len(RETIRED_PREFIX):].split("_", 1)[0])
+        except ValueError:
+            continue
+        if now - retired <= grace_seconds:
+            continue
+        _delete_path(os.path.join(folder, name))
+        purged = purged + 1
+
+    return purged
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+"""Interface for the git implementations *bring* can use.
+
+All backends share the same git checkout cache layout: one bare repository per url, with branches and tags mirrored
+1:1 into 'refs/heads/' and 'refs/tags/', and the clone strategy recorded in the '[bring]' section of the repository
+config. That way a repository cloned by one backend can be used by all others.
+
+Housekeeping of the cache (reading the recorded strategy, migrating old cache entries) uses dulwich, which is always
+installed.
+"""
+
+import logging
+import os
+import shutil
+from abc import ABCMeta, abstractmethod
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple
+
+from dulwich.config import ConfigFile
+from dulwich.repo import Repo
+
+from bring.config.settings import get_setting
+from bring.defaults import BRING_GIT_CHECKOUT_CACHE
+from bring.utils.executors import run_disk
+from bring.utils.filesystem import get_folder_size, retire_path
+from bring.utils.locks import cache_lock, is_shared_cache
+from bring.utils.metrics import BYTES_CLONED, CLONE_SIZE
+from frkl.common.downloads.cache import calculate_cache_path
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+from frkl.common.strings import generate_valid_identifier
+
+
+log = logging.getLogger("bring")
+
+GIT_CLONE_STRATEGIES = ("full", "shallow", "tags", "blobless")
+"""Available strategies to populate the git checkout cache.
+
+- full: all refs, with full history
+- shallow: all refs, only the last 'depth' commits of each
+- tags: only tags, only the last 'depth' commits of each
+- blobless: all refs with full history, but file contents are only fetched on demand (not supported by dulwich)
+"""
+
+_HISTORY_STRATEGIES = ("full", "blobless")
+
+GIT_BACKENDS = ("dulwich", "native")
+"""Available git backends ('auto' combines both if a git executable is available, check 'AutoGitBackend', and uses
+'dulwich' otherwise)."""
+
+
+def is_commit_hash(version: str) -> bool:
+
+    if len(version) != 40:
+        return False
+    try:
+        int(version, 16)
+        return True
+    except ValueError:
+        return False
+
+
+def get_clone_requirement_for_version(version: Optional[str], ref_type: Optional[str] = None, depth: int = 1) -> Tuple[str, Optional[int]]:
+    """Calculate the cheapest clone strategy (and depth) that makes sure a version is available in the git checkout cache."""
+
+    if ref_type is None and version is not None and is_commit_hash(version):
+        ref_type = "commit"
+
+    if ref_type == "commit":
+        return ("full", None)
+    elif ref_type == "tag":
+        return ("tags", depth)
+    else:
+        return ("shallow", depth)
+
+
+def clone_strategy_satisfies(existing: Tuple[str, Optional[int]], required: Tuple[str, Optional[int]]) -> bool:
+    """Check whether a repository that was cloned with one strategy contains everything another strategy would."""
+
+    existing_strategy, existing_depth = existing
+    required_strategy, required_depth = required
+
+    if existing_strategy in _HISTORY_STRATEGIES:
+        return True
+
+    if required_strategy in _HISTORY_STRATEGIES:
+        return False
+
+    if existing_strategy == "tags" and required_strategy != "tags":
+        return False
+
+    if existing_depth is None:
+        return True
+    if required_depth is None:
+        return False
+    return existing_depth >= required_depth
+
+
+def get_clone_strategy(path: str) -> Tuple[str, Optional[int]]:
+    """Return the strategy (and depth) a repository in the git checkout cache was cloned with."""
+
+    config = ConfigFile.from_path(os.path.join(path, "config"))
+    try:
+        strategy = config.get((b"bring",), b"clone-strategy").decode("utf-8")
+    except KeyError:
+        # repositories cloned before strategies were introduced
+        return ("full", None)
+    try:
+        depth: Optional[int] = int(config.get((b"bring",), b"clone-depth"))
+    except KeyError:
+        depth = None
+    return (strategy, depth)
+
+
+def get_git_cache_path(url: str) -> str:
+    """Return the path of the repository for this url in the git checkout cache."""
+
+    return calculate_cache_path(base_path=BRING_GIT_CHECKOUT_CACHE, url=url)
+
+
+def is_old_cache_layout(path: str) -> bool:
+    """Check whether a repository in the git checkout cache still uses the old, non-bare layout."""
+
+    return os.path.isdir(os.path.join(path, ".git"))
+
+
+def _link_or_copy(source: str, target: str) -> None:
+
+    # git objects are never modified in place, and dulwich replaces refs and config files with renames
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _convert_to_bare_repo(repo_path: str) -> None:
+
+    index_file = os.path.join(repo_path, "index")
+    if os.path.exists(index_file):
+        os.unlink(index_file)
+
+    repo = Repo(repo_path)
+    config = repo.get_config()
+    config.set((b"core",), b"bare", True)
+    config.set((b"remote", b"origin"), b"mirror", True)
+    # backends fetch with explicit, mirroring refspecs; git would still update 'refs/remotes/' for the old one
+    remote_section = config[(b"remote", b"origin")]
+    if b"fetch" in remote_section:
+        del remote_section[b"fetch"]
+    config.write_to_path()
+
+    remote_prefix = b"refs/remotes/origin/"
+    for ref in list(repo.refs.allkeys()):
+        if not ref.startswith(remote_prefix):
+            continue
+        branch = ref[len(remote_prefix):]
+        if branch != b"HEAD":
+            # 'refs/remotes/origin/HEAD' is a symbolic ref, which might point to an already moved branch
+            repo.refs[b"refs/heads/" + branch] = repo.refs[ref]
+        del repo.refs[ref]
+
+
+def migrate_to_bare_repo(path: str) -> bool:
+    """Convert a (non-bare) repository from the old git checkout cache layout into a bare, mirrored repository.
+
+    Branches that were stored as 'refs/remotes/origin/<branch>' are moved to 'refs/heads/<branch>', and the fetch
+    refspec for those is removed. The working tree is discarded.
+
+    The converted repository is created next to the old one (hard linking the git objects, if possible), and replaces
+    it like a re-clone does, so processes that still read the old repository are not affected. Callers should hold the
+    cache lock for the path (check 'cache_lock'); without it, concurrent migrations are wasteful, but still safe.
+
+    Returns:
+        bool: whether the repository was migrated by this call
+    """
+
+    git_dir = os.path.join(path, ".git")
+    if not os.path.isdir(git_dir):
+        return False
+
+    log.debug(f"Migrating git checkout cache to bare repository: {path}")
+
+    temp_path = os.path.join(os.path.dirname(path), f".tmp_{generate_valid_identifier()}")
+    try:
+        shutil.copytree(git_dir, temp_path, symlinks=True, copy_function=_link_or_copy)
+        _convert_to_bare_repo(temp_path)
+    except (FileNotFoundError, shutil.Error) as e:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not os.path.isdir(git_dir):
+            # migrated by another process in the meantime
+            return False
+        raise e
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+    if not os.path.isdir(git_dir):
+        shutil.rmtree(temp_path, ignore_errors=True)
+        return False
+
+    retire_path(path)
+    try:
+        os.rename(temp_path, path)
+    except OSError:
+        # another process put its migrated repository in place first, which is just as good
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not os.path.isdir(path) or is_old_cache_layout(path):
+            raise
+
+    return True
+
+
+def _replace_clone(temp_path: str, path: str, required: Tuple[str, Optional[int]], can_use_clone: Callable[[Tuple[str, Optional[int]], Tuple[str, Optional[int]]], bool]) -> None:
+
+    if os.path.exists(path):
+        if can_use_clone(get_clone_strategy(path), required):
+            # another process was faster
+            shutil.rmtree(temp_path, ignore_errors=True)
+            return
+        # replace the insufficient clone, other processes might still be reading the old one
+        retire_path(path)
+    os.rename(temp_path, path)
+
+
+class GitBackend(metaclass=ABCMeta):
+    """Base class for git implementations.
+
+    Backends implement the primitive operations (clone, fetch, ref listing, commit metadata, tree export), the
+    management of the git checkout cache is shared.
+    """
+
+    _backend_name: str = None  # type: ignore
+
+    @classmethod
+    def is_available(cls) -> bool:
+        """Whether this backend can be used in the current environment."""
+
+        return True
+
+    @property
+    def name(self) -> str:
+        return self._backend_name
+
+    def can_use_clone(self, existing: Tuple[str, Optional[int]], required: Tuple[str, Optional[int]]) -> bool:
+        """Check whether this backend can use an existing clone, for the required strategy."""
+
+        return clone_strategy_satisfies(existing, required)
+
+    def supports_strategy(self, strategy: str) -> bool:
+        """Check whether this backend can clone with a strategy."""
+
+        return strategy in GIT_CLONE_STRATEGIES
+
+    @abstractmethod
+    async def clone(self, url: str, target: str, strategy: str = "full", depth: Optional[int] = None) -> Tuple[str, Optional[int]]:
+        """Clone a remote repository into a new, bare and mirrored repository.
+
+        Returns:
+            Tuple: the strategy and depth that were actually used (backends may fall back to a more complete strategy)
+        """
+
+    @abstractmethod
+    async def fetch(self, path: str, url: str) -> None:
+        """Update a repository in the git checkout cache, using the strategy it was cloned with."""
+
+    @abstractmethod
+    async def list_refs(self, path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """List tags and branches of a repository.
+
+        Returns:
+            Tuple: two dicts (tags, branches) with the ref name as key, and the hash of the commit it points to as value
+        """
+
+    @abstractmethod
+    async def get_commits_metadata(self, path: str, commits: Iterable[str], include_history: bool = False) -> Dict[str, Mapping[str, Any]]:
+        """Get metadata for commits: 'author_time' (seconds since the epoch) and 'author_timezone' (offset to UTC in seconds).
+
+        If 'include_history' is True, all ancestors of the provided commits are included as well.
+        """
+
+    @abstractmethod
+    async def export_tree(self, source_repo: str, target_path: str, version: Optional[str] = None, paths: Optional[Iterable[str]] = None) -> None:
+        """Write the files of a version (tag, branch or commit hash) of a repository in the git checkout cache into a new folder.
+
+        If 'paths' is None, the result is a complete, non-bare clone with the version checked out. Otherwise only
+        the provided paths are written, without any git metadata.
+        """
+
+    async def ensure_repo_cloned(self, url: str, update: bool = False, strategy: str = "full", depth: Optional[int] = None) -> str:
+        """Make sure a git repository is available in the git checkout cache, and return its local path.
+
+        If the repository was cloned before with a strategy that does not satisfy the requested one (e.g. a shallow clone
+        when the full history is required), it is re-cloned.
+
+        In offline mode (setting: 'offline'), the repository is never cloned or updated, and an error is raised if the
+        git checkout cache doesn't contain what's required.
+        """
+
+        if strategy not in GIT_CLONE_STRATEGIES:
+            raise FrklException(msg=f"Can't clone git repository '{url}'.", reason=f"Invalid clone strategy '{strategy}', allowed: {', '.join(GIT_CLONE_STRATEGIES)}")
+        if strategy in _HISTORY_STRATEGIES:
+            depth = None
+
+        path = get_git_cache_path(url)
+        parent_folder = os.path.dirname(path)
+
+        await self._migrate_cached_clone(path)
+        exists, satisfied, existing = await self._check_cached_clone(path, strategy, depth)
+
+        if get_setting("offline"):
+            # never clone or fetch, the git checkout cache is all we have
+            if not exists:
+                raise FrklException(msg=f"Can't use git repository '{url}'.", reason=f"Offline mode is enabled, and the repository is not in the git checkout cache: {path}", solution="Run 'bring warm' for the package while online, or disable offline mode.")
+            if not satisfied:
+                raise FrklException(msg=f"Can't use git repository '{url}'.", reason=f"Offline mode is enabled, and the repository in the git checkout cache was cloned with strategy '{existing[0]}' (depth: {existing[1]}), which does not contain what strategy '{strategy}' (depth: {depth}) requires.", solution="Run 'bring warm --version-folders' for the package version while online, or disable offline mode.")
+            return path
+
+        if exists and satisfied and not update:
+            return path
+
+        await run_disk(ensure_folder, parent_folder)
+
+        async with cache_lock(path):
+
+            if is_shared_cache():
+                # another node might have cloned the repository while we were waiting for the lock
+                exists, satisfied, existing = await self._check_cached_clone(path, strategy, depth)
+                if exists and satisfied and not update:
+                    return path
+
+            if not exists or not satisfied:
+                # clone to a temp location first, in case another process tries to do the same
+                temp_path = os.path.join(parent_folder, f".tmp_{generate_valid_identifier()}")
+                try:
+                    used = await self.clone(url, temp_path, strategy=strategy, depth=depth)
+                except Exception as e:
+                    await run_disk(shutil.rmtree, temp_path, True)
+                    raise e
+
+                cloned_size = await run_disk(get_folder_size, temp_path)
+                BYTES_CLONED.inc(cloned_size)
+                CLONE_SIZE.observe(cloned_size)
+
+                await run_disk(_replace_clone, temp_path, path, used, self.can_use_clone)
+            else:
+                # git updates refs atomically, so fetching is safe while other processes read the repository
+                size_before = await run_disk(get_folder_size, path)
+                await self.fetch(path, url)
+                fetched_size = max(await run_disk(get_folder_size, path) - size_before, 0)
+                BYTES_CLONED.inc(fetched_size)
+                CLONE_SIZE.observe(fetched_size)
+
+        return path
+
+    async def _migrate_cached_clone(self, path: str) -> None:
+
+        if not await run_disk(is_old_cache_layout, path):
+            return
+
+        async with cache_lock(path):
+            # 'migrate_to_bare_repo' checks again, another process might have migrated it while we were waiting
+            await run_disk(migrate_to_bare_repo, path)
+
+    async def _check_cached_clone(self, path: str, strategy: str, depth: Optional[int]) -> Tuple[bool, bool, Optional[Tuple[str, Optional[int]]]]:
+
+        if not await run_disk(os.path.exists, path):
+            return (False, False, None)
+
+        existing = await run_disk(get_clone_strategy, path)
+        return (True, self.can_use_clone(existing, (strategy, depth)), existing)
+
+    async def get_repo_info(self, path: str, include_history: bool = True) -> Mapping[str, Mapping[str, Any]]:
+        """Collect tags, branches and commit metadata of a repository.
+
+        If 'include_history' is False, only the commits that tags and branches point to are included. This is much faster
+        for large repositories, and is the only option for shallow clones that don't contain the full history.
+        """
+
+        tags, branches = await self.list_refs(path)
+        ref_commits = set(tags.values()) | set(branches.values())
+
+        commits: Dict[str, Mapping[str, Any]] = {}
+        if ref_commits:
+            commits = await self.get_commits_metadata(path, ref_commits, include_history=include_history)
+
+        return {
+            "tags": tags,
+            "branches": branches,
+            "commits": commits
+        }
+
+
+class AutoGitBackend(GitBackend):
+    """Uses the faster backend for each operation, since all backends share the git checkout cache layout.
+
+    Measured with the 'git_*' benchmarks: dulwich avoids the per-process overhead of the git executable, which makes it
+    faster for cloning and fetching local repositories, listing refs and exporting single paths, in particular for many
+    small repositories. Native git is much faster for complete checkouts and history walks of larger repositories, and is
+    the only backend that supports 'blobless' clones (whose file contents it fetches on demand). Remote repositories
+    are cloned with native git, which supports shallow and partial fetches over all transports.
+    """
+
+    _backend_name = "auto"
+
+    def __init__(self, native: GitBackend, dulwich: GitBackend):
+
+        self._native: GitBackend = native
+        self._dulwich: GitBackend = dulwich
+
+    def can_use_clone(self, existing: Tuple[str, Optional[int]], required: Tuple[str, Optional[int]]) -> bool:
+
+        return self._native.can_use_clone(existing, required)
+
+    def supports_strategy(self, strategy: str) -> bool:
+
+        return self._native.supports_strategy(strategy)
+
+    def _fetch_backend(self, url: str, strategy: str) -> GitBackend:
+
+        if strategy == "blobless" or not os.path.isdir(url):
+            return self._native
+        return self._dulwich
+
+    async def _tree_backend(self, path: str) -> GitBackend:
+
+        strategy, _ = await run_disk(get_clone_strategy, path)
+        # dulwich can't fetch missing file contents
+        return self._native if strategy == "blobless" else self._dulwich
+
+    async def clone(self, url: str, target: str, strategy: str = "full", depth: Optional[int] = None) -> Tuple[str, Optional[int]]:
+
+        return await self._fetch_backend(url, strategy).clone(url, target, strategy=strategy, depth=depth)
+
+    async def fetch(self, path: str, url: str) -> None:
+
+        strategy, _ = await run_disk(get_clone_strategy, path)
+        await self._fetch_backend(url, strategy).fetch(path, url)
+
+    async def list_refs(self, path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+
+        return await self._dulwich.list_refs(path)
+
+    async def get_commits_metadata(self, path: str, commits: Iterable[str], include_history: bool = False) -> Dict[str, Mapping[str, Any]]:
+
+        backend = self._native if include_history else self._dulwich
+        return await backend.get_commits_metadata(path, commits, include_history=include_history)
+
+    async def export_tree(self, source_repo: str, target_path: str, version: Optional[str] = None, paths: Optional[Iterable[str]] = None) -> None:
+
+        backend = self._native if paths is None else await self._tree_backend(source_repo)
+        await backend.export_tree(source_repo, target_path, version=version, paths=paths)
+
+
+_BACKENDS: Dict[str, GitBackend] = {}
+
+
+def get_git_backend(name: Optional[str] = None) -> GitBackend:
+    """Return the git backend with the provided name, or the configured one (setting: 'git_backend')."""
+
+    if name is None:
+        name = get_setting("git_backend")
+
+    if name in _BACKENDS.keys():
+        return _BACKENDS[name]
+
+    from bring.utils.git_external import NativeGitBackend
+    from bring.utils.git_python import DulwichGitBackend
+
+    if name == "auto":
+        if NativeGitBackend.is_available():
+            backend: GitBackend = AutoGitBackend(get_git_backend("native"), get_git_backend("dulwich"))
+        else:
+            backend = get_git_backend("dulwich")
+    elif name == "dulwich":
+        backend = DulwichGitBackend()
+    elif name == "native":
+        if not NativeGitBackend.is_available():
+            raise FrklException(msg="Can't use 'native' git backend.", reason="No 'git' executable found.", solution="Install git, or use the 'dulwich' backend.")
+        backend = NativeGitBackend()
+    else:
+        raise FrklException(msg=f"Can't use git backend '{name}'.", reason=f"Invalid backend name, allowed: auto, {', '.join(GIT_BACKENDS)}")
+
+    _BACKENDS[name] = backend
+    return backend
@@ -1,106 +1,253 @@
 # -*- coding: utf-8 -*-
+"""Git backend that runs the 'git' executable in subprocesses (asynchronously, via anyio)."""
+
+import io
+import logging
 import os
 import shutil
-from typing import Mapping, Dict, Any
+import subprocess
+import tarfile
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
 
-from pydriller import GitRepository
+from anyio import run_process
+from dulwich.config import ConfigFile
 
-from bring.defaults import BRING_GIT_CHECKOUT_CACHE
-from frkl.common.downloads.cache import calculate_cache_path
+from bring.config.settings import get_setting
+from bring.utils.executors import run_disk
+from bring.utils.git_backend import GitBackend, get_clone_strategy, is_commit_hash
+from frkl.common.exceptions import FrklException
 from frkl.common.filesystem import ensure_folder
 from frkl.common.strings import generate_valid_identifier
-from frkl.common.subprocesses import GitProcess
 
 
-async def ensure_repo_cloned(url, update=False) -> str:
+log = logging.getLogger("bring")
 
-    path = calculate_cache_path(base_path=BRING_GIT_CHECKOUT_CACHE, url=url)
-    parent_folder = os.path.dirname(path)
+_REF_FORMAT = "%(refname)%00%(objectname)%00%(*objectname)"
+_COMMIT_FORMAT = "%H%x00%at%x00%ai"
 
-    exists = False
-    if os.path.exists(path):
-        exists = True
 
-    if exists and not update:
-        return path
+_GIT_ENV = {"GIT_TERMINAL_PROMPT": "0"}
+"""Environment variables for git processes (never wait for credentials on a terminal)."""
 
-    ensure_folder(parent_folder)
 
-    if not exists:
-        # clone to a temp location first, in case another process tries to do the same
-        temp_name = generate_valid_identifier()
-        temp_path = os.path.join(parent_folder, temp_name)
-        git = GitProcess(
-            "clone", url, temp_path, working_dir=parent_folder, GIT_TERMINAL_PROMPT="0"
-        )
+async def run_git(*args: str, input: Optional[bytes] = None) -> bytes:
+    """Run git with the provided arguments, and return its stdout."""
 
-        await git.run(wait=True)
+    command = []
+    if os.name == "posix":
+        # 'run_process' can't set the environment of the child process (anyio 2), so 'env' does it
+        command.extend(["env"] + [f"{k}={v}" for k, v in _GIT_ENV.items()])
+    command.append("git")
+    if get_setting("offline"):
+        # fail fast instead of waiting for network timeouts (e.g. when a blobless clone needs missing file contents)
+        command.extend(["-c", "protocol.allow=never", "-c", "protocol.file.allow=always"])
+    command.extend(args)
+    try:
+        result = await run_process(command, input=input, check=True)
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode("utf-8", errors="replace").strip() if e.stderr else ""
+        raise FrklException(msg=f"Error running git command: {' '.join(['git'] + list(args))}", reason=stderr or f"Exit code: {e.returncode}")
+    return result.stdout
 
-        if os.path.exists(path):
-            shutil.rmtree(temp_path, ignore_errors=True)
-        else:
-            shutil.move(temp_path, path)
 
-    else:
-        # TODO: some sort of lock?
-        git = GitProcess("fetch", working_dir=path)
+def _parse_commit_line(line: str) -> Tuple[str, Mapping[str, Any]]:
 
-        await git.run(wait=True)
+    commit_hash, author_time, author_date_iso = line.split("\0")
+    timezone_str = author_date_iso[-5:]
+    sign = -1 if timezone_str.startswith("-") else 1
+    offset = sign * (int(timezone_str[1:3]) * 3600 + int(timezone_str[3:5]) * 60)
 
-    return path
+    return commit_hash, {"author_time": int(author_time), "author_timezone": offset}
 
-def get_repo_info(local_path: str) -> Mapping[str, Mapping[str, Any]]:
 
-    gr = GitRepository(local_path)
+class NativeGitBackend(GitBackend):
+    """Git backend that uses the 'git' executable.
 
-    commits = get_commits_info(gr)
-    tags = get_tags_from_repo(gr)
-    branches = get_branches_from_repo(gr)
+    Supports all clone strategies, including 'blobless' (if the remote supports it).
+    """
 
-    result = {
-        "branches": branches,
-        "tags": tags,
-        "commits": commits
-    }
+    _backend_name = "native"
 
-    return result
+    @classmethod
+    def is_available(cls) -> bool:
 
+        return shutil.which("git") is not None
 
-def get_commits_info(gr: GitRepository) -> Mapping[str, Mapping[str, Any]]:
+    async def clone(self, url: str, target: str, strategy: str = "full", depth: Optional[int] = None) -> Tuple[str, Optional[int]]:
 
-    commits: Dict[str, Mapping[str, Any]] = {}
-    for c in gr.get_list_commits():
-        commits[c.hash] = {
-            "author_date": c.author_date,
-            "author_timezone": c.author_timezone
-        }
-    return commits
+        if strategy == "full" or strategy == "blobless":
+            depth = None
 
-def get_branches_from_repo(gr: GitRepository) -> Mapping[str, str]:
-    """Retrieve all branches from provided git repo.
+        await run_git("-c", "init.defaultBranch=master", "init", "--bare", "--quiet", target)
 
-    Returns:
-        Mapping: a dict with the branch name as key, and the commit hash of its head as value
-    """
+        # writing the config directly saves one git process per value
+        config_path = os.path.join(target, "config")
+        config = ConfigFile.from_path(config_path)
+        config.set((b"remote", b"origin"), b"url", url.encode("utf-8"))
+        config.set((b"remote", b"origin"), b"mirror", True)
+        if strategy == "blobless":
+            config.set((b"remote", b"origin"), b"promisor", True)
+            config.set((b"remote", b"origin"), b"partialclonefilter", b"blob:none")
+        config.set((b"bring",), b"clone-strategy", strategy.encode("utf-8"))
+        if depth is not None:
+            config.set((b"bring",), b"clone-depth", str(depth).encode("ASCII"))
+        config.write_to_path(config_path)
 
-    branches: Dict[str, str] = {}
-    for b in gr.repo.branches:
-        branches[b.name] = b.commit.hexsha
+        await self.fetch(target, url)
+        return (strategy, depth)
 
-    return branches
+    async def fetch(self, path: str, url: str) -> None:
 
+        strategy, depth = await run_disk(get_clone_strategy, path)
 
-def get_tags_from_repo(gr: GitRepository) -> Mapping[str, str]:
-    """Retrieve all tags from provided git repo.
+        args = ["-C", path, "fetch", "--quiet", "--prune", "--no-tags"]
+        if depth is not None and strategy in ["shallow", "tags"]:
+            args.append(f"--depth={depth}")
+        if strategy == "blobless":
+            args.append("--filter=blob:none")
 
-    Returns:
-        Mapping: a dict with the tag name as key, and the commit hash it refers to as value
-    """
+        # explicit refspecs, so repositories cloned by other backends (without fetch config) are mirrored the same way
+        args.append("origin")
+        if strategy != "tags":
+            args.append("+refs/heads/*:refs/heads/*")
+        args.append("+refs/tags/*:refs/tags/*")
+
+        await run_git(*args)
+
+    async def list_refs(self, path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+
+        output = await run_git("-C", path, "for-each-ref", f"--format={_REF_FORMAT}", "--sort=-refname", "refs/tags", "refs/heads")
+
+        tags: Dict[str, str] = {}
+        branches: Dict[str, str] = {}
+        for line in output.decode("utf-8").splitlines():
+            if not line:
+                continue
+            ref, sha, peeled = line.split("\0")
+            if ref.startswith("refs/tags/"):
+                tags[ref[len("refs/tags/"):]] = peeled or sha
+            elif ref.startswith("refs/heads/"):
+                branches[ref[len("refs/heads/"):]] = sha
+
+        return tags, branches
+
+    async def get_commits_metadata(self, path: str, commits: Iterable[str], include_history: bool = False) -> Dict[str, Mapping[str, Any]]:
+
+        args = ["-C", path, "log", f"--format={_COMMIT_FORMAT}", "--stdin"]
+        if not include_history:
+            args.append("--no-walk=unsorted")
+
+        stdin = "\n".join(commits).encode("ASCII") + b"\n"
+        output = await run_git(*args, input=stdin)
+
+        result: Dict[str, Mapping[str, Any]] = {}
+        for line in output.decode("utf-8").splitlines():
+            if not line:
+                continue
+            commit_hash, metadata = _parse_commit_line(line)
+            result[commit_hash] = metadata
+        return result
+
+    async def resolve_version(self, path: str, version: str) -> Tuple[str, Optional[str]]:
+        """Find the commit for a tag, branch or commit hash (tags take precedence over branches with the same name).
+
+        Returns:
+            Tuple: the commit hash, and the branch name (or None, if the version is not a branch)
+        """
+
+        tag_ref = f"refs/tags/{version}"
+        branch_ref = f"refs/heads/{version}"
+        output = await run_git("-C", path, "for-each-ref", f"--format={_REF_FORMAT}", tag_ref, branch_ref)
+
+        refs: Dict[str, str] = {}
+        for line in output.decode("utf-8").splitlines():
+            if not line:
+                continue
+            ref, sha, peeled = line.split("\0")
+            refs[ref] = peeled or sha
+
+        if tag_ref in refs.keys():
+            return refs[tag_ref], None
+        if branch_ref in refs.keys():
+            return refs[branch_ref], version
+
+        if is_commit_hash(version):
+            try:
+                output = await run_git("-C", path, "rev-parse", "--verify", "--quiet", f"{version}^{{commit}}")
+                return output.decode("ASCII").strip(), None
+            except FrklException:
+                pass
+
+        raise FrklException(msg=f"Can't find version '{version}' in git repository: {path}", reason="No tag, branch or commit with that name.")
+
+    async def export_tree(self, source_repo: str, target_path: str, version: Optional[str] = None, paths: Optional[Iterable[str]] = None) -> None:
+
+        if os.path.exists(target_path):
+            raise FrklException("Can't export git repo.", reason=f"Target path already exists: {target_path}")
+
+        if version is None:
+            version = "master"
+
+        commit, branch = await self.resolve_version(source_repo, version)
+
+        parent_folder = os.path.dirname(target_path)
+        await run_disk(ensure_folder, parent_folder)
+        temp_path = os.path.join(parent_folder, generate_valid_identifier())
+
+        try:
+            if paths is None:
+                await self._checkout(source_repo, temp_path, commit, branch)
+            else:
+                await self._export_paths(source_repo, temp_path, commit, paths)
+        except Exception as e:
+            log.debug(f"Can't export git repo {source_repo} -> {target_path}", exc_info=True)
+            await run_disk(shutil.rmtree, temp_path, True)
+            raise e
+
+        def move_into_place():
+            if os.path.exists(target_path):
+                shutil.rmtree(temp_path, ignore_errors=True)
+                raise FrklException("Can't export git repo.", reason=f"Target folder created during export process: {target_path}")
+            shutil.move(temp_path, target_path)
+
+        await run_disk(move_into_place)
+
+    async def _checkout(self, source_repo: str, target: str, commit: str, branch: Optional[str]) -> None:
+
+        await run_git("clone", "--quiet", "--no-checkout", source_repo, target)
+
+        strategy, _ = await run_disk(get_clone_strategy, source_repo)
+        try:
+            url = (await run_git("-C", source_repo, "config", "remote.origin.url")).decode("utf-8").strip()
+            await run_git("-C", target, "remote", "set-url", "origin", url)
+            if strategy == "blobless":
+                # missing file contents are fetched from the original remote
+                await run_git("-C", target, "config", "remote.origin.promisor", "true")
+                await run_git("-C", target, "config", "remote.origin.partialclonefilter", "blob:none")
+        except FrklException:
+            pass
+
+        if branch is not None:
+            await run_git("-C", target, "checkout", "--quiet", "-B", branch, commit)
+        else:
+            await run_git("-C", target, "checkout", "--quiet", "--detach", commit)
+
+    async def _export_paths(self, source_repo: str, target: str, commit: str, paths: Iterable[str]) -> None:
+
+        rel_paths = sorted(set(p.strip("/") for p in paths if p.strip("/")))
+        await run_disk(ensure_folder, target)
+        if not rel_paths:
+            return
+
+        output = await run_git("-C", source_repo, "ls-tree", "-z", "--name-only", commit, "--", *rel_paths)
+        existing = [p for p in output.decode("utf-8").split("\0") if p]
+        if not existing:
+            return
+
+        archive = await run_git("-C", source_repo, "archive", "--format=tar", commit, "--", *existing)
 
-    tags: Dict[str, str] = {}
-    for t in reversed(
-            sorted(gr.repo.tags, key=lambda t: t.commit.committed_datetime)
-        ):
-        tags[t.name] = t.commit.hexsha
+        def extract():
+            with tarfile.open(fileobj=io.BytesIO(archive), mode="r:") as tar:
+                tar.extractall(target)
 
-    return tags
+        await run_disk(extract)
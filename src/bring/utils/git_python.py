@@ -1,20 +1,21 @@
 import os
 import shutil
 import logging
-import time
+import stat
 from threading import Thread
-from typing import Mapping, Any, Dict, Optional
+from typing import Mapping, Any, Dict, Optional, Tuple, Iterable
 
-from anyio import run_sync_in_worker_thread
 from dulwich import porcelain, index
-from dulwich.client import HttpGitClient, LocalGitClient
-from dulwich.objects import format_timezone, Tag, Commit
+from dulwich.client import HttpGitClient, LocalGitClient, get_transport_and_path
+from dulwich.object_store import tree_lookup_path
+from dulwich.objects import Tag, Commit, S_ISGITLINK
 from dulwich.objectspec import parse_commit
 from dulwich.porcelain import NoneStream
 from dulwich.repo import Repo
 
-from bring.defaults import BRING_GIT_CHECKOUT_CACHE
-from frkl.common.downloads.cache import calculate_cache_path
+from bring.utils.executors import run_cpu, run_disk
+from bring.utils.git_backend import GIT_CLONE_STRATEGIES, GitBackend, clone_strategy_satisfies, get_clone_strategy, \
+    get_git_backend, is_commit_hash
 from frkl.common.exceptions import FrklException
 from frkl.common.filesystem import ensure_folder
 from frkl.common.strings import generate_valid_identifier
@@ -22,193 +23,350 @@ from frkl.common.strings import generate_valid_identifier
 
 log = logging.getLogger("bring")
 
-async def ensure_repo_cloned(url, update=False, use_thread: bool=True) -> str:
 
-    path = calculate_cache_path(base_path=BRING_GIT_CHECKOUT_CACHE, url=url)
-    parent_folder = os.path.dirname(path)
+def _set_clone_strategy(repo: Repo, strategy: str, depth: Optional[int]) -> None:
 
-    exists = False
-    if os.path.exists(path):
-        exists = True
+    config = repo.get_config()
+    config.set((b"bring",), b"clone-strategy", strategy.encode("utf-8"))
+    if depth is not None:
+        config.set((b"bring",), b"clone-depth", str(depth).encode("ASCII"))
+    config.write_to_path()
 
-    if exists and not update:
-        return path
 
-    ensure_folder(parent_folder)
+def _supports_depth(url: str) -> bool:
+    """Check whether the transport for this url supports shallow fetches (dulwich's local transport doesn't)."""
 
-    if not exists:
+    client, _ = get_transport_and_path(url)
+    return not isinstance(client, LocalGitClient)
 
-        def git_clone():
 
-            # clone to a temp location first, in case another process tries to do the same
-            temp_name = generate_valid_identifier()
-            temp_path = os.path.join(parent_folder, temp_name)
+MIRRORED_REF_PREFIXES = (b"refs/heads/", b"refs/tags/")
+"""Ref namespaces that are mirrored 1:1 from the remote into the (bare) repositories of the git checkout cache."""
 
-            porcelain.clone(url, temp_path, errstream=NoneStream())
 
-            if os.path.exists(path):
-                shutil.rmtree(temp_path, ignore_errors=True)
-            else:
-                shutil.move(temp_path, path)
+def _fetch_mirror(repo: Repo, url: str, strategy: str, depth: Optional[int]) -> None:
+    """Fetch the refs required by the clone strategy, and mirror them into the repository.
 
-        task = git_clone
+    Branches end up in 'refs/heads/', tags in 'refs/tags/', exactly like they are named in the remote repository.
+    Refs that don't exist in the remote anymore are removed.
+    """
 
+    client, remote_path = get_transport_and_path(url)
+    if isinstance(client, LocalGitClient):
+        depth = None
+
+    if strategy == "tags":
+        prefixes: Tuple[bytes, ...] = (b"refs/tags/",)
     else:
-        def git_fetch():
-            # TODO: some sort of lock?
-            porcelain.fetch(path, errstream=NoneStream())
-        task = git_fetch
+        prefixes = MIRRORED_REF_PREFIXES
+
+    def wanted(ref: bytes) -> bool:
+        return ref.startswith(prefixes) and not ref.endswith(b"^{}")
+
+    def determine_wants(refs, **kwargs):
+        return list(set(sha for ref, sha in refs.items() if wanted(ref) and sha not in repo.object_store))
 
-    if not use_thread:
-        task()
+    symrefs: Mapping[bytes, bytes] = {}
+    if isinstance(client, LocalGitClient) and not determine_wants(client.get_refs(remote_path)):
+        # dulwich's local transport fails for shallow repositories if there is nothing to fetch
+        all_remote_refs = client.get_refs(remote_path)
     else:
-        await run_sync_in_worker_thread(task)
+        result = client.fetch(remote_path, repo, determine_wants=determine_wants, depth=depth)
+        all_remote_refs = result.refs
+        if result.symrefs:
+            symrefs = result.symrefs
+
+    remote_refs = {ref: sha for ref, sha in all_remote_refs.items() if wanted(ref)}
+    for ref in repo.refs.allkeys():
+        if ref.startswith(prefixes) and ref not in remote_refs.keys():
+            del repo.refs[ref]
+    for ref, sha in remote_refs.items():
+        if ref not in repo.refs or repo.refs[ref] != sha:
+            repo.refs[ref] = sha
+
+    head_target = symrefs.get(b"HEAD", None)
+    if head_target is None and b"refs/heads/master" in remote_refs.keys():
+        head_target = b"refs/heads/master"
+    if head_target is not None and head_target in remote_refs.keys():
+        repo.refs.set_symbolic_ref(b"HEAD", head_target)
+
+
+def _git_clone(url: str, target: str, strategy: str, depth: Optional[int]) -> Tuple[str, Optional[int]]:
+
+    if strategy == "blobless":
+        raise FrklException(
+            msg=f"Can't clone git repository '{url}'.",
+            reason="The 'blobless' clone strategy is not supported by dulwich.",
+        )
+
+    if strategy not in GIT_CLONE_STRATEGIES:
+        raise FrklException(msg=f"Can't clone git repository '{url}'.", reason=f"Invalid clone strategy: {strategy}")
+
+    if depth is not None and not _supports_depth(url):
+        # no point in shallow clones of local repositories
+        depth = None
+        if strategy == "shallow":
+            strategy = "full"
+
+    repo = Repo.init_bare(target, mkdir=True)
+    config = repo.get_config()
+    config.set((b"remote", b"origin"), b"url", url.encode("utf-8"))
+    config.set((b"remote", b"origin"), b"mirror", True)
+    config.write_to_path()
+
+    if strategy == "full":
+        depth = None
+    _set_clone_strategy(repo, strategy, depth)
+    _fetch_mirror(repo, url, strategy=strategy, depth=depth)
 
-    return path
+    return (strategy, depth)
+
+
+def _git_fetch(path: str, url: str) -> None:
+
+    strategy, depth = get_clone_strategy(path)
+    _fetch_mirror(Repo(path), url, strategy=strategy, depth=depth)
+
+
+async def ensure_repo_cloned(url, update=False, strategy: str="full", depth: Optional[int]=None) -> str:
+    """Make sure a git repository is available in the git checkout cache (using dulwich), and return its local path."""
+
+    return await get_git_backend("dulwich").ensure_repo_cloned(url, update=update, strategy=strategy, depth=depth)
 
 
 async def clone_local_repo_async(source_repo: str, target_path: str, version: Optional[str]=None) -> None:
 
-    await run_sync_in_worker_thread(clone_local_repo, source_repo, target_path, version)
+    await run_disk(clone_local_repo, source_repo, target_path, version)
+
+
+def resolve_version(repo: Repo, version: str) -> Tuple[Commit, Optional[bytes]]:
+    """Find the commit for a tag, branch or commit hash in a (bare, mirrored) repository.
+
+    Tags take precedence over branches with the same name.
+
+    Returns:
+        Tuple: the commit object, and the branch ref (or None, if the version is not a branch)
+    """
+
+    tag_ref = f"refs/tags/{version}".encode("utf-8")
+    branch_ref = f"refs/heads/{version}".encode("utf-8")
+
+    if tag_ref in repo.refs:
+        obj = repo[repo.refs[tag_ref]]
+        while isinstance(obj, Tag):
+            obj = repo[obj.object[1]]
+        return obj, None
+
+    if branch_ref in repo.refs:
+        return repo[repo.refs[branch_ref]], branch_ref
+
+    if is_commit_hash(version) and version.encode("ASCII") in repo.object_store:
+        obj = repo[version.encode("ASCII")]
+        if isinstance(obj, Commit):
+            return obj, None
+
+    raise FrklException(msg=f"Can't find version '{version}' in git repository: {repo.path}", reason="No tag, branch or commit with that name.")
 
 
 def clone_local_repo(source_repo: str, target_path: str, version: Optional[str]=None) -> None:
+    """Create a (non-bare) clone of a repository in the git checkout cache, with the specified version checked out."""
 
     if os.path.exists(target_path):
         raise FrklException("Can't clone local git repo.", reason=f"Target path already exists: {target_path}")
 
-    try:
-        parent_folder = os.path.dirname(target_path)
+    if version is None:
+        version = "master"
 
-        temp_name = generate_valid_identifier()
-        temp_path = os.path.join(parent_folder, temp_name)
+    parent_folder = os.path.dirname(target_path)
+    temp_name = generate_valid_identifier()
+    temp_path = os.path.join(parent_folder, temp_name)
 
-        remote: Repo = porcelain.open_repo(source_repo)
-        source_config = remote.get_config()
+    try:
+        remote: Repo = Repo(source_repo)
+        commit, branch_ref = resolve_version(remote, version)
 
         # TODO: this is slow, copying the whole repo would be faster,
         # but dulwich does not support the 'checkout' command properly yet,
         # there is a chance of dangling files
-        # shutil.copytree(source_repo, temp_path)
-        # local: Repo = porcelain.open_repo(temp_path)
-
         local: Repo = porcelain.clone(source=source_repo, target=temp_path, errstream=NoneStream(), checkout=False)
 
-        remote_refs = LocalGitClient().fetch(source_repo, local)
+        try:
+            encoded_path = remote.get_config().get((b'remote', b'origin'), b'url')
+            target_config = local.get_config()
+            target_config.set((b'remote', b'origin'), b'url', encoded_path)
+            target_config.write_to_path()
+        except KeyError:
+            pass
 
-        encoded_path = source_config.get((b'remote', b'origin'), b'url')
+        to_set = b"HEAD"
+        if branch_ref is not None:
+            local.refs[branch_ref] = commit.id
+            local.refs.set_symbolic_ref(to_set, branch_ref)
+        else:
+            if to_set in local.refs.allkeys():
+                del local.refs[to_set]
+            local.refs[to_set] = commit.id
 
-        target_config = local.get_config()
-        target_config.set((b'remote', b'origin'), b'url', encoded_path)
-        target_config.write_to_path()
+        local.reset_index(commit.tree)
+    except Exception as e:
+        log.debug(f"Can't clone local git repo {source_repo} -> {target_path}", exc_info=True)
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise e
 
-        for key, value in remote_refs.items():
-            if key != b'refs/remotes/origin/HEAD' and key.decode("ASCII").startswith("refs/remotes/") and key not in local.refs.keys():
-                local.refs[key] = value
+    if os.path.exists(target_path):
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise FrklException("Can't clone local git repo.", reason=f"Target repository create during cloning process: {target_path}")
+    else:
+        shutil.move(temp_path, target_path)
 
-        local_refs = LocalGitClient().get_refs(temp_path)
 
-        if version is None:
-            version = "master"
+async def export_repo_paths_async(source_repo: str, target_path: str, paths: Iterable[str], version: Optional[str]=None) -> None:
 
-        tag = None
-        branch = None
-        # commit = None
-        tag_commit_obj = None
+    await run_disk(export_repo_paths, source_repo, target_path, paths, version)
 
-        for ref, ref_obj in local_refs.items():
 
-            ref = ref.decode("ASCII")
+def _write_tree_entry(repo: Repo, mode: int, sha: bytes, target: str) -> None:
 
-            if ref == f"refs/tags/{version}":
-                tag = ref
-                obj = local[ref_obj]
-                if isinstance(obj, Commit):
-                    tag_commit_obj = obj
-                elif isinstance(obj, Tag):
-                    tag_commit_obj = local[obj.object[1]]
-            elif ref == f"refs/heads/{version}":
-                branch = ref
-            elif ref.startswith("refs/remotes/") and ref.endswith(f"/{version}"):
-                branch_ref = f"refs/heads/{version}"
-                local.refs[branch_ref.encode("ASCII")] = ref_obj
-                branch = branch_ref
+    if S_ISGITLINK(mode):
+        # submodules are not supported
+        return
 
-        to_set = b"HEAD"
+    blob = repo[sha]
+    ensure_folder(os.path.dirname(target))
+    if stat.S_ISLNK(mode):
+        os.symlink(blob.as_raw_string(), target)
+        return
 
-        if tag is None and branch is None:
-            raise NotImplementedError()
-        elif tag is not None and branch is None:
-            local.reset_index(tag_commit_obj.tree)
-            del local.refs[to_set]
-            local.refs[to_set] = tag_commit_obj.sha().hexdigest().encode("ASCII")
-        elif branch is not None and tag is None:
-            branch_ref = branch.encode("ASCII")
-            local.reset_index(local[branch_ref].tree)
-            local.refs.set_symbolic_ref(to_set, branch_ref)
-        else:
-            raise NotImplementedError()
+    with open(target, "wb") as f:
+        f.write(blob.as_raw_string())
+    os.chmod(target, 0o755 if mode & stat.S_IXUSR else 0o644)
+
+
+def export_repo_paths(source_repo: str, target_path: str, paths: Iterable[str], version: Optional[str]=None) -> None:
+    """Write a subset of the files of a version of a repository in the git checkout cache into a folder.
+
+    Only the requested paths (files, or folders including all their children) are read from the object store, so
+    the cost of this does not depend on the size of the rest of the repository. Paths that don't exist in the
+    requested version are ignored. The result does not contain any git metadata.
+    """
+
+    if os.path.exists(target_path):
+        raise FrklException("Can't export paths from local git repo.", reason=f"Target path already exists: {target_path}")
+
+    if version is None:
+        version = "master"
+
+    parent_folder = os.path.dirname(target_path)
+    temp_name = generate_valid_identifier()
+    temp_path = os.path.join(parent_folder, temp_name)
+
+    try:
+        repo: Repo = Repo(source_repo)
+        commit, _ = resolve_version(repo, version)
+
+        ensure_folder(temp_path)
+        for path in sorted(set(paths)):
+            rel_path = path.strip("/")
+            if not rel_path:
+                continue
+            try:
+                mode, sha = tree_lookup_path(repo.__getitem__, commit.tree, rel_path.encode("utf-8"))
+            except KeyError:
+                log.debug(f"Path '{rel_path}' not in version '{version}' of repo {source_repo}, ignoring.")
+                continue
+
+            target = os.path.join(temp_path, rel_path)
+            if stat.S_ISDIR(mode):
+                for entry in repo.object_store.iter_tree_contents(sha):
+                    _write_tree_entry(repo, entry.mode, entry.sha, os.path.join(target, entry.path.decode("utf-8")))
+            elif not os.path.lexists(target):
+                _write_tree_entry(repo, mode, sha, target)
     except Exception as e:
-        log.debug(f"Can't clone local git repo {source_repo} -> {target_path}", exc_info=True)
-        import traceback
-        traceback.print_exc()
+        log.debug(f"Can't export paths from local git repo {source_repo} -> {target_path}", exc_info=True)
+        shutil.rmtree(temp_path, ignore_errors=True)
         raise e
 
     if os.path.exists(target_path):
         shutil.rmtree(temp_path, ignore_errors=True)
-        raise FrklException("Can't clone local git repo.", reason=f"Target repository create during cloning process: {target_path}")
+        raise FrklException("Can't export paths from local git repo.", reason=f"Target folder created during export process: {target_path}")
     else:
         shutil.move(temp_path, target_path)
 
 
-def get_repo_info(local_path: str) -> Mapping[str, Mapping[str, Any]]:
+def _get_commit_metadata(commit: Commit) -> Mapping[str, Any]:
 
-    repo: Repo = Repo(local_path)
+    return {
+        "author_time": commit.author_time,
+        "author_timezone": commit.author_timezone
+    }
 
-    commits: Dict[str, Mapping[str, Any]] = {}
-    walker = repo.get_walker(
-        max_entries=None, reverse=False)
-    for entry in walker:
-        commit_hash = entry.commit.id.decode('ASCII')
 
-        time_tuple = time.gmtime(entry.commit.author_time + entry.commit.author_timezone)
-        time_str = time.strftime("%a %b %d %Y %H:%M:%S", time_tuple)
-        timezone_str = format_timezone(entry.commit.author_timezone).decode('ascii')
+def list_refs(local_path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """List tags and branches of a repository, with the hash of the commit they point to."""
 
-        commits[commit_hash] = {
-            "author_date": time_str,
-            "author_timezone": timezone_str
-        }
+    repo: Repo = Repo(local_path)
 
     tags: Dict[str, str] = {}
     branches: Dict[str, str] = {}
 
     for ref, ref_obj in sorted(repo.get_refs().items(), reverse=True):
 
-        ref = ref.decode("ASCII")
-        # commit_hash = commit_hash.decode("ASCII")
+        ref = ref.decode("utf-8")
 
         if ref.startswith("refs/tags/"):
 
-            tag_name = ref.split("/")[-1]
+            tag_name = ref[len("refs/tags/"):]
             obj = repo.get_object(ref_obj)
-            if isinstance(obj, Tag):
-                sha_digest = obj.object[1].decode("ASCII")
-            elif isinstance(obj, Commit):
-                sha_digest = obj.sha().hexdigest()
+            while isinstance(obj, Tag):
+                obj = repo.get_object(obj.object[1])
+            if not isinstance(obj, Commit):
+                continue
 
-            tags[tag_name] = sha_digest
+            tags[tag_name] = obj.id.decode("ASCII")
 
         elif ref.startswith("refs/heads/"):
-            branch_name = ref.split("/")[-1]
+            branch_name = ref[len("refs/heads/"):]
             obj = repo.get_object(ref_obj)
             if not isinstance(obj, Commit):
                 raise NotImplementedError()
 
-            sha_digest = obj.sha().hexdigest()
+            branches[branch_name] = obj.id.decode("ASCII")
+
+    return tags, branches
+
+
+def get_commits_metadata(local_path: str, commits: Iterable[str], include_history: bool=False) -> Dict[str, Mapping[str, Any]]:
+    """Get metadata for commits (and, optionally, all their ancestors)."""
+
+    repo: Repo = Repo(local_path)
+
+    result: Dict[str, Mapping[str, Any]] = {}
+    if include_history:
+        walker = repo.get_walker(
+            include=[c.encode("ASCII") for c in commits], max_entries=None, reverse=False)
+        for entry in walker:
+            commit_hash = entry.commit.id.decode('ASCII')
+            result[commit_hash] = _get_commit_metadata(entry.commit)
+    else:
+        for commit_hash in commits:
+            result[commit_hash] = _get_commit_metadata(repo[commit_hash.encode("ASCII")])
+
+    return result
+
+
+def get_repo_info(local_path: str, include_history: bool=True) -> Mapping[str, Mapping[str, Any]]:
+    """Collect tags, branches and commit metadata of a repository.
 
-            branches[branch_name] = sha_digest
-            # print(obj)
+    If 'include_history' is False, only the commits that tags and branches point to are included. This is much faster
+    for large repositories, and is the only option for shallow clones that don't contain the full history.
+    """
+
+    tags, branches = list_refs(local_path)
+    ref_commits = set(tags.values()) | set(branches.values())
+
+    commits: Dict[str, Mapping[str, Any]] = {}
+    if ref_commits:
+        commits = get_commits_metadata(local_path, ref_commits, include_history=include_history)
 
     result = {
         "tags": tags,
@@ -217,3 +375,42 @@ def get_repo_info(local_path: str) -> Mapping[str, Mapping[str, Any]]:
     }
     return result
 
+
+class DulwichGitBackend(GitBackend):
+    """Git backend that uses dulwich (in worker threads), doesn't need a git executable."""
+
+    _backend_name = "dulwich"
+
+    def can_use_clone(self, existing: Tuple[str, Optional[int]], required: Tuple[str, Optional[int]]) -> bool:
+
+        # dulwich can't fetch missing objects on demand
+        if existing[0] == "blobless":
+            return False
+        return clone_strategy_satisfies(existing, required)
+
+    def supports_strategy(self, strategy: str) -> bool:
+
+        return strategy != "blobless" and super().supports_strategy(strategy)
+
+    async def clone(self, url: str, target: str, strategy: str = "full", depth: Optional[int] = None) -> Tuple[str, Optional[int]]:
+
+        return await run_disk(_git_clone, url, target, strategy, depth)
+
+    async def fetch(self, path: str, url: str) -> None:
+
+        await run_disk(_git_fetch, path, url)
+
+    async def list_refs(self, path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+
+        return await run_cpu(list_refs, path)
+
+    async def get_commits_metadata(self, path: str, commits: Iterable[str], include_history: bool = False) -> Dict[str, Mapping[str, Any]]:
+
+        return await run_cpu(get_commits_metadata, path, list(commits), include_history)
+
+    async def export_tree(self, source_repo: str, target_path: str, version: Optional[str] = None, paths: Optional[Iterable[str]] = None) -> None:
+
+        if paths is None:
+            await run_disk(clone_local_repo, source_repo, target_path, version)
+        else:
+            await run_disk(export_repo_paths, source_repo, target_path, list(paths), version)
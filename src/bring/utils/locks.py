@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""Lock files with leases, to coordinate several processes (possibly on several nodes) that share one cache folder.
+
+Only exclusive file creation ('O_EXCL') and renames within the same folder are used, both are atomic on local
+filesystems as well as on NFS (v3 and later). 'flock'/'fcntl' locks are not used, since they are not reliable on
+network filesystems.
+
+A lock file holds a lease: the node and process that hold the lock, and when the lease expires. The holder renews the
+lease in the background for as long as it holds the lock. If the holder dies (or its node does), the lease runs out and
+other processes can take the lock over. Lease expiry is compared against the local clock, so node clocks need to be in
+sync (e.g. via NTP) to within a fraction of the 'lease_seconds' setting.
+
+An existing lock file is only ever replaced (renewed, or taken over) while holding a short-lived second lock file
+('<lock>.break'), and after checking the lease again: so a holder can't renew a lease that was taken over by another
+process, and an expired lease can only be taken over once. The remaining window: a '<lock>.break' file that is older
+than 'lease_seconds' is considered left behind by a dead process and removed, so a process that stalls for longer than
+that while holding it can still replace a lock file it shouldn't (as can a holder that stalls for longer than its lease,
+which is inherent to leases).
+
+Locks for cache entries are only used in shared cache mode (setting: 'shared_cache'), see 'cache_lock'. Version
+retrievals always use a lock on the metadata cache file, so concurrent processes don't retrieve the same versions.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, TypeVar, Union
+
+import anyio
+
+from bring.config.settings import get_setting
+from frkl.common.exceptions import FrklException
+from frkl.common.filesystem import ensure_folder
+
+
+log = logging.getLogger("bring")
+
+LOCK_FILE_EXTENSION = ".lock"
+
+REPLACE_LOCK_POLL_INTERVAL = 0.005
+
+T = TypeVar("T")
+
+
+def _run_disk(func: Callable[..., T], *args: Any) -> Awaitable[T]:
+
+    # imported here, since the executors count metrics, and the metrics file uses a lease itself
+    from bring.utils.executors import run_disk
+
+    return run_disk(func, *args)
+
+
+def get_node_id() -> str:
+    """Return the id of this node (setting: 'node_id', defaults to the host name)."""
+
+    node_id = get_setting("node_id")
+    if not node_id:
+        node_id = socket.gethostname()
+    return node_id
+
+
+def is_shared_cache() -> bool:
+    """Whether the cache folder is shared with other nodes (setting: 'shared_cache')."""
+
+    return get_setting("shared_cache")
+
+
+class FileLease(object):
+    """A lock file holding a lease, that expires unless it is renewed.
+
+    Can be used as async context manager. While the lock is held, a background thread renews the lease every third of
+    the lease time (unless 'auto_renew' is False, which is mostly useful to simulate a node that dies).
+
+    Args:
+        path (str): the path of the lock file
+        lease_seconds (float): how long a lease is valid without renewal (default: setting 'lease_seconds')
+        node_id (str): the id of the node that holds the lease (default: 'get_node_id()')
+        auto_renew (bool): whether to renew the lease automatically while the lock is held
+    """
+
+    def __init__(self, path: str, lease_seconds: Optional[float] = None, node_id: Optional[str] = None, auto_renew: bool = True):
+
+        self._path: str = path
+        if lease_seconds is None:
+            lease_seconds = get_setting("lease_seconds")
+        self._lease_seconds: float = lease_seconds
+        if node_id is None:
+            node_id = get_node_id()
+        self._node_id: str = node_id
+        self._auto_renew: bool = auto_renew
+
+        self._token: Optional[str] = None
+        self._renew_stop: Optional[threading.Event] = None
+        self._renew_thread: Optional[threading.Thread] = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def is_held(self) -> bool:
+        return self._token is not None
+
+    def _create_lease(self) -> Dict[str, Any]:
+
+        now = time.time()
+        return {
+            "node": self._node_id,
+            "pid": os.getpid(),
+            "token": self._token,
+            "acquired": now,
+            "expires": now + self._lease_seconds,
+        }
+
+    def read_lease(self) -> Optional[Mapping[str, Any]]:
+        """Return the current lease (or None if the lock is not held by anyone).
+
+        If the lock file exists but can't be parsed (e.g. because it is being written), a lease is returned that expires
+        one lease time after the lock file was last modified.
+        """
+
+        return self._read_lease_file(self._path)
+
+    def _read_lease_file(self, path: str) -> Optional[Mapping[str, Any]]:
+
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            try:
+                modified = os.stat(path).st_mtime
+            except FileNotFoundError:
+                return None
+            return {"node": None, "pid": None, "token": None, "expires": modified + self._lease_seconds}
+
+    def try_acquire(self) -> bool:
+        """Try to acquire the lock (once, without waiting), taking over an expired lease if there is one."""
+
+        if self._token is not None:
+            raise FrklException(msg=f"Can't acquire lock: {self._path}", reason="Lock is already held by this object.")
+
+        ensure_folder(os.path.dirname(self._path))
+
+        for _ in range(2):
+            token = uuid.uuid4().hex
+            try:
+                fd = os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                lease = self.read_lease()
+                if lease is None or lease["expires"] >= time.time():
+                    return False
+                self._break_expired_lease(lease)
+                continue
+
+            self._token = token
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._create_lease(), f)
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self._auto_renew:
+                self._start_renewal()
+            return True
+
+        return False
+
+    def _try_lock_replace(self) -> bool:
+
+        replace_lock = f"{self._path}.break"
+        try:
+            fd = os.open(replace_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(replace_lock).st_mtime > self._lease_seconds:
+                    # left behind by a process that died
+                    os.unlink(replace_lock)
+            except FileNotFoundError:
+                pass
+            return False
+        os.close(fd)
+        return True
+
+    def _unlock_replace(self) -> None:
+
+        try:
+            os.unlink(f"{self._path}.break")
+        except FileNotFoundError:
+            pass
+
+    def _break_expired_lease(self, lease: Mapping[str, Any]) -> None:
+
+        if not self._try_lock_replace():
+            # another process is renewing the lease, or taking it over
+            return
+
+        try:
+            # the lease might have been renewed, or taken over, since we read it
+            current = self.read_lease()
+            if current is None or current.get("token") != lease.get("token") or current["expires"] >= time.time():
+                return
+
+            log.debug(f"Taking over expired lease (node: {lease.get('node')}, pid: {lease.get('pid')}): {self._path}")
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+        finally:
+            self._unlock_replace()
+
+    async def acquire(self, timeout: Optional[float] = None, poll_interval: float = 0.2) -> None:
+        """Wait until the lock can be acquired (at most 'timeout' seconds, default: setting 'lock_timeout')."""
+
+        if timeout is None:
+            timeout = get_setting("lock_timeout")
+
+        start = time.time()
+        while not await _run_disk(self.try_acquire):
+            if time.time() - start > timeout:
+                lease = await _run_disk(self.read_lease) or {}
+                raise FrklException(
+                    msg=f"Can't acquire lock: {self._path}",
+                    reason=f"Timed out after {timeout} seconds, lock is held by node '{lease.get('node')}' (pid: {lease.get('pid')}).",
+                    solution="Wait for the other process to finish. If it has died, its lease expires after 'lease_seconds'.",
+                )
+            await anyio.sleep(poll_interval)
+
+    def renew(self) -> bool:
+        """Extend the lease. Returns False if the lock was taken over by another process (because our lease expired)."""
+
+        if self._token is None:
+            return False
+
+        start = time.time()
+        while not self._try_lock_replace():
+            if time.time() - start > min(self._lease_seconds / 3.0, 5.0):
+                # try again next time, the lease is still valid for a while
+                lease = self.read_lease()
+                return lease is not None and lease.get("token") == self._token
+            time.sleep(REPLACE_LOCK_POLL_INTERVAL)
+
+        try:
+            # nobody can take the lease over while we hold the replace lock, so this check stays valid
+            lease = self.read_lease()
+            if lease is None or lease.get("token") != self._token:
+                log.warning(f"Lost lease on lock: {self._path}")
+                return False
+
+            # replace the lock file atomically, so readers never see a partially written lease
+            temp_path = f"{self._path}.renew_{uuid.uuid4().hex}"
+            with open(temp_path, "w") as f:
+                json.dump(self._create_lease(), f)
+            os.rename(temp_path, self._path)
+            return True
+        finally:
+            self._unlock_replace()
+
+    def _start_renewal(self) -> None:
+
+        stop = threading.Event()
+        interval = max(self._lease_seconds / 3.0, 0.01)
+
+        def renew_loop():
+            while not stop.wait(interval):
+                try:
+                    if not self.renew():
+                        return
+                except Exception as e:
+                    log.debug(f"Can't renew lease for lock '{self._path}': {e}")
+
+        self._renew_stop = stop
+        self._renew_thread = threading.Thread(target=renew_loop, name="bring_lease_renewal", daemon=True)
+        self._renew_thread.start()
+
+    def release(self) -> None:
+        """Release the lock (if it is still ours).
+
+        Blocks for up to a second if another process holds the replace lock, use 'release_async' on the event loop.
+        """
+
+        self._stop_renewal()
+        if self._token is None:
+            return
+
+        start = time.time()
+        locked = self._try_lock_replace()
+        while not locked and time.time() - start < 1.0:
+            time.sleep(REPLACE_LOCK_POLL_INTERVAL)
+            locked = self._try_lock_replace()
+
+        self._remove_lock_file(locked)
+
+    async def release_async(self) -> None:
+        """Release the lock (if it is still ours), without blocking the event loop."""
+
+        await _run_disk(self._stop_renewal)
+        if self._token is None:
+            return
+
+        start = time.time()
+        locked = await _run_disk(self._try_lock_replace)
+        while not locked and time.time() - start < 1.0:
+            await anyio.sleep(REPLACE_LOCK_POLL_INTERVAL)
+            locked = await _run_disk(self._try_lock_replace)
+
+        await _run_disk(self._remove_lock_file, locked)
+
+    def _stop_renewal(self) -> None:
+
+        if self._renew_stop is not None:
+            self._renew_stop.set()
+            self._renew_thread.join()  # type: ignore
+            self._renew_stop = None
+            self._renew_thread = None
+
+    def _remove_lock_file(self, replace_locked: bool) -> None:
+
+        try:
+            lease = self.read_lease()
+            if lease is not None and lease.get("token") == self._token:
+                try:
+                    os.unlink(self._path)
+                except FileNotFoundError:
+                    pass
+        finally:
+            if replace_locked:
+                self._unlock_replace()
+        self._token = None
+
+    async def __aenter__(self) -> "FileLease":
+
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+
+        # the lock must be released even if the task was cancelled
+        async with anyio.open_cancel_scope(shield=True):
+            await self.release_async()
+
+
+class _NoLock(object):
+    async def __aenter__(self) -> "_NoLock":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+
+def cache_lock(path: str) -> Union[FileLease, _NoLock]:
+    """Return a lock for a cache path (a 'FileLease' on '<path>.lock' in shared cache mode, a no-op otherwise).
+
+    Use it as async context manager around work that creates or replaces 'path'.
+    """
+
+    if not is_shared_cache():
+        return _NoLock()
+    return FileLease(f"{path}{LOCK_FILE_EXTENSION}")
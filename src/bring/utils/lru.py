@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""A least-recently-used map with a limit on the total size of its values."""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple, Union
+
+
+class SizeLimitedLRU(object):
+    """A thread-safe LRU map that evicts the least recently used values once their total size is over a limit.
+
+    Sizes are provided by the caller (in any unit, usually an estimate in bytes). Values that are larger than the limit
+    on their own are not stored.
+
+    Args:
+        max_size (int, Callable): the size limit, or a function that returns it (e.g. to read a setting), 0 disables the map
+    """
+
+    def __init__(self, max_size: Union[int, Callable[[], int]]):
+
+        self._max_size: Union[int, Callable[[], int]] = max_size
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._size: int = 0
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self) -> int:
+
+        if callable(self._max_size):
+            return self._max_size()
+        return self._max_size
+
+    @property
+    def size(self) -> int:
+        """The total size of all values."""
+
+        return self._size
+
+    def __len__(self) -> int:
+
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for a key (and mark it as used), or None."""
+
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        """Add or replace the value for a key, returns False if the value is too large to be stored."""
+
+        max_size = self.max_size
+        with self._lock:
+            self._remove(key)
+            if size > max_size or max_size <= 0:
+                return False
+
+            self._entries[key] = (value, size)
+            self._size = self._size + size
+            while self._size > max_size:
+                self._remove(next(iter(self._entries.keys())))
+            return True
+
+    def pop(self, key: Hashable) -> None:
+
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key: Hashable) -> None:
+
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size = self._size - entry[1]
@@ -0,0 +1,589 @@
+# -*- coding: utf-8 -*-
+"""Simple, persistent metrics (counters and histograms) for *bring*.
+
+Metric values are kept in memory while *bring* runs, and are added to the values stored in the metrics file in the
+*bring* cache directory when the process exits (or when 'flush' is called explicitly). That way counters survive
+across runs, even if several *bring* processes are running at the same time: the metrics file is only updated while
+holding a lock on it ('metrics.json.lock', check 'bring.utils.locks'). The metrics file is only read once values are
+needed (on the first flush, or when metrics are reported), not when metrics are registered.
+"""
+
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from bring.defaults import BRING_METRICS_FILE
+from bring.utils.locks import LOCK_FILE_EXTENSION, FileLease
+
+
+log = logging.getLogger("bring")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BYTES_BUCKETS: Tuple[float, ...] = (
+    1024,
+    16 * 1024,
+    256 * 1024,
+    1024 * 1024,
+    16 * 1024 * 1024,
+    256 * 1024 * 1024,
+    1024 * 1024 * 1024,
+)
+DEFAULT_SECONDS_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+    10.0,
+    60.0,
+)
+
+FLUSH_LOCK_TIMEOUT = 10.0
+"""How long (in seconds) to wait for another process to finish updating the metrics file."""
+
+
+def _label_key(labels: Mapping[str, Any]) -> LabelKey:
+
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key: LabelKey, extra: Optional[Mapping[str, str]] = None) -> str:
+
+    items = list(label_key)
+    if extra:
+        items.extend(extra.items())
+    if not items:
+        return ""
+
+    escaped = []
+    for k, v in items:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+
+    _metric_type: str = "untyped"
+
+    def __init__(self, name: str, doc: str, registry: "MetricsRegistry"):
+
+        self._name: str = name
+        self._doc: str = doc
+        self._registry: MetricsRegistry = registry
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def doc(self) -> str:
+        return self._doc
+
+    @property
+    def metric_type(self) -> str:
+        return self._metric_type
+
+
+class Counter(Metric):
+    """A monotonically increasing counter, optionally split up by labels."""
+
+    _metric_type = "counter"
+
+    def __init__(self, name: str, doc: str, registry: "MetricsRegistry"):
+
+        super().__init__(name=name, doc=doc, registry=registry)
+        self._persisted: Dict[LabelKey, float] = {}
+        self._session: Dict[LabelKey, float] = {}
+
+    def inc(self, value: float = 1, **labels: Any) -> None:
+
+        if value < 0:
+            raise ValueError(f"Can't decrease counter '{self.name}': {value}")
+
+        key = _label_key(labels)
+        with self._lock:
+            self._session[key] = self._session.get(key, 0) + value
+        self._registry._mark_dirty()
+
+    def get(self, **labels: Any) -> float:
+
+        self._registry._ensure_loaded()
+        key = _label_key(labels)
+        return self._persisted.get(key, 0) + self._session.get(key, 0)
+
+    def total(self) -> float:
+
+        return sum(v for _, v in self.values())
+
+    def values(self) -> List[Tuple[LabelKey, float]]:
+
+        self._registry._ensure_loaded()
+        keys = set(self._persisted.keys()) | set(self._session.keys())
+        return [
+            (k, self._persisted.get(k, 0) + self._session.get(k, 0))
+            for k in sorted(keys)
+        ]
+
+    def _load(self, data: Mapping[str, Any]) -> None:
+
+        self._persisted = {}
+        for item in data.get("values", []):
+            self._persisted[_label_key(item["labels"])] = item["value"]
+
+    def _merge_session(self, data: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+
+        current: Dict[LabelKey, float] = {}
+        if data:
+            for item in data.get("values", []):
+                current[_label_key(item["labels"])] = item["value"]
+        for k, v in self._session.items():
+            current[k] = current.get(k, 0) + v
+
+        return {
+            "type": self.metric_type,
+            "doc": self.doc,
+            "values": [{"labels": dict(k), "value": v} for k, v in sorted(current.items())],
+        }
+
+    def _session_flushed(self, merged: Mapping[str, Any]) -> None:
+
+        self._session = {}
+        self._load(merged)
+
+    def to_prometheus(self) -> List[str]:
+
+        lines = []
+        for k, v in self.values():
+            lines.append(f"{self.name}{_format_labels(k)} {_format_value(v)}")
+        return lines
+
+
+class _HistogramData(object):
+    def __init__(self, num_buckets: int):
+
+        self.buckets: List[int] = [0] * num_buckets
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def add(self, other: "_HistogramData") -> None:
+
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.count = self.count + other.count
+        self.sum = self.sum + other.sum
+
+    def to_dict(self) -> Dict[str, Any]:
+
+        return {"buckets": list(self.buckets), "count": self.count, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, num_buckets: int, data: Mapping[str, Any]) -> "_HistogramData":
+
+        result = cls(num_buckets)
+        buckets = data.get("buckets", [])
+        if len(buckets) == num_buckets:
+            result.buckets = list(buckets)
+        result.count = data.get("count", 0)
+        result.sum = data.get("sum", 0.0)
+        return result
+
+
+class Histogram(Metric):
+    """A histogram with a fixed set of (upper-bound) buckets, optionally split up by labels.
+
+    Bucket counts are stored non-cumulative, and are only accumulated when exported.
+    """
+
+    _metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        doc: str,
+        registry: "MetricsRegistry",
+        buckets: Iterable[float] = DEFAULT_SECONDS_BUCKETS,
+    ):
+
+        super().__init__(name=name, doc=doc, registry=registry)
+        self._buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self._persisted: Dict[LabelKey, _HistogramData] = {}
+        self._session: Dict[LabelKey, _HistogramData] = {}
+
+    @property
+    def buckets(self) -> Tuple[float, ...]:
+        return self._buckets
+
+    def observe(self, value: float, **labels: Any) -> None:
+
+        key = _label_key(labels)
+        with self._lock:
+            data = self._session.get(key, None)
+            if data is None:
+                data = _HistogramData(len(self._buckets) + 1)
+                self._session[key] = data
+
+            index = len(self._buckets)
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    index = i
+                    break
+            data.buckets[index] = data.buckets[index] + 1
+            data.count = data.count + 1
+            data.sum = data.sum + value
+        self._registry._mark_dirty()
+
+    def _combined(self, key: LabelKey) -> _HistogramData:
+
+        self._registry._ensure_loaded()
+        result = _HistogramData(len(self._buckets) + 1)
+        if key in self._persisted.keys():
+            result.add(self._persisted[key])
+        if key in self._session.keys():
+            result.add(self._session[key])
+        return result
+
+    def values(self) -> List[Tuple[LabelKey, Mapping[str, Any]]]:
+
+        self._registry._ensure_loaded()
+        keys = set(self._persisted.keys()) | set(self._session.keys())
+        return [(k, self._combined(k).to_dict()) for k in sorted(keys)]
+
+    def mean(self, **labels: Any) -> Optional[float]:
+
+        data = self._combined(_label_key(labels))
+        if not data.count:
+            return None
+        return data.sum / data.count
+
+    def _load(self, data: Mapping[str, Any]) -> None:
+
+        self._persisted = {}
+        if list(data.get("bounds", [])) != list(self._buckets):
+            # bucket layout changed, we can't re-use the old data
+            return
+        for item in data.get("values", []):
+            self._persisted[_label_key(item["labels"])] = _HistogramData.from_dict(
+                len(self._buckets) + 1, item
+            )
+
+    def _merge_session(self, data: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+
+        current: Dict[LabelKey, _HistogramData] = {}
+        if data and list(data.get("bounds", [])) == list(self._buckets):
+            for item in data.get("values", []):
+                current[_label_key(item["labels"])] = _HistogramData.from_dict(
+                    len(self._buckets) + 1, item
+                )
+        for k, v in self._session.items():
+            current.setdefault(k, _HistogramData(len(self._buckets) + 1)).add(v)
+
+        values = []
+        for k, v in sorted(current.items()):
+            item = v.to_dict()
+            item["labels"] = dict(k)
+            values.append(item)
+
+        return {
+            "type": self.metric_type,
+            "doc": self.doc,
+            "bounds": list(self._buckets),
+            "values": values,
+        }
+
+    def _session_flushed(self, merged: Mapping[str, Any]) -> None:
+
+        self._session = {}
+        self._load(merged)
+
+    def to_prometheus(self) -> List[str]:
+
+        lines = []
+        for k, data in self.values():
+            cumulative = 0
+            for bound, count in zip(self._buckets, data["buckets"]):
+                cumulative = cumulative + count
+                le = _format_labels(k, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(k, {"le": "+Inf"})
+            lines.append(f"{self.name}_bucket{le} {data['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(k)} {_format_value(data['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(k)} {data['count']}")
+        return lines
+
+
+class MetricsRegistry(object):
+    """Registry for all metrics of a *bring* process.
+
+    Args:
+        metrics_file (str): the file to persist metric values to (or None to not persist metrics at all)
+    """
+
+    def __init__(self, metrics_file: Optional[str] = BRING_METRICS_FILE):
+
+        self._metrics_file: Optional[str] = metrics_file
+        self._metrics: Dict[str, Metric] = {}
+        self._persisted_data: Optional[Mapping[str, Any]] = None
+        self._atexit_registered: bool = False
+        self._lock = threading.Lock()
+
+    @property
+    def metrics_file(self) -> Optional[str]:
+        return self._metrics_file
+
+    @property
+    def metrics(self) -> Mapping[str, Metric]:
+        return self._metrics
+
+    def counter(self, name: str, doc: str) -> Counter:
+
+        return self._register(name, Counter, doc=doc)  # type: ignore
+
+    def histogram(
+        self, name: str, doc: str, buckets: Iterable[float] = DEFAULT_SECONDS_BUCKETS
+    ) -> Histogram:
+
+        return self._register(name, Histogram, doc=doc, buckets=buckets)  # type: ignore
+
+    def _register(self, name: str, metric_cls, **kwargs) -> Metric:
+
+        with self._lock:
+            if name in self._metrics.keys():
+                metric = self._metrics[name]
+                if not isinstance(metric, metric_cls):
+                    raise ValueError(f"Metric '{name}' already registered with different type.")
+                return metric
+
+            metric = metric_cls(name=name, registry=self, **kwargs)
+            if self._persisted_data is not None:
+                persisted = self._persisted_data.get(name, None)
+                if persisted:
+                    metric._load(persisted)
+            self._metrics[name] = metric
+            return metric
+
+    def _read_metrics_file(self) -> Mapping[str, Any]:
+
+        if not self._metrics_file or not os.path.isfile(self._metrics_file):
+            return {}
+
+        try:
+            with open(self._metrics_file, "r") as f:
+                data = json.load(f)
+            return data.get("metrics", {})
+        except Exception as e:
+            log.debug(f"Can't read metrics file '{self._metrics_file}': {e}")
+            return {}
+
+    def _ensure_loaded(self) -> None:
+
+        if self._persisted_data is not None:
+            return
+
+        with self._lock:
+            if self._persisted_data is not None:
+                return
+            data = self._read_metrics_file()
+            for name, metric in self._metrics.items():
+                persisted = data.get(name, None)
+                if persisted:
+                    metric._load(persisted)  # type: ignore
+            self._persisted_data = data
+
+    def _lock_metrics_file(self) -> Optional[FileLease]:
+
+        lock = FileLease(f"{self._metrics_file}{LOCK_FILE_EXTENSION}", auto_renew=False)
+        start = time.time()
+        while not lock.try_acquire():
+            if time.time() - start > FLUSH_LOCK_TIMEOUT:
+                return None
+            time.sleep(0.01)
+        return lock
+
+    def _mark_dirty(self) -> None:
+
+        if self._atexit_registered or not self._metrics_file:
+            return
+        self._atexit_registered = True
+        atexit.register(self.flush)
+
+    def flush(self) -> None:
+        """Add the values collected in this session to the ones in the metrics file."""
+
+        if not self._metrics_file:
+            return
+
+        with self._lock:
+            try:
+                file_lock = self._lock_metrics_file()
+            except Exception as e:
+                log.debug(f"Can't lock metrics file '{self._metrics_file}': {e}")
+                return
+            if file_lock is None:
+                # values stay in the session, and are added on the next flush
+                log.debug(f"Timed out waiting for lock on metrics file: {self._metrics_file}")
+                return
+
+            try:
+                current = dict(self._read_metrics_file())
+                for name, metric in self._metrics.items():
+                    current[name] = metric._merge_session(current.get(name, None))  # type: ignore
+
+                parent = os.path.dirname(self._metrics_file)
+                fd, temp_file = tempfile.mkstemp(dir=parent, prefix=".metrics_")
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"metrics": current}, f)
+                os.replace(temp_file, self._metrics_file)
+            except Exception as e:
+                log.debug(f"Can't write metrics file '{self._metrics_file}': {e}")
+                return
+            finally:
+                file_lock.release()
+
+            self._persisted_data = current
+            for name, metric in self._metrics.items():
+                metric._session_flushed(current[name])  # type: ignore
+
+    def reset(self) -> None:
+        """Delete all persisted and in-memory metric values."""
+
+        with self._lock:
+            if self._metrics_file and os.path.exists(self._metrics_file):
+                os.unlink(self._metrics_file)
+            self._persisted_data = {}
+            for metric in self._metrics.values():
+                metric._session = {}  # type: ignore
+                metric._persisted = {}  # type: ignore
+
+    def to_dict(self) -> Dict[str, Any]:
+
+        result: Dict[str, Any] = {}
+        for name, metric in sorted(self._metrics.items()):
+            result[name] = {
+                "type": metric.metric_type,
+                "doc": metric.doc,
+                "values": [
+                    {"labels": dict(k), "value": v}
+                    for k, v in metric.values()  # type: ignore
+                ],
+            }
+        return result
+
+    def to_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format (e.g. for the node-exporter textfile collector)."""
+
+        lines: List[str] = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.doc}")
+            lines.append(f"# TYPE {name} {metric.metric_type}")
+            lines.extend(metric.to_prometheus())  # type: ignore
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_textfile(self, path: str) -> None:
+        """Write the Prometheus export to a file, atomically (as is required by the textfile collector)."""
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=parent, prefix=".bring_metrics_")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.to_prometheus())
+        os.chmod(temp_file, 0o644)
+        os.replace(temp_file, path)
+
+
+METRICS = MetricsRegistry()
+
+VERSIONS_CACHE_HITS = METRICS.counter(
+    "bring_versions_cache_hits_total",
+    "Number of times package versions could be loaded from the metadata cache.",
+)
+VERSIONS_CACHE_MISSES = METRICS.counter(
+    "bring_versions_cache_misses_total",
+    "Number of times package versions were retrieved from their source, because the metadata cache was missing or expired.",
+)
+VERSIONS_MEMORY_CACHE_HITS = METRICS.counter(
+    "bring_versions_memory_cache_hits_total",
+    "Number of times package versions could be used from memory, without reading the metadata cache file.",
+)
+VERSIONS_RETRIEVALS_COALESCED = METRICS.counter(
+    "bring_versions_retrievals_coalesced_total",
+    "Number of times a version retrieval was skipped because another task or process retrieved the same versions.",
+)
+INSTALL_CACHE_HITS = METRICS.counter(
+    "bring_install_cache_hits_total",
+    "Number of package installs that could be served from the install cache.",
+)
+INSTALL_CACHE_MISSES = METRICS.counter(
+    "bring_install_cache_misses_total",
+    "Number of package installs that had to run the transform pipeline.",
+)
+STEP_CACHE_HITS = METRICS.counter(
+    "bring_step_cache_hits_total",
+    "Number of package installs that could skip one or more transform steps, because their results were cached.",
+)
+STEP_CACHE_MISSES = METRICS.counter(
+    "bring_step_cache_misses_total",
+    "Number of package installs that had to run all transform steps.",
+)
+DOWNLOAD_CACHE_HITS = METRICS.counter(
+    "bring_download_cache_hits_total",
+    "Number of downloads that could be served from the download cache.",
+)
+DOWNLOAD_CACHE_MISSES = METRICS.counter(
+    "bring_download_cache_misses_total",
+    "Number of downloads that had to use the network.",
+)
+BINARY_CACHE_HITS = METRICS.counter(
+    "bring_binary_cache_hits_total",
+    "Number of package installs that could use a prebuilt package from a binary cache.",
+)
+BINARY_CACHE_MISSES = METRICS.counter(
+    "bring_binary_cache_misses_total",
+    "Number of package installs that had to be built because no binary cache had the package.",
+)
+BYTES_CLONED = METRICS.counter(
+    "bring_git_cloned_bytes_total",
+    "Number of bytes added to the git checkout cache by clones and fetches.",
+)
+BYTES_DOWNLOADED = METRICS.counter(
+    "bring_downloaded_bytes_total", "Number of bytes downloaded."
+)
+BYTES_COPIED = METRICS.counter(
+    "bring_copied_bytes_total", "Number of bytes copied between local folders."
+)
+CLONE_SIZE = METRICS.histogram(
+    "bring_git_clone_bytes",
+    "Size of git repositories added to, or updated in, the git checkout cache.",
+    buckets=DEFAULT_BYTES_BUCKETS,
+)
+VERSION_FOLDER_SIZE = METRICS.histogram(
+    "bring_version_folder_bytes",
+    "Size of version folders created from a package source.",
+    buckets=DEFAULT_BYTES_BUCKETS,
+)
+VERSIONS_RETRIEVAL_SECONDS = METRICS.histogram(
+    "bring_versions_retrieval_seconds",
+    "Time it takes to retrieve package versions from their source.",
+)
+INSTALL_SECONDS = METRICS.histogram(
+    "bring_install_seconds", "Time it takes to create a package in the install cache."
+)
+LOOP_STALLS = METRICS.counter(
+    "bring_event_loop_stalls_total",
+    "Number of times a callback blocked the event loop for longer than the configured threshold (only counted if 'debug_loop_stalls' is enabled).",
+)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Ordering of version strings (e.g. git tags), and resolution of version ranges.
+
+Version strings are parsed once, following semver and PEP 440 conventions loosely enough to cover most tags in the wild:
+
+- an optional prefix ('v1.2.3', 'release-1.2', 'helm-v3.1.0')
+- release numbers, any number of them ('1', '1.2', '1.2.3.4'), trailing zeros are not significant ('1.2' == '1.2.0')
+- an optional pre-release ('1.0-alpha.1', '1.0a1', '1.0-beta', '1.0rc2', '1.0-pre3'), which sorts before the release
+- an optional post-release ('1.0.post1') and/or development release ('1.0.dev3', sorts before pre-releases)
+- optional build metadata ('1.0+build.5'), which is ignored
+
+Strings that don't parse (e.g. branch names) are not part of the ordering.
+
+Range constraints are comma-separated clauses, all of which need to match:
+
+- comparisons: '>=3.1', '>3.1', '<=3.1', '<3.2', '==3.1.2', '!=3.1.3' ('=3.1.2' and '3.1.2' are the same as '==3.1.2')
+- wildcards: '3.1.*', '3.1.x' (any 3.1 release)
+- tilde: '~2.16' (>=2.16,<2.17), '~2' (>=2,<3)
+- compatible release (PEP 440): '~=2.16' (>=2.16,<3), '~=2.16.1' (>=2.16.1,<2.17)
+- caret (semver): '^1.2.3' (>=1.2.3,<2), '^0.2.3' (>=0.2.3,<0.3)
+
+An upper bound excludes pre-releases of the bound ('<3.2' doesn't match '3.2.0-rc1'). If a range matches both releases and
+pre-releases, the highest release is preferred.
+"""
+
+import functools
+import re
+from bisect import bisect_left, bisect_right
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from frkl.common.exceptions import FrklException
+
+
+_VERSION_REGEX = re.compile(
+    r"^(?:[a-z][\w\-]*?[-_])?v?"
+    r"(?P<release>\d+(?:\.\d+)*)"
+    r"(?:[-_.]?(?P<pre_name>alpha|beta|preview|pre|rc|a|b|c)[-_.]?(?P<pre_number>\d+)?)?"
+    r"(?:[-_.]?post[-_.]?(?P<post>\d+))?"
+    r"(?P<dev_marker>[-_.]?dev[-_.]?(?P<dev>\d+)?)?"
+    r"(?:[-_.]?(?:final|ga|release|stable))?"
+    r"(?:\+[\w.\-]*)?$",
+    re.IGNORECASE,
+)
+
+_PRE_RELEASE_RANKS = {"a": 1, "alpha": 1, "b": 2, "beta": 2, "c": 3, "rc": 3, "pre": 3, "preview": 3}
+
+_CLAUSE_REGEX = re.compile(r"^(?P<op>>=|<=|==|!=|~=|>|<|=|~|\^)?\s*(?P<version>[^\s]+)$")
+
+_DEV_STAGE = 0
+_PRE_STAGE = 1
+_RELEASE_STAGE = 2
+
+VersionKey = Tuple[Tuple[int, ...], Tuple[int, int, int], int]
+"""Sort key of a version: (release numbers without trailing zeros, (stage, pre-release rank, number), post-release)."""
+
+
+class ParsedVersion(NamedTuple):
+
+    key: VersionKey
+    release: Tuple[int, ...]
+    stable: bool
+
+
+def _trim(release: Tuple[int, ...]) -> Tuple[int, ...]:
+
+    end = len(release)
+    while end > 0 and release[end - 1] == 0:
+        end = end - 1
+    return release[0:end]
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_version(version: str) -> Optional[ParsedVersion]:
+    """Parse a version string, returns None if it's not a version."""
+
+    match = _VERSION_REGEX.match(version.strip())
+    if match is None:
+        return None
+
+    release = tuple(int(x) for x in match.group("release").split("."))
+    pre_name = match.group("pre_name")
+    post = int(match.group("post")) if match.group("post") is not None else -1
+
+    if pre_name is not None:
+        stage = (_PRE_STAGE, _PRE_RELEASE_RANKS[pre_name.lower()], int(match.group("pre_number") or 0))
+    elif match.group("dev_marker") is not None:
+        stage = (_DEV_STAGE, 0, int(match.group("dev") or 0))
+    else:
+        stage = (_RELEASE_STAGE, 0, 0)
+
+    return ParsedVersion(key=(_trim(release), stage, post), release=release, stable=stage[0] == _RELEASE_STAGE)
+
+
+def _lowest_key(release: Tuple[int, ...]) -> VersionKey:
+    """The key that sorts before every version (incl. development and pre-releases) of a release."""
+
+    return (_trim(release), (-1, 0, 0), -1)
+
+
+def _bump(release: Tuple[int, ...], index: int) -> Tuple[int, ...]:
+
+    release = release + (0,) * max(index + 1 - len(release), 0)
+    return release[0:index] + (release[index] + 1,)
+
+
+class _Clause(NamedTuple):
+
+    lower: Optional[Tuple[VersionKey, bool]]  # key, inclusive
+    upper: Optional[Tuple[VersionKey, bool]]
+    exclude: Optional[VersionKey]
+
+
+def _parse_clause(clause: str, constraint: str) -> _Clause:
+
+    match = _CLAUSE_REGEX.match(clause.strip())
+    if match is None:
+        raise FrklException(msg=f"Can't parse version range: {constraint}", reason=f"Invalid clause: {clause}")
+    op = match.group("op") or "=="
+    version = match.group("version")
+
+    if version.endswith(".*") or version.lower().endswith(".x"):
+        if op not in ["==", "="]:
+            raise FrklException(msg=f"Can't parse version range: {constraint}", reason=f"Wildcards can only be used for equality: {clause}")
+        parsed = parse_version(version[0:-2])
+        if parsed is None:
+            raise FrklException(msg=f"Can't parse version range: {constraint}", reason=f"Invalid version: {version}")
+        return _Clause(lower=(_lowest_key(parsed.release), True), upper=(_lowest_key(_bump(parsed.release, len(parsed.release) - 1)), False), exclude=None)
+
+    parsed = parse_version(version)
+    if parsed is None:
+        raise FrklException(msg=f"Can't parse version range: {constraint}", reason=f"Invalid version: {version}")
+    key = parsed.key
+    release = parsed.release
+
+    if op in ["==", "="]:
+        return _Clause(lower=(key, True), upper=(key, True), exclude=None)
+    if op == "!=":
+        return _Clause(lower=None, upper=None, exclude=key)
+    if op == ">=":
+        return _Clause(lower=(key, True), upper=None, exclude=None)
+    if op == ">":
+        return _Clause(lower=(key, False), upper=None, exclude=None)
+    if op == "<=":
+        return _Clause(lower=None, upper=(key, True), exclude=None)
+    if op == "<":
+        # '<3.2' doesn't include pre-releases of 3.2
+        return _Clause(lower=None, upper=(_lowest_key(release) if parsed.stable else key, False), exclude=None)
+
+    if op == "~":
+        upper_release = _bump(release, 0 if len(release) == 1 else 1)
+    elif op == "~=":
+        if len(release) < 2:
+            raise FrklException(msg=f"Can't parse version range: {constraint}", reason=f"'~=' needs at least two release numbers: {clause}")
+        upper_release = _bump(release, len(release) - 2)
+    else:
+        # '^': the first non-zero release number must not change
+        significant = next((i for i, x in enumerate(release) if x != 0), len(release) - 1)
+        upper_release = _bump(release, significant)
+
+    return _Clause(lower=(key, True), upper=(_lowest_key(upper_release), False), exclude=None)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_constraint(constraint: str) -> Tuple[_Clause, ...]:
+    """Parse a range constraint (check the module documentation for the syntax)."""
+
+    clauses = [c for c in constraint.split(",") if c.strip()]
+    if not clauses:
+        raise FrklException(msg=f"Can't parse version range: {constraint}", reason="Empty constraint.")
+    return tuple(_parse_clause(c, constraint) for c in clauses)
+
+
+_CONSTRAINT_INDICATOR = re.compile(r"^\s*(>=|<=|==|!=|~=|>|<|~|\^)|,|\.[*xX]\s*$")
+
+
+def is_range_constraint(value: str) -> bool:
+    """Whether a string looks like a range constraint (as opposed to a plain version, or an alias like 'latest')."""
+
+    return _CONSTRAINT_INDICATOR.search(value) is not None
+
+
+class VersionIndex(object):
+    """Version strings, sorted by version, to compute aliases and resolve range constraints with binary search.
+
+    Args:
+        versions (Iterable): version strings (e.g. tag names), strings that aren't versions are ignored
+    """
+
+    def __init__(self, versions: Iterable[str]):
+
+        parsed = []
+        for version in set(versions):
+            p = parse_version(version)
+            if p is not None:
+                parsed.append((p.key, version, p.stable))
+        parsed.sort()
+
+        self._keys: List[VersionKey] = [p[0] for p in parsed]
+        self._versions: List[str] = [p[1] for p in parsed]
+        self._stable: List[bool] = [p[2] for p in parsed]
+
+    @property
+    def versions(self) -> List[str]:
+        """All versions, in ascending order."""
+
+        return self._versions
+
+    def __len__(self) -> int:
+
+        return len(self._versions)
+
+    @property
+    def latest(self) -> Optional[str]:
+        """The highest version, including pre-releases."""
+
+        if not self._versions:
+            return None
+        return self._versions[-1]
+
+    @property
+    def latest_stable(self) -> Optional[str]:
+        """The highest version that is not a pre-release (or development release)."""
+
+        for index in reversed(range(len(self._versions))):
+            if self._stable[index]:
+                return self._versions[index]
+        return None
+
+    def _get_range(self, clauses: Iterable[_Clause]) -> Tuple[int, int, List[VersionKey]]:
+
+        start = 0
+        end = len(self._keys)
+        excluded = []
+        for clause in clauses:
+            if clause.lower is not None:
+                key, inclusive = clause.lower
+                start = max(start, bisect_left(self._keys, key) if inclusive else bisect_right(self._keys, key))
+            if clause.upper is not None:
+                key, inclusive = clause.upper
+                end = min(end, bisect_right(self._keys, key) if inclusive else bisect_left(self._keys, key))
+            if clause.exclude is not None:
+                excluded.append(clause.exclude)
+        return (start, end, excluded)
+
+    def resolve_all(self, constraint: str) -> List[str]:
+        """Return all versions that match a range constraint, in ascending order."""
+
+        start, end, excluded = self._get_range(parse_constraint(constraint))
+        return [self._versions[i] for i in range(start, end) if self._keys[i] not in excluded]
+
+    def resolve(self, constraint: str) -> Optional[str]:
+        """Return the highest version that matches a range constraint (preferring releases over pre-releases), or None."""
+
+        start, end, excluded = self._get_range(parse_constraint(constraint))
+
+        fallback = None
+        for index in reversed(range(start, end)):
+            if self._keys[index] in excluded:
+                continue
+            if self._stable[index]:
+                return self._versions[index]
+            if fallback is None:
+                fallback = self._versions[index]
+        return fallback
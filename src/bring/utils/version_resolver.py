@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""Resolution of package versions from (partial) input values.
+
+Versions are identified by the values of their id vars (e.g. 'version', or 'version', 'os' and 'arch' for a template
+matrix). The resolver indexes every variable once, as a map of value to a bitset of the versions that have it, so
+filtering by a value is a dictionary lookup and an integer 'and', no matter how many versions there are.
+
+Input values are applied first: a version that has a different value for an input variable is not a candidate
+(versions that don't use the variable at all stay candidates). Then the defaults of the version args are applied
+to the variables that are not part of the input, as long as they don't rule out all candidates. Candidates are
+ranked by the number of input values they match, then by the number of defaults they match, then by the order of
+the versions (which is the order of the version source, e.g. highest version first).
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from bring.utils.aliases import is_hashable
+
+if TYPE_CHECKING:
+    from bring.pkg.versions import PkgVersion
+
+
+MAX_EXPLAIN_VALUES = 10
+"""Max. number of available values to list when explaining why no version matches."""
+
+
+class VersionCandidate(NamedTuple):
+
+    version: "PkgVersion"
+    score: int
+    default_score: int
+
+
+def _bits(mask: int) -> Iterable[int]:
+
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask = mask ^ low
+
+
+class VersionResolver(object):
+    """Index of the id vars of a list of versions, to find and rank the versions that match some input values.
+
+    Args:
+        versions (Iterable): the versions, in order of preference
+        defaults (Mapping): default values for id vars (usually from the version args)
+    """
+
+    def __init__(self, versions: Iterable["PkgVersion"], defaults: Optional[Mapping[str, Any]] = None):
+
+        self._versions: List["PkgVersion"] = list(versions)
+        self._all: int = (1 << len(self._versions)) - 1
+
+        self._index: Dict[str, Dict[Any, int]] = {}
+        # values that can't be dictionary keys, compared one by one
+        self._unhashable: Dict[str, List[Tuple[int, Any]]] = {}
+        self._has_var: Dict[str, int] = {}
+
+        for position, version in enumerate(self._versions):
+            bit = 1 << position
+            for var_name, value in version.id_vars.items():
+                self._has_var[var_name] = self._has_var.get(var_name, 0) | bit
+                if is_hashable(value):
+                    var_index = self._index.setdefault(var_name, {})
+                    var_index[value] = var_index.get(value, 0) | bit
+                else:
+                    self._unhashable.setdefault(var_name, []).append((position, value))
+
+        if defaults is None:
+            defaults = {}
+        self._defaults: Mapping[str, Any] = {k: v for k, v in defaults.items() if k in self._has_var.keys()}
+
+    @property
+    def var_names(self) -> List[str]:
+        """The names of all id vars of the versions."""
+
+        return list(self._has_var.keys())
+
+    @property
+    def defaults(self) -> Mapping[str, Any]:
+
+        return self._defaults
+
+    def get_values(self, var_name: str, mask: Optional[int] = None) -> List[Any]:
+        """Return the distinct values of an id var (of all versions, or the ones in the mask), in version order."""
+
+        if mask is None:
+            mask = self._all
+        values = [value for value, value_mask in self._index.get(var_name, {}).items() if value_mask & mask]
+        for position, value in self._unhashable.get(var_name, []):
+            if (1 << position) & mask and value not in values:
+                values.append(value)
+        return values
+
+    def has_value(self, var_name: str, value: Any) -> bool:
+        """Whether any version has this value for an id var."""
+
+        return self._match_mask(var_name, value) != 0
+
+    def _match_mask(self, var_name: str, value: Any) -> int:
+
+        mask = 0
+        if is_hashable(value):
+            mask = self._index.get(var_name, {}).get(value, 0)
+        for position, v in self._unhashable.get(var_name, []):
+            if v == value:
+                mask = mask | (1 << position)
+        return mask
+
+    def _allowed_mask(self, var_name: str, value: Any) -> int:
+        """Versions that have the value, or don't use the variable."""
+
+        return self._match_mask(var_name, value) | (self._all & ~self._has_var[var_name])
+
+    def find_candidates(self, input_values: Mapping[str, Any]) -> List[VersionCandidate]:
+        """Return the versions that match the input values, best match first.
+
+        Input values that are not id vars of any version (e.g. install arguments) are ignored.
+        """
+
+        mask = self._all
+        match_masks = []
+        for var_name, value in input_values.items():
+            if var_name not in self._has_var.keys():
+                continue
+            mask = mask & self._allowed_mask(var_name, value)
+            if not mask:
+                return []
+            match_masks.append(self._match_mask(var_name, value))
+
+        default_masks = []
+        for var_name, value in self._defaults.items():
+            if var_name in input_values.keys():
+                continue
+            narrowed = mask & self._allowed_mask(var_name, value)
+            # a default that doesn't fit the input is ignored
+            if narrowed:
+                mask = narrowed
+                default_masks.append(self._match_mask(var_name, value))
+
+        candidates = []
+        for position in _bits(mask):
+            bit = 1 << position
+            candidates.append(VersionCandidate(
+                version=self._versions[position],
+                score=sum(1 for m in match_masks if m & bit),
+                default_score=sum(1 for m in default_masks if m & bit),
+            ))
+        candidates.sort(key=lambda c: (-c.score, -c.default_score))
+
+        return candidates
+
+    def get_ambiguous_vars(self, candidates: Sequence[VersionCandidate]) -> List[str]:
+        """Return the id vars whose values differ between the best ranked candidates (empty if there is a single best one)."""
+
+        if not candidates:
+            return []
+        best = [c for c in candidates if c.score == candidates[0].score and c.default_score == candidates[0].default_score]
+        if len(best) == 1:
+            return []
+
+        result = []
+        for var_name in self._has_var.keys():
+            first = best[0].version.id_vars.get(var_name, None)
+            if any(c.version.id_vars.get(var_name, None) != first for c in best[1:]):
+                result.append(var_name)
+        return result
+
+    def explain(self, input_values: Mapping[str, Any]) -> Optional[str]:
+        """Explain why no version matches the input values (or return None if some do)."""
+
+        if not self._versions:
+            return "Package has no versions."
+
+        mask = self._all
+        applied: List[str] = []
+        for var_name, value in input_values.items():
+            if var_name not in self._has_var.keys():
+                continue
+            narrowed = mask & self._allowed_mask(var_name, value)
+            if not narrowed:
+                available = [str(v) for v in self.get_values(var_name, mask)]
+                if len(available) > MAX_EXPLAIN_VALUES:
+                    available = available[0:MAX_EXPLAIN_VALUES] + ["..."]
+                condition = f" (with {', '.join(applied)})" if applied else ""
+                return f"No version has {var_name}='{value}'{condition}, available values: {', '.join(available)}"
+            mask = narrowed
+            applied.append(f"{var_name}='{value}'")
+
+        return None
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Run or compare *bring* benchmarks.
+
+Examples:
+
+    python -m tests.benchmarks run --size medium --output results.json
+    python -m tests.benchmarks compare base.json results.json --threshold 0.1
+
+All caches are redirected into a temporary folder (via 'XDG_CACHE_HOME') before *bring* is imported, so a run never
+touches the cache of the current user, and always starts from the same (empty) state.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+
+def _run(args) -> int:
+
+    base_dir = tempfile.mkdtemp(prefix="bring_benchmarks_")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(base_dir, "cache")
+    os.environ["XDG_DATA_HOME"] = os.path.join(base_dir, "data")
+
+    import anyio
+
+    from tests.benchmarks.suite import run_benchmarks
+
+    try:
+        results = anyio.run(
+            run_benchmarks,
+            base_dir,
+            args.benchmark,
+            args.size,
+            args.repeat,
+            args.seed,
+            lambda msg: print(msg, file=sys.stderr),
+        )
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+        else:
+            print(f"Benchmark folder: {base_dir}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    return 0
+
+
+def _compare(args) -> int:
+
+    from tests.benchmarks.suite import compare_results
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    if base["meta"]["fixture_params"] != new["meta"]["fixture_params"]:
+        print("Warning: benchmark runs used different fixture parameters.", file=sys.stderr)
+
+    rows = compare_results(base, new, threshold=args.threshold)
+    print(f"{'benchmark':<40} {'base (ms)':>12} {'new (ms)':>12} {'ratio':>8}  status")
+    for row in rows:
+        print(
+            f"{row['name']:<40} {row['base'] * 1000:>12.3f} {row['new'] * 1000:>12.3f} {row['ratio']:>8.3f}  {row['status']}"
+        )
+
+    if any(row["status"] == "regression" for row in rows):
+        return 1
+    return 0
+
+
+def main() -> int:
+
+    parser = argparse.ArgumentParser(prog="python -m tests.benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run benchmarks")
+    run_parser.add_argument("benchmark", nargs="*", help="the benchmarks to run (default: all)")
+    run_parser.add_argument("--size", default="small", help="fixture size: small, medium, large")
+    run_parser.add_argument("--repeat", type=int, default=5, help="number of timed iterations per benchmark")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed for the fixture generation")
+    run_parser.add_argument("--output", "-o", help="file to write the results to (default: stdout)")
+    run_parser.add_argument("--keep", action="store_true", help="don't delete the benchmark folder after the run")
+    run_parser.set_defaults(func=_run)
+
+    compare_parser = subparsers.add_parser("compare", help="compare the results of two runs")
+    compare_parser.add_argument("base", help="results of the baseline run")
+    compare_parser.add_argument("new", help="results of the run to compare")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change that counts as regression/improvement")
+    compare_parser.set_defaults(func=_compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
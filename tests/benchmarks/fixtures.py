@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Synthetic, reproducible fixtures for the *bring* benchmarks.
+
+All content is generated from a seeded random generator, so the same parameters always lead to identical
+repositories (including commit hashes) and artefacts.
+"""
+
+import io
+import os
+import random
+import tarfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Mapping, Optional
+
+from dulwich.objects import Blob, Commit, Tag, Tree
+from dulwich.repo import Repo
+
+
+FIXTURE_SIZES: Mapping[str, Mapping[str, int]] = {
+    "small": {"commits": 50, "tags": 10, "branches": 3, "files": 20, "file_size": 1024},
+    "medium": {"commits": 1000, "tags": 100, "branches": 10, "files": 200, "file_size": 4096},
+    "large": {"commits": 10000, "tags": 1000, "branches": 50, "files": 2000, "file_size": 8192},
+}
+
+AUTHOR = b"Bring Benchmark <benchmark@bring.invalid>"
+BASE_TIME = 1577836800  # 2020-01-01
+
+
+def _random_bytes(rnd: random.Random, size: int) -> bytes:
+
+    return rnd.getrandbits(size * 8).to_bytes(size, "little")
+
+
+class _TreeBuilder(object):
+    """Keeps the blobs of a (two-level) file tree, and only re-creates the tree objects that changed."""
+
+    def __init__(self, repo: Repo):
+
+        self._store = repo.object_store
+        self._folders: Dict[str, Dict[str, bytes]] = {}
+        self._folder_trees: Dict[str, bytes] = {}
+        self._dirty: set = set()
+
+    def set_file(self, path: str, content: bytes) -> None:
+
+        folder, _, name = path.rpartition("/")
+        blob = Blob.from_string(content)
+        self._store.add_object(blob)
+        self._folders.setdefault(folder, {})[name] = blob.id
+        self._dirty.add(folder)
+
+    def _write_tree(self, entries: Mapping[str, Any]) -> bytes:
+
+        tree = Tree()
+        for name, (mode, sha) in entries.items():
+            tree.add(name.encode("utf-8"), mode, sha)
+        self._store.add_object(tree)
+        return tree.id
+
+    def build(self) -> bytes:
+
+        for folder in self._dirty:
+            if folder:
+                self._folder_trees[folder] = self._write_tree(
+                    {k: (0o100644, v) for k, v in self._folders[folder].items()}
+                )
+        self._dirty = set()
+
+        root: Dict[str, Any] = {k: (0o100644, v) for k, v in self._folders.get("", {}).items()}
+        for folder, tree_id in self._folder_trees.items():
+            root[folder] = (0o040000, tree_id)
+        return self._write_tree(root)
+
+
+def create_git_repo(
+    path: str,
+    commits: int = 50,
+    tags: int = 10,
+    branches: int = 3,
+    files: int = 20,
+    file_size: int = 1024,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Create a synthetic git repository (with working tree) at the specified path.
+
+    Each commit changes one file. Tags (annotated and lightweight, alternating) are spread evenly across the history,
+    using semver names ('v<major>.<minor>.<patch>'). Branches point to commits towards the end of the history.
+
+    Returns:
+        Mapping: details about the created repository ('path', 'tags', 'branches', 'files', 'head')
+    """
+
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    repo = Repo.init(path)
+
+    file_names = []
+    for i in range(files):
+        folder = f"dir_{i % 10}" if files > 10 else ""
+        name = f"file_{i}.txt"
+        file_names.append(f"{folder}/{name}" if folder else name)
+
+    tree_builder = _TreeBuilder(repo)
+    for name in file_names:
+        tree_builder.set_file(name, _random_bytes(rnd, file_size))
+
+    parent: Optional[bytes] = None
+    commit_ids: List[bytes] = []
+    for i in range(commits):
+        changed = file_names[i % len(file_names)]
+        tree_builder.set_file(changed, _random_bytes(rnd, file_size))
+
+        commit = Commit()
+        commit.tree = tree_builder.build()
+        commit.parents = [parent] if parent else []
+        commit.author = commit.committer = AUTHOR
+        commit.author_time = commit.commit_time = BASE_TIME + i * 3600
+        commit.author_timezone = commit.commit_timezone = 0
+        commit.encoding = b"UTF-8"
+        commit.message = f"commit {i}: change {changed}".encode("utf-8")
+        repo.object_store.add_object(commit)
+        commit_ids.append(commit.id)
+        parent = commit.id
+
+    repo.refs[b"refs/heads/master"] = parent
+    repo.refs.set_symbolic_ref(b"HEAD", b"refs/heads/master")
+
+    tag_names = []
+    if tags:
+        step = max(commits // tags, 1)
+        for i in range(min(tags, commits)):
+            commit_id = commit_ids[i * step]
+            name = f"v{i // 100}.{(i // 10) % 10}.{i % 10}"
+            if i % 2 == 0:
+                tag = Tag()
+                tag.tagger = AUTHOR
+                tag.message = f"release {name}".encode("utf-8")
+                tag.name = name.encode("utf-8")
+                tag.object = (Commit, commit_id)
+                tag.tag_time = BASE_TIME + i
+                tag.tag_timezone = 0
+                repo.object_store.add_object(tag)
+                repo.refs[f"refs/tags/{name}".encode("utf-8")] = tag.id
+            else:
+                repo.refs[f"refs/tags/{name}".encode("utf-8")] = commit_id
+            tag_names.append(name)
+
+    branch_names = []
+    for i in range(branches):
+        name = f"branch_{i}"
+        repo.refs[f"refs/heads/{name}".encode("utf-8")] = commit_ids[-1 - (i % len(commit_ids))]
+        branch_names.append(name)
+
+    repo.reset_index()
+
+    return {
+        "path": path,
+        "tags": tag_names,
+        "branches": branch_names,
+        "files": file_names,
+        "head": parent.decode("ascii") if parent else None,
+    }
+
+
+def create_artefacts(path: str, count: int = 5, size: int = 1024 * 1024, seed: int = 0) -> List[str]:
+    """Create gzipped tarballs with random content in the provided folder, return their file names."""
+
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+
+    names = []
+    for i in range(count):
+        name = f"artefact-{i}.tar.gz"
+        data = _random_bytes(rnd, size)
+        with tarfile.open(os.path.join(path, name), "w:gz") as tar:
+            info = tarfile.TarInfo(name=f"artefact-{i}/data.bin")
+            info.size = len(data)
+            info.mtime = BASE_TIME
+            tar.addfile(info, io.BytesIO(data))
+        names.append(name)
+
+    return names
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ArtefactServer(object):
+    """A local HTTP server, serving files from a folder in a background thread.
+
+    Use as context manager:
+
+        with ArtefactServer(folder) as server:
+            url = server.url_for("artefact-0.tar.gz")
+    """
+
+    def __init__(self, folder: str, host: str = "127.0.0.1", port: int = 0):
+
+        self._folder: str = folder
+        self._host: str = host
+        self._port: int = port
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+
+        if self._server is None:
+            raise Exception("Artefact server not started.")
+        return f"http://{self._host}:{self._server.server_address[1]}"
+
+    def url_for(self, name: str) -> str:
+
+        return f"{self.base_url}/{name}"
+
+    def start(self) -> None:
+
+        handler = partial(_QuietHandler, directory=self._folder)
+        self._server = ThreadingHTTPServer((self._host, self._port), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "ArtefactServer":
+
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+
+        self.stop()
@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+"""Benchmark cases for *bring*.
+
+Don't import this module before the cache location is redirected (see '__main__.py'), otherwise the benchmarks
+will use (and modify) the cache folders of the current user.
+"""
+
+import itertools
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Mapping, Optional
+
+from bring.bring import Bring
+from bring.defaults import BRING_PKG_INSTALL_FOLDER, BRING_PKG_VERSION_CACHE, BRING_WORKSPACE_FOLDER
+from bring.pkg import PkgVersion, ResolvePkg
+from bring.pkg.versions import _LOADED_VERSIONS
+from bring.pkg.versions.git_repo import GitRepoSource
+from bring.transform.transformers.folder_content import PkgContentLocalFolder
+from bring.utils.git_backend import get_git_backend
+from bring.utils.git_external import NativeGitBackend
+from bring.utils.git_python import clone_local_repo, ensure_repo_cloned, export_repo_paths, get_repo_info
+from bring.utils.version_index import VersionIndex
+from bring.utils.version_resolver import VersionResolver
+from tests.benchmarks.fixtures import FIXTURE_SIZES, ArtefactServer, create_artefacts, create_git_repo
+
+
+RESULTS_FORMAT_VERSION = 1
+
+
+class BenchmarkContext(object):
+    """Holds the fixtures that are shared between all benchmarks of one run."""
+
+    def __init__(self, base_dir: str, size: str = "small", seed: int = 0):
+
+        if size not in FIXTURE_SIZES.keys():
+            raise ValueError(f"Invalid fixture size '{size}', allowed: {', '.join(FIXTURE_SIZES.keys())}")
+
+        self.base_dir: str = base_dir
+        self.size: str = size
+        self.seed: int = seed
+        self.params: Mapping[str, int] = FIXTURE_SIZES[size]
+
+        self.bring: Bring = Bring()
+        self.repo: Dict[str, Any] = {}
+        self.cache_path: Optional[str] = None
+        self.artefacts: List[str] = []
+        self.server: Optional[ArtefactServer] = None
+        self.state: Dict[str, Any] = {}
+
+    @property
+    def repo_url(self) -> str:
+        return self.repo["path"]
+
+    async def setup(self) -> None:
+
+        self.repo = create_git_repo(
+            os.path.join(self.base_dir, "fixtures", "repo"), seed=self.seed, **self.params
+        )
+        self.cache_path = await ensure_repo_cloned(self.repo_url, update=False)
+
+        artefact_folder = os.path.join(self.base_dir, "fixtures", "artefacts")
+        self.artefacts = create_artefacts(artefact_folder, seed=self.seed)
+        self.server = ArtefactServer(artefact_folder)
+        self.server.start()
+
+    def teardown(self) -> None:
+
+        if self.server is not None:
+            self.server.stop()
+
+    def create_source(self, use_commits_as_versions: bool = False) -> GitRepoSource:
+
+        return GitRepoSource(
+            tingistry=self.bring.tingistry,
+            url=self.repo_url,
+            use_commits_as_versions=use_commits_as_versions,
+        )
+
+    def temp_dir(self, prefix: str) -> str:
+
+        path = os.path.join(self.base_dir, "work")
+        os.makedirs(path, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f"{prefix}_", dir=path)
+
+
+class Benchmark(object):
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[BenchmarkContext], Awaitable[Any]],
+        setup: Optional[Callable[[BenchmarkContext], Awaitable[Any]]] = None,
+        doc: Optional[str] = None,
+    ):
+
+        self.name: str = name
+        self.func: Callable[[BenchmarkContext], Awaitable[Any]] = func
+        self.setup: Optional[Callable[[BenchmarkContext], Awaitable[Any]]] = setup
+        self.doc: Optional[str] = doc
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str, setup: Optional[Callable[[BenchmarkContext], Awaitable[Any]]] = None):
+    """Register a benchmark. The optional 'setup' coroutine is run (untimed) before every iteration."""
+
+    def wrapper(func):
+        BENCHMARKS[name] = Benchmark(name=name, func=func, setup=setup, doc=func.__doc__)
+        return func
+
+    return wrapper
+
+
+@benchmark("get_repo_info")
+async def bench_get_repo_info(ctx: BenchmarkContext):
+    """Collect commit, tag and branch metadata from the cached repository."""
+
+    get_repo_info(ctx.cache_path)
+
+
+@benchmark("git_repo_retrieve_versions")
+async def bench_git_repo_retrieve_versions(ctx: BenchmarkContext):
+    """Create the version list for a 'git_repo' package (tags and branches)."""
+
+    source = ctx.create_source()
+    await source._retrieve_pkg_versions(**source.validated_pkg_input_values)
+
+
+@benchmark("git_repo_retrieve_versions_commits")
+async def bench_git_repo_retrieve_versions_commits(ctx: BenchmarkContext):
+    """Create the version list for a 'git_repo' package, with 'use_commits_as_versions' enabled."""
+
+    source = ctx.create_source(use_commits_as_versions=True)
+    await source._retrieve_pkg_versions(**source.validated_pkg_input_values)
+
+
+@benchmark("clone_local_repo")
+async def bench_clone_local_repo(ctx: BenchmarkContext):
+    """Create a checkout of the latest tag from the cached repository."""
+
+    target = os.path.join(ctx.temp_dir("clone"), "repo")
+    clone_local_repo(ctx.cache_path, target, version=ctx.repo["tags"][-1])
+
+
+@benchmark("export_repo_single_file")
+async def bench_export_repo_single_file(ctx: BenchmarkContext):
+    """Write a single file of the latest tag from the cached repository."""
+
+    target = os.path.join(ctx.temp_dir("export"), "repo")
+    export_repo_paths(ctx.cache_path, target, [ctx.repo["files"][0]], version=ctx.repo["tags"][-1])
+
+
+async def _setup_versions(ctx: BenchmarkContext):
+
+    if "source" not in ctx.state.keys():
+        source = ctx.create_source(use_commits_as_versions=True)
+        await source.get_versions()
+        ctx.state["source"] = source
+
+
+@benchmark("find_matching_version", setup=_setup_versions)
+async def bench_find_matching_version(ctx: BenchmarkContext):
+    """Find the version that matches a tag, with all commits as versions."""
+
+    await ctx.state["source"].find_matching_version(version=ctx.repo["tags"][0])
+
+
+@benchmark("versions_cache_roundtrip", setup=_setup_versions)
+async def bench_versions_cache_roundtrip(ctx: BenchmarkContext):
+    """Write the versions of a package to the metadata cache, and read them back."""
+
+    source: GitRepoSource = ctx.state["source"]
+    versions = await source.get_versions()
+    args = await source.get_version_args_dict()
+    await source.write_versions_cache(versions, args)
+    # read the cache file, not the versions kept in memory
+    _LOADED_VERSIONS.clear()
+    await source.get_cached_versions(skip_validity_check=True)
+
+
+@benchmark("versions_memory_cache_hit", setup=_setup_versions)
+async def bench_versions_memory_cache_hit(ctx: BenchmarkContext):
+    """Load the versions of a package that were loaded from the metadata cache before (by another version source)."""
+
+    source: GitRepoSource = ctx.state["source"]
+    await source.get_cached_versions(skip_validity_check=True)
+
+
+VERSION_INDEX_SIZE = 5000
+"""Number of versions for the version range benchmark."""
+
+
+async def _setup_version_index(ctx: BenchmarkContext):
+
+    if "version_index" not in ctx.state.keys():
+        versions = []
+        for i in range(VERSION_INDEX_SIZE):
+            versions.append(f"v{i // 500}.{(i // 20) % 25}.{i % 20}")
+            if i % 10 == 0:
+                versions.append(f"v{i // 500}.{(i // 20) % 25}.{i % 20}-rc1")
+        ctx.state["version_index"] = VersionIndex(versions)
+
+
+@benchmark("resolve_version_range", setup=_setup_version_index)
+async def bench_resolve_version_range(ctx: BenchmarkContext):
+    """Resolve a set of range constraints against a large number of versions."""
+
+    index: VersionIndex = ctx.state["version_index"]
+    for constraint in [">=3.1,<3.2", "~5.16", "^0.2.3", "3.1.*", ">=1.0,!=9.24.19"]:
+        index.resolve(constraint)
+
+
+async def _setup_version_matrix(ctx: BenchmarkContext):
+
+    if "version_resolver" not in ctx.state.keys():
+        timestamp = datetime.now()
+        versions = []
+        for version, os_name, arch, libc, variant in itertools.product(
+            [f"{i // 20}.{i % 20}.0" for i in range(200)], ["linux", "darwin", "windows", "freebsd"], ["amd64", "arm64", "arm", "i386", "ppc64le"], ["gnu", "musl"], ["full", "slim"]
+        ):
+            id_vars = {"version": version, "os": os_name, "arch": arch, "libc": libc, "variant": variant}
+            versions.append(PkgVersion(steps=[], id_vars=id_vars, metadata_timestamp=timestamp))
+        defaults = {"version": "9.19.0", "os": "linux", "arch": "amd64", "libc": "gnu", "variant": "full"}
+        ctx.state["version_resolver"] = VersionResolver(versions, defaults=defaults)
+
+
+@benchmark("resolve_version_matrix", setup=_setup_version_matrix)
+async def bench_resolve_version_matrix(ctx: BenchmarkContext):
+    """Resolve partial input against a matrix of 5 variables (16000 versions), filling in defaults."""
+
+    resolver: VersionResolver = ctx.state["version_resolver"]
+    for input_values in [{}, {"os": "darwin"}, {"version": "3.4.0", "arch": "arm64", "libc": "musl"}, {"variant": "slim", "os": "freebsd", "arch": "ppc64le"}]:
+        resolver.find_candidates(input_values)
+
+
+async def _setup_merge_source(ctx: BenchmarkContext):
+
+    if "merge_source" not in ctx.state.keys():
+        target = os.path.join(ctx.temp_dir("merge_source"), "repo")
+        clone_local_repo(ctx.cache_path, target, version="master")
+        shutil.rmtree(os.path.join(target, ".git"))
+        ctx.state["merge_source"] = target
+
+
+@benchmark("folder_content_merge", setup=_setup_merge_source)
+async def bench_folder_content_merge(ctx: BenchmarkContext):
+    """Merge all files of a checkout into a new folder, without content spec."""
+
+    folder = PkgContentLocalFolder(path=ctx.temp_dir("merge_target"), content_spec=None)
+    await folder.merge_folders(ctx.state["merge_source"], item_metadata={})
+
+
+@benchmark("folder_content_merge_single_file", setup=_setup_merge_source)
+async def bench_folder_content_merge_single_file(ctx: BenchmarkContext):
+    """Merge a single file of a checkout into a new folder, using a content spec."""
+
+    folder = PkgContentLocalFolder(path=ctx.temp_dir("merge_target"), content_spec=[ctx.repo["files"][0]])
+    await folder.merge_folders(ctx.state["merge_source"], item_metadata={})
+
+
+def _create_pkg(ctx: BenchmarkContext) -> ResolvePkg:
+
+    return ResolvePkg(
+        tingistry=ctx.bring.tingistry,
+        pkg={"type": "git_repo", "url": ctx.repo_url},
+        content=[ctx.repo["files"][0]],
+    )
+
+
+async def _setup_install_cold(ctx: BenchmarkContext):
+
+    for folder in [BRING_PKG_INSTALL_FOLDER, BRING_PKG_VERSION_CACHE, os.path.join(BRING_WORKSPACE_FOLDER, "version_data")]:
+        shutil.rmtree(folder, ignore_errors=True)
+    await _create_pkg(ctx).get_versions()
+
+
+@benchmark("install_cold", setup=_setup_install_cold)
+async def bench_install_cold(ctx: BenchmarkContext):
+    """Install a single-file package from a 'git_repo' source, with empty version and install caches."""
+
+    await _create_pkg(ctx).install(version="master")
+
+
+async def _setup_install_cached(ctx: BenchmarkContext):
+
+    await _create_pkg(ctx).install(version="master")
+
+
+@benchmark("install_cached", setup=_setup_install_cached)
+async def bench_install_cached(ctx: BenchmarkContext):
+    """Install a package that is already in the install cache."""
+
+    await _create_pkg(ctx).install(version="master")
+
+
+@benchmark("http_fetch_artefact")
+async def bench_http_fetch_artefact(ctx: BenchmarkContext):
+    """Baseline: fetch an artefact from the local HTTP server, without any caching."""
+
+    with urllib.request.urlopen(ctx.server.url_for(ctx.artefacts[0])) as response:  # type: ignore
+        while response.read(1024 * 64):
+            pass
+
+
+SMALL_REPOS = 20
+"""Number of repositories for the 'many small repositories' git backend benchmarks."""
+
+
+async def _setup_small_repos(ctx: BenchmarkContext):
+
+    if "small_repos" not in ctx.state.keys():
+        repos = []
+        for i in range(SMALL_REPOS):
+            repo = create_git_repo(
+                os.path.join(ctx.base_dir, "fixtures", "small_repos", f"repo_{i}"),
+                commits=10, tags=3, branches=1, files=5, file_size=512, seed=ctx.seed + i,
+            )
+            repos.append(repo)
+        ctx.state["small_repos"] = repos
+
+
+def _register_git_backend_benchmarks(backend_name: str):
+    """Register the same set of benchmarks for a git backend, so the backends can be compared directly."""
+
+    @benchmark(f"git_{backend_name}_clone")
+    async def bench_clone(ctx: BenchmarkContext):
+        """Clone the fixture repository into a new bare, mirrored repository."""
+
+        target = os.path.join(ctx.temp_dir("clone"), "repo")
+        await get_git_backend(backend_name).clone(ctx.repo_url, target)
+
+    @benchmark(f"git_{backend_name}_repo_info")
+    async def bench_repo_info(ctx: BenchmarkContext):
+        """Collect commit, tag and branch metadata from the cached repository."""
+
+        await get_git_backend(backend_name).get_repo_info(ctx.cache_path)
+
+    @benchmark(f"git_{backend_name}_checkout")
+    async def bench_checkout(ctx: BenchmarkContext):
+        """Create a checkout of the latest tag from the cached repository."""
+
+        target = os.path.join(ctx.temp_dir("checkout"), "repo")
+        await get_git_backend(backend_name).export_tree(ctx.cache_path, target, version=ctx.repo["tags"][-1])
+
+    @benchmark(f"git_{backend_name}_many_small_repos", setup=_setup_small_repos)
+    async def bench_many_small_repos(ctx: BenchmarkContext):
+        """Clone many small repositories, read their metadata, and export a single file of each."""
+
+        backend = get_git_backend(backend_name)
+        work_dir = ctx.temp_dir("small_repos")
+        for i, repo in enumerate(ctx.state["small_repos"]):
+            cache_path = os.path.join(work_dir, f"cache_{i}")
+            await backend.clone(repo["path"], cache_path)
+            await backend.get_repo_info(cache_path, include_history=False)
+            await backend.export_tree(cache_path, os.path.join(work_dir, f"export_{i}"), version="master", paths=[repo["files"][0]])
+
+
+_register_git_backend_benchmarks("dulwich")
+if NativeGitBackend.is_available():
+    _register_git_backend_benchmarks("native")
+    _register_git_backend_benchmarks("auto")
+
+
+def _get_git_revision() -> Optional[str]:
+
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode("ascii").strip()
+    except Exception:
+        return None
+
+
+def _summarize(samples: List[float]) -> Dict[str, Any]:
+
+    return {
+        "repeat": len(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "mean": statistics.mean(samples),
+        "median": statistics.median(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "samples": samples,
+    }
+
+
+async def run_benchmarks(
+    base_dir: str,
+    names: Optional[Iterable[str]] = None,
+    size: str = "small",
+    repeat: int = 5,
+    seed: int = 0,
+    progress: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """Run the selected (or all) benchmarks, return the results in a json-serializable dict."""
+
+    if not names:
+        names = list(BENCHMARKS.keys())
+    else:
+        names = list(names)
+        for n in names:
+            if n not in BENCHMARKS.keys():
+                raise ValueError(f"Invalid benchmark name '{n}', allowed: {', '.join(BENCHMARKS.keys())}")
+
+    ctx = BenchmarkContext(base_dir=base_dir, size=size, seed=seed)
+    start = time.perf_counter()
+    await ctx.setup()
+    setup_time = time.perf_counter() - start
+
+    results: Dict[str, Any] = {}
+    try:
+        for name in names:
+            bm = BENCHMARKS[name]
+            samples: List[float] = []
+            for _ in range(repeat):
+                if bm.setup is not None:
+                    await bm.setup(ctx)
+                start = time.perf_counter()
+                await bm.func(ctx)
+                samples.append(time.perf_counter() - start)
+            results[name] = _summarize(samples)
+            if progress is not None:
+                progress(f"{name}: median {results[name]['median'] * 1000:.3f} ms")
+    finally:
+        ctx.teardown()
+
+    return {
+        "format_version": RESULTS_FORMAT_VERSION,
+        "meta": {
+            "git_revision": _get_git_revision(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "size": size,
+            "seed": seed,
+            "fixture_params": dict(ctx.params),
+            "fixture_setup_seconds": setup_time,
+            "timestamp": time.time(),
+        },
+        "results": results,
+    }
+
+
+def compare_results(
+    base: Mapping[str, Any], new: Mapping[str, Any], threshold: float = 0.1
+) -> List[Dict[str, Any]]:
+    """Compare the median times of two benchmark runs.
+
+    Returns:
+        List: one item per benchmark that exists in both runs, with the 'ratio' of new/base medians and a 'status' of
+            'regression', 'improvement' or 'unchanged' (depending on whether the ratio differs from 1 more than 'threshold')
+    """
+
+    rows = []
+    for name, base_result in base["results"].items():
+        new_result = new["results"].get(name, None)
+        if new_result is None:
+            continue
+
+        ratio = new_result["median"] / base_result["median"] if base_result["median"] else float("inf")
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 - threshold:
+            status = "improvement"
+        else:
+            status = "unchanged"
+
+        rows.append(
+            {
+                "name": name,
+                "base": base_result["median"],
+                "new": new_result["median"],
+                "ratio": ratio,
+                "status": status,
+            }
+        )
+    return rows
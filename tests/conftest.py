@@ -14,6 +14,7 @@ from collections import Callable
 import pytest
 
 from bring.bring import Bring
+from bring.config.settings import reset_settings, set_setting
 
 
 @pytest.fixture
@@ -27,3 +28,34 @@ def resource_folder() :
 
     res_folder = os.path.join(os.path.dirname(__file__), "resources")
     return res_folder
+
+
+@pytest.fixture
+def pkg_caches(tmp_path, monkeypatch):
+    """Redirect all caches an install goes through into the test folder, so they start out empty."""
+
+    cache_folder = tmp_path / "cache"
+    workspace_folder = str(cache_folder / "workspace")
+    results_folder = str(cache_folder / "workspace" / "results")
+    paths = {
+        "bring.utils.git_backend.BRING_GIT_CHECKOUT_CACHE": str(cache_folder / "git_checkouts"),
+        "bring.pkg.versions.BRING_PKG_METADATA_CACHE": str(cache_folder / "pkg_metadata"),
+        "bring.pkg.versions.BRING_PKG_VERSION_CACHE": str(cache_folder / "pkg_versions"),
+        "bring.pkg.versions.BRING_RESULTS_FOLDER": results_folder,
+        "bring.pkg.versions.git_repo.BRING_WORKSPACE_FOLDER": workspace_folder,
+        "bring.pkg.versions.git_repo.BRING_RESULTS_FOLDER": results_folder,
+        "bring.transform.pipeline.BRING_WORKSPACE_FOLDER": workspace_folder,
+        "bring.pkg.BRING_PKG_INSTALL_FOLDER": str(cache_folder / "packages"),
+        "bring.utils.downloads.BRING_DOWNLOAD_CACHE": str(cache_folder / "downloads"),
+    }
+    for name, path in paths.items():
+        monkeypatch.setattr(name, path)
+    return str(cache_folder)
+
+
+@pytest.fixture
+def settings():
+    """Restore the default settings after the test."""
+
+    yield set_setting
+    reset_settings()
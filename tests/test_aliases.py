@@ -0,0 +1,26 @@
+import pytest
+
+from bring.utils.aliases import AliasTable
+
+
+def test_alias_table():
+
+    table = AliasTable(
+        pkg_aliases={"arch": {"x86_64": "amd64", "x64": "x86_64"}, "version": {"stable": "latest"}},
+        version_aliases=[{"version": {"latest": "v1.2.0"}}, {}, {"version": {"latest": "v1.2.0"}}],
+    )
+
+    assert table.table["arch"] == {"x86_64": "amd64", "x64": "amd64"}
+    assert table.translate({"arch": "x64", "version": "stable", "os": "linux"}) == {"arch": "amd64", "version": "v1.2.0", "os": "linux"}
+
+    values = {"arch": "arm", "content": ["a"]}
+    assert table.translate(values) is values
+
+
+def test_alias_table_errors():
+
+    with pytest.raises(Exception, match="Alias cycle: a -> b -> a"):
+        AliasTable(pkg_aliases={"arch": {"a": "b", "b": "a"}})
+
+    with pytest.raises(Exception, match="used for different values"):
+        AliasTable(version_aliases=[{"version": {"latest": "v1"}}, {"version": {"latest": "v2"}}])
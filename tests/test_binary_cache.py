@@ -0,0 +1,67 @@
+import functools
+import http.server
+import os
+import threading
+
+import pytest
+
+from bring.config.settings import reset_settings, set_setting
+from bring.pkg.archive import pack_package
+from bring.pkg.binary_cache import add_to_binary_cache, fetch_from_binary_caches
+from bring.pkg.manifest import create_manifest
+
+
+def _create_binary_cache(path, package_id):
+
+    source = path / "package_data"
+    os.makedirs(str(source / "bin"))
+    (source / "bin" / "tool").write_text("tool")
+    manifest = create_manifest(str(source), {"id": "version_1"}, "12345")
+
+    archive_file = pack_package(str(source), manifest, str(path / "cache" / f"{package_id}.bring.tar.gz"))
+    add_to_binary_cache(archive_file)
+    return str(path / "cache")
+
+
+@pytest.fixture
+def http_server(tmp_path):
+
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.mark.anyio
+async def test_binary_cache_fallback(tmp_path, http_server):
+
+    set_setting("binary_cache_key", "secret")
+    try:
+        _create_binary_cache(tmp_path, "version_1_12345")
+        locations = [str(tmp_path / "missing"), f"{http_server}/missing", f"{http_server}/cache"]
+
+        install_folder = str(tmp_path / "node_2")
+        path = await fetch_from_binary_caches("version_1_12345", "version_1", "12345", install_folder, locations=locations)
+        assert path == os.path.join(install_folder, "version_1", "12345", "package_data")
+        with open(os.path.join(path, "bin", "tool")) as f:
+            assert f.read() == "tool"
+
+        assert await fetch_from_binary_caches("version_2_12345", "version_2", "12345", str(tmp_path / "node_3"), locations=locations) is None
+    finally:
+        reset_settings()
+
+
+@pytest.mark.anyio
+async def test_binary_cache_requires_signature(tmp_path):
+
+    local_cache = _create_binary_cache(tmp_path, "version_1_12345")
+
+    set_setting("binary_cache_key", "other_secret")
+    try:
+        assert await fetch_from_binary_caches("version_1_12345", "version_1", "12345", str(tmp_path / "node_2"), locations=[local_cache]) is None
+    finally:
+        reset_settings()
+
+    assert await fetch_from_binary_caches("version_1_12345", "version_1", "12345", str(tmp_path / "node_2"), locations=[local_cache]) is not None
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+from frkl.common.exceptions import FrklException
+
+from bring.index.compiled import _HEADER, INDEX_FORMAT_VERSION, INDEX_MAGIC, load_pkgs
+
+
+def _write_index(path, names):
+
+    toc = {"created": "now", "packages": {name: {"description": [0, 0], "versions": [0, 0], "source_id": name, "num_versions": 1} for name in names}}
+    toc_blob = json.dumps(toc).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, _HEADER.size, len(toc_blob)))
+        f.write(toc_blob)
+    return path
+
+
+@pytest.mark.anyio
+async def test_load_pkgs_is_lazy(tmp_path):
+
+    index_file = _write_index(str(tmp_path / "test.bidx"), ["pkg_1", "pkg_2"])
+
+    # packages are only created when they are accessed (which fails here, since there is no tingistry)
+    packages = await load_pkgs(None, index_file)
+    assert sorted(packages.keys()) == ["pkg_1", "pkg_2"]
+    assert "pkg_1" in packages
+    with pytest.raises(FrklException, match="No tingistry"):
+        packages["pkg_1"]
+    packages.close()
@@ -0,0 +1,97 @@
+import hashlib
+import os
+
+import pytest
+
+from bring.pkg import ResolvePkg
+from bring.utils.downloads import download_file, get_hash_path, read_url_alias
+
+
+def _create_file(path, content):
+
+    path.write_bytes(content)
+    return path.as_uri()
+
+
+@pytest.mark.anyio
+async def test_downloads_are_stored_by_content(tmp_path):
+
+    cache = str(tmp_path / "cache")
+    content = b"x" * 1000
+    checksum = hashlib.sha256(content).hexdigest()
+
+    url_1 = _create_file(tmp_path / "mirror_1.tar.gz", content)
+    url_2 = _create_file(tmp_path / "mirror_2.tar.gz", content)
+
+    path_1 = await download_file(url_1, base_path=cache)
+    path_2 = await download_file(url_2, base_path=cache)
+    assert path_1 == path_2
+    assert os.path.basename(path_1) == checksum
+    assert read_url_alias(url_2, base_path=cache)["sha256"] == checksum
+
+    # with a known checksum, the url is not used at all
+    os.unlink(str(tmp_path / "mirror_1.tar.gz"))
+    assert await download_file(url_1, sha256=checksum.upper(), base_path=cache) == path_1
+
+
+@pytest.mark.anyio
+async def test_download_checksum_mismatch(tmp_path):
+
+    cache = str(tmp_path / "cache")
+    url = _create_file(tmp_path / "file.zip", b"content")
+
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        await download_file(url, sha256="0" * 64, base_path=cache)
+
+    assert os.listdir(os.path.join(cache, "by_hash", "sha256")) == []
+
+
+def _seed_download_cache(pkg_caches, content):
+
+    checksum = hashlib.sha256(content).hexdigest()
+    hash_path = get_hash_path(checksum, base_path=os.path.join(pkg_caches, "downloads"))
+    os.makedirs(os.path.dirname(hash_path))
+    with open(hash_path, "wb") as f:
+        f.write(content)
+    return checksum
+
+
+@pytest.mark.anyio
+async def test_template_url_pkg_uses_cached_download(tmp_path, bring, pkg_caches):
+
+    content = b"#!/bin/sh\necho tool\n"
+    url = _create_file(tmp_path / "tool", content)
+    checksum = _seed_download_cache(pkg_caches, content)
+    os.unlink(str(tmp_path / "tool"))
+
+    pkg = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "template_url", "url": url, "sha256": checksum})
+
+    versions = list(await pkg.get_versions())
+    assert len(versions) == 1
+    assert versions[0].metadata["url"] == url
+    assert versions[0].steps[0]["sha256"] == checksum
+
+    # the source file doesn't exist anymore, the content comes from the download cache
+    package_path = await pkg.install()
+    assert package_path.startswith(pkg_caches)
+    with open(os.path.join(package_path, "tool"), "rb") as f:
+        assert f.read() == content
+
+
+@pytest.mark.anyio
+async def test_template_url_pkg_offline(tmp_path, bring, pkg_caches, settings):
+
+    content = b"offline"
+    url = _create_file(tmp_path / "tool", content)
+    checksum = _seed_download_cache(pkg_caches, content)
+
+    settings("offline", True)
+
+    # no cached metadata, but template_url packages don't need any remote data
+    pkg = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "template_url", "url": url, "sha256": checksum})
+    assert len(list(await pkg.get_versions())) == 1
+
+    package_path = await pkg.install()
+    with open(os.path.join(package_path, "tool"), "rb") as f:
+        assert f.read() == content
+
@@ -0,0 +1,383 @@
+import os
+
+import pytest
+from anyio import create_task_group
+from dulwich import porcelain
+from dulwich.repo import Repo
+
+from bring.utils.git_backend import clone_strategy_satisfies, get_clone_requirement_for_version, get_clone_strategy, \
+    get_git_backend, get_git_cache_path, migrate_to_bare_repo
+from bring.utils.git_external import NativeGitBackend
+from tests.benchmarks.fixtures import create_git_repo
+
+
+BACKENDS = ["dulwich"]
+if NativeGitBackend.is_available():
+    BACKENDS.extend(["native", "auto"])
+
+
+@pytest.fixture
+def git_cache(tmp_path, monkeypatch):
+    """Redirect the git checkout cache into the test folder."""
+
+    cache_folder = str(tmp_path / "git_checkouts")
+    monkeypatch.setattr("bring.utils.git_backend.BRING_GIT_CHECKOUT_CACHE", cache_folder)
+    return cache_folder
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend_name", BACKENDS)
+async def test_git_backend_clone_and_export(tmp_path, backend_name):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=2, files=6, file_size=64)
+    backend = get_git_backend(backend_name)
+
+    cache_path = str(tmp_path / "cache")
+    await backend.clone(repo["path"], cache_path)
+
+    info = await backend.get_repo_info(cache_path)
+    assert sorted(info["tags"].keys()) == sorted(repo["tags"])
+    assert sorted(info["branches"].keys()) == ["branch_0", "branch_1", "master"]
+    assert len(info["commits"]) == 12
+    for metadata in info["commits"].values():
+        assert isinstance(metadata["author_time"], int)
+        assert metadata["author_timezone"] == 0
+
+    target = str(tmp_path / "export")
+    single_file = repo["files"][0]
+    await backend.export_tree(cache_path, target, version=repo["tags"][-1], paths=[single_file, "does_not_exist"])
+    assert os.path.isfile(os.path.join(target, single_file))
+    assert len(os.listdir(target)) == 1
+
+
+@pytest.mark.anyio
+async def test_git_backends_agree(tmp_path):
+
+    if not NativeGitBackend.is_available():
+        pytest.skip("no git executable")
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=1, files=6, file_size=64)
+
+    infos = []
+    for name in ["dulwich", "native"]:
+        cache_path = str(tmp_path / f"cache_{name}")
+        await get_git_backend(name).clone(repo["path"], cache_path)
+        infos.append(await get_git_backend(name).get_repo_info(cache_path))
+
+    assert infos[0] == infos[1]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend_name", BACKENDS)
+async def test_git_backend_offline(tmp_path, backend_name, git_cache, settings):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=4, tags=1, branches=0, files=2, file_size=16)
+    backend = get_git_backend(backend_name)
+
+    settings("offline", True)
+    with pytest.raises(Exception, match="Offline mode"):
+        await backend.ensure_repo_cloned(repo["path"], strategy="shallow", depth=1)
+
+    settings("offline", False)
+    path = await backend.ensure_repo_cloned(repo["path"], strategy="shallow", depth=1)
+    assert path.startswith(git_cache)
+
+    settings("offline", True)
+    assert await backend.ensure_repo_cloned(repo["path"], update=True, strategy="shallow", depth=1) == path
+    if get_clone_strategy(path)[0] != "full":
+        with pytest.raises(Exception, match="Offline mode"):
+            await backend.ensure_repo_cloned(repo["path"], strategy="full")
+
+
+
+@pytest.mark.anyio
+async def test_auto_backend_picks_per_operation(tmp_path, monkeypatch):
+
+    if not NativeGitBackend.is_available():
+        pytest.skip("no git executable")
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=6, tags=2, branches=1, files=3, file_size=16)
+    backend = get_git_backend("auto")
+    assert backend.name == "auto"
+
+    calls = []
+    for name in ["dulwich", "native"]:
+        delegate = get_git_backend(name)
+        for method in ["clone", "list_refs", "get_commits_metadata", "export_tree"]:
+            original = getattr(delegate, method)
+
+            def record(*args, _name=name, _method=method, _original=original, **kwargs):
+                calls.append((_method, _name))
+                return _original(*args, **kwargs)
+
+            monkeypatch.setattr(delegate, method, record)
+
+    cache_path = str(tmp_path / "cache")
+    await backend.clone(repo["path"], cache_path)
+    await backend.get_repo_info(cache_path, include_history=False)
+    await backend.get_repo_info(cache_path, include_history=True)
+    await backend.export_tree(cache_path, str(tmp_path / "single"), version="master", paths=[repo["files"][0]])
+    await backend.export_tree(cache_path, str(tmp_path / "checkout"), version="master")
+    await backend.clone(f"file://{repo['path']}", str(tmp_path / "cache_url"), strategy="shallow", depth=1)
+
+    assert calls == [
+        ("clone", "dulwich"),
+        ("list_refs", "dulwich"),
+        ("get_commits_metadata", "dulwich"),
+        ("list_refs", "dulwich"),
+        ("get_commits_metadata", "native"),
+        ("export_tree", "dulwich"),
+        ("export_tree", "native"),
+        ("clone", "native"),
+    ]
+
+@pytest.mark.parametrize(
+    "existing, required, expected",
+    [
+        (("full", None), ("full", None), True),
+        (("full", None), ("shallow", 1), True),
+        (("full", None), ("tags", 1), True),
+        (("blobless", None), ("full", None), True),
+        (("shallow", 1), ("full", None), False),
+        (("shallow", 1), ("blobless", None), False),
+        (("shallow", 3), ("shallow", 1), True),
+        (("shallow", 1), ("shallow", 3), False),
+        (("shallow", 1), ("tags", 1), True),
+        (("shallow", None), ("shallow", 5), True),
+        (("shallow", 5), ("shallow", None), False),
+        (("tags", 1), ("tags", 1), True),
+        (("tags", 1), ("shallow", 1), False),
+        (("tags", 5), ("shallow", 1), False),
+    ],
+)
+def test_clone_strategy_satisfies(existing, required, expected):
+
+    assert clone_strategy_satisfies(existing, required) is expected
+
+
+def test_clone_requirement_for_version():
+
+    assert get_clone_requirement_for_version("v1.0.0", ref_type="tag", depth=2) == ("tags", 2)
+    assert get_clone_requirement_for_version("master", ref_type="branch") == ("shallow", 1)
+    assert get_clone_requirement_for_version("master") == ("shallow", 1)
+    assert get_clone_requirement_for_version("a" * 40) == ("full", None)
+    assert get_clone_requirement_for_version(None) == ("shallow", 1)
+
+
+def test_backend_supports_strategy():
+
+    assert not get_git_backend("dulwich").supports_strategy("blobless")
+    assert get_git_backend("dulwich").supports_strategy("full")
+    assert not get_git_backend("dulwich").supports_strategy("nope")
+
+    if NativeGitBackend.is_available():
+        assert get_git_backend("native").supports_strategy("blobless")
+        assert get_git_backend("auto").supports_strategy("blobless")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend_name", BACKENDS)
+async def test_insufficient_clone_is_replaced(tmp_path, backend_name, git_cache):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=2, files=6, file_size=64)
+    backend = get_git_backend(backend_name)
+
+    path = await backend.ensure_repo_cloned(repo["path"], strategy="tags", depth=1)
+    assert get_clone_strategy(path)[0] == "tags"
+    tags, branches = await backend.list_refs(path)
+    assert sorted(tags.keys()) == sorted(repo["tags"])
+    assert branches == {}
+
+    # a tags-only clone doesn't contain branches, so it has to be replaced
+    assert await backend.ensure_repo_cloned(repo["path"], strategy="full") == path
+    assert get_clone_strategy(path) == ("full", None)
+    info = await backend.get_repo_info(path)
+    assert sorted(info["branches"].keys()) == ["branch_0", "branch_1", "master"]
+    assert len(info["commits"]) == 12
+
+    # ... and a full clone satisfies everything
+    assert await backend.ensure_repo_cloned(repo["path"], strategy="tags", depth=1) == path
+    assert get_clone_strategy(path) == ("full", None)
+
+
+@pytest.mark.anyio
+async def test_native_shallow_and_tags_clones(tmp_path, git_cache):
+
+    if not NativeGitBackend.is_available():
+        pytest.skip("no git executable")
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=2, files=6, file_size=64)
+    backend = get_git_backend("native")
+    # git ignores the depth for plain local paths, but not for 'file://' urls
+    url = f"file://{repo['path']}"
+
+    path = await backend.ensure_repo_cloned(url, strategy="shallow", depth=1)
+    assert get_clone_strategy(path) == ("shallow", 1)
+    assert os.path.isfile(os.path.join(path, "shallow"))
+    info = await backend.get_repo_info(path, include_history=False)
+    assert sorted(info["branches"].keys()) == ["branch_0", "branch_1", "master"]
+    assert info["branches"]["master"] == repo["head"]
+    history = await backend.get_commits_metadata(path, [repo["head"]], include_history=True)
+    assert len(history) == 1
+
+    # not deep enough
+    assert await backend.ensure_repo_cloned(url, strategy="shallow", depth=3) == path
+    assert get_clone_strategy(path) == ("shallow", 3)
+    history = await backend.get_commits_metadata(path, [repo["head"]], include_history=True)
+    # tags are fetched with the same depth, and some of their commits are ancestors of the head as well
+    assert 3 <= len(history) < 12
+
+    tags_url = f"file://{repo['path']}/"
+    tags_path = await backend.ensure_repo_cloned(tags_url, strategy="tags", depth=1)
+    assert get_clone_strategy(tags_path) == ("tags", 1)
+    assert os.path.isfile(os.path.join(tags_path, "shallow"))
+    tags, branches = await backend.list_refs(tags_path)
+    assert sorted(tags.keys()) == sorted(repo["tags"])
+    assert branches == {}
+
+    # fetching keeps the strategy
+    await backend.ensure_repo_cloned(tags_url, update=True, strategy="tags", depth=1)
+    assert get_clone_strategy(tags_path) == ("tags", 1)
+    assert (await backend.list_refs(tags_path))[1] == {}
+
+
+@pytest.mark.anyio
+async def test_dulwich_local_shallow_clone_is_full(tmp_path, git_cache):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=4, tags=1, branches=0, files=2, file_size=16)
+    backend = get_git_backend("dulwich")
+
+    # dulwich's local transport doesn't support shallow fetches
+    path = await backend.ensure_repo_cloned(repo["path"], strategy="shallow", depth=1)
+    assert get_clone_strategy(path) == ("full", None)
+    assert not os.path.exists(os.path.join(path, "shallow"))
+
+
+def _create_old_cache_entry(url, path):
+    """Clone a repository like the git checkout cache did before it used bare repositories."""
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(os.devnull, "wb") as devnull:
+        repo = porcelain.clone(url, path, checkout=True, errstream=devnull)
+    repo.refs.set_symbolic_ref(b"refs/remotes/origin/HEAD", b"refs/remotes/origin/master")
+    return repo
+
+
+def test_migrate_to_bare_repo(tmp_path):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=6, tags=2, branches=2, files=3, file_size=16)
+    path = str(tmp_path / "cache")
+    old = _create_old_cache_entry(repo["path"], path)
+    assert b"refs/remotes/origin/branch_0" in old.refs.allkeys()
+
+    assert migrate_to_bare_repo(path) is True
+    assert not os.path.exists(os.path.join(path, ".git"))
+    assert not os.path.exists(os.path.join(path, "index"))
+    for name in repo["files"]:
+        assert not os.path.exists(os.path.join(path, name))
+
+    migrated = Repo(path)
+    assert migrated.bare
+    assert b"fetch" not in migrated.get_config()[(b"remote", b"origin")]
+    refs = migrated.refs.as_dict()
+    assert not [ref for ref in refs.keys() if ref.startswith(b"refs/remotes/")]
+    source_refs = Repo(repo["path"]).refs.as_dict()
+    for ref in [b"refs/heads/master", b"refs/heads/branch_0", b"refs/heads/branch_1", b"refs/tags/v0.0.0", b"refs/tags/v0.0.1"]:
+        assert refs[ref] == source_refs[ref]
+
+    # already migrated
+    assert migrate_to_bare_repo(path) is False
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend_name", BACKENDS)
+async def test_old_cache_entry_is_migrated(tmp_path, backend_name, git_cache):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=6, tags=2, branches=2, files=3, file_size=16)
+    path = get_git_cache_path(repo["path"])
+    _create_old_cache_entry(repo["path"], path)
+    backend = get_git_backend(backend_name)
+
+    # repositories cloned before strategies were introduced have the full history, no need to re-clone
+    assert await backend.ensure_repo_cloned(repo["path"], strategy="full") == path
+    assert get_clone_strategy(path) == ("full", None)
+    assert not os.path.exists(os.path.join(path, ".git"))
+
+    tags, branches = await backend.list_refs(path)
+    assert sorted(tags.keys()) == sorted(repo["tags"])
+    assert sorted(branches.keys()) == ["branch_0", "branch_1", "master"]
+
+    # fetching mirrors into 'refs/heads/', not into 'refs/remotes/'
+    await backend.ensure_repo_cloned(repo["path"], update=True, strategy="full")
+    assert not [ref for ref in Repo(path).refs.allkeys() if ref.startswith(b"refs/remotes/")]
+
+    target = str(tmp_path / "export")
+    await backend.export_tree(path, target, version="branch_1")
+    assert sorted(os.listdir(target)) == sorted([".git"] + repo["files"])
+
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("shared_cache", [False, True])
+async def test_concurrent_migration(tmp_path, git_cache, settings, shared_cache):
+
+    settings("shared_cache", shared_cache)
+    repo = create_git_repo(str(tmp_path / "source"), commits=6, tags=2, branches=2, files=3, file_size=16)
+    path = get_git_cache_path(repo["path"])
+    _create_old_cache_entry(repo["path"], path)
+
+    results = []
+
+    async def ensure(backend_name):
+        results.append(await get_git_backend(backend_name).ensure_repo_cloned(repo["path"], strategy="full"))
+
+    async with create_task_group() as tg:
+        for i in range(4):
+            await tg.spawn(ensure, BACKENDS[i % len(BACKENDS)])
+
+    assert results == [path] * 4
+    assert not os.path.exists(os.path.join(path, ".git"))
+    assert get_clone_strategy(path) == ("full", None)
+    tags, branches = await get_git_backend("dulwich").list_refs(path)
+    assert sorted(branches.keys()) == ["branch_0", "branch_1", "master"]
+    assert not [name for name in os.listdir(git_cache) if name.startswith(".tmp_")]
+
+def _list_files(path):
+
+    result = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in files:
+            result.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(result)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend_name", BACKENDS)
+async def test_export_content_paths(tmp_path, backend_name, git_cache):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=0, files=20, file_size=64)
+    backend = get_git_backend(backend_name)
+    path = await backend.ensure_repo_cloned(repo["path"], strategy="full")
+
+    # an older version, so the content differs from the working tree of the source repository
+    version = repo["tags"][0]
+    full = str(tmp_path / "full")
+    await backend.export_tree(path, full, version=version)
+    assert os.path.isdir(os.path.join(full, ".git"))
+    assert _list_files(full) == sorted(repo["files"])
+
+    single_file = repo["files"][2]
+    sparse = str(tmp_path / "sparse")
+    await backend.export_tree(path, sparse, version=version, paths=["dir_1", single_file, "/dir_3/", "does_not_exist"])
+
+    expected = sorted(f for f in repo["files"] if f.startswith(("dir_1/", "dir_3/")) or f == single_file)
+    assert _list_files(sparse) == expected
+    assert not os.path.exists(os.path.join(sparse, ".git"))
+    for name in expected:
+        with open(os.path.join(sparse, name), "rb") as f, open(os.path.join(full, name), "rb") as f_full:
+            assert f.read() == f_full.read()
+
+    empty = str(tmp_path / "empty")
+    await backend.export_tree(path, empty, version=version, paths=["does_not_exist"])
+    assert os.listdir(empty) == []
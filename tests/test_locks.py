@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+
+import anyio
+import pytest
+
+from bring.config.settings import reset_settings, set_setting
+from bring.utils.filesystem import RETIRED_PREFIX, publish_path, purge_retired, retire_path
+from bring.utils.locks import FileLease
+
+
+def test_lease_excludes_other_nodes(tmp_path):
+
+    lock_file = str(tmp_path / "cache" / "entry.lock")
+    node_1 = FileLease(lock_file, lease_seconds=60, node_id="node_1")
+    node_2 = FileLease(lock_file, lease_seconds=60, node_id="node_2")
+
+    assert node_1.try_acquire()
+    try:
+        assert not node_2.try_acquire()
+        assert node_2.read_lease()["node"] == "node_1"
+    finally:
+        node_1.release()
+
+    assert not os.path.exists(lock_file)
+    assert node_2.try_acquire()
+    node_2.release()
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+
+    lock_file = str(tmp_path / "entry.lock")
+    # a node that dies while holding the lock never renews its lease
+    dead_node = FileLease(lock_file, lease_seconds=0.2, node_id="node_1", auto_renew=False)
+    node_2 = FileLease(lock_file, lease_seconds=60, node_id="node_2")
+
+    assert dead_node.try_acquire()
+    assert not node_2.try_acquire()
+
+    time.sleep(0.3)
+    assert node_2.try_acquire()
+    assert node_2.read_lease()["node"] == "node_2"
+
+    # the dead node must not remove a lock it doesn't hold anymore
+    assert not dead_node.renew()
+    dead_node.release()
+    assert os.path.exists(lock_file)
+    node_2.release()
+
+
+def test_renewal_races_takeover(tmp_path):
+
+    lock_file = str(tmp_path / "entry.lock")
+
+    for i in range(30):
+        holder = FileLease(lock_file, lease_seconds=0.05, node_id="node_1", auto_renew=False)
+        other = FileLease(lock_file, lease_seconds=60, node_id="node_2", auto_renew=False)
+        assert holder.try_acquire()
+        time.sleep(0.06)
+
+        # the holder renews its (just expired) lease at the same time as another process takes it over
+        start = threading.Barrier(2)
+        results = {}
+
+        def renew():
+            start.wait()
+            results["renewed"] = holder.renew()
+
+        def take_over():
+            start.wait()
+            results["acquired"] = other.try_acquire()
+
+        threads = [threading.Thread(target=renew), threading.Thread(target=take_over)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results["renewed"] != results["acquired"]
+        winner = holder if results["renewed"] else other
+        assert winner.read_lease()["token"] == winner._token
+
+        winner.release()
+        assert not os.path.exists(lock_file)
+        holder._token = None
+        other._token = None
+
+
+@pytest.mark.anyio
+async def test_renewed_lease_does_not_expire(tmp_path):
+
+    lock_file = str(tmp_path / "entry.lock")
+
+    async with FileLease(lock_file, lease_seconds=0.3, node_id="node_1"):
+        time.sleep(0.6)
+        with pytest.raises(Exception, match="Timed out"):
+            await FileLease(lock_file, lease_seconds=0.3, node_id="node_2").acquire(timeout=0.2, poll_interval=0.05)
+
+    assert not os.path.exists(lock_file)
+
+
+
+@pytest.mark.anyio
+async def test_release_does_not_block_the_event_loop(tmp_path):
+
+    lock_file = str(tmp_path / "entry.lock")
+    lease = FileLease(lock_file, lease_seconds=60, node_id="node_1")
+    await lease.acquire()
+
+    # another process is renewing or taking over a lease, release waits for it (for up to a second)
+    with open(f"{lock_file}.break", "w"):
+        pass
+
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(time.time())
+            await anyio.sleep(0.01)
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(tick)
+        await lease.__aexit__(None, None, None)
+        await tg.cancel_scope.cancel()
+
+    assert len(ticks) > 20
+    assert not lease.is_held
+
+
+@pytest.mark.anyio
+async def test_lock_is_released_on_cancellation(tmp_path):
+
+    lock_file = str(tmp_path / "entry.lock")
+
+    async def hold():
+        async with FileLease(lock_file, lease_seconds=60, node_id="node_1"):
+            await anyio.sleep(10)
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(hold)
+        while not os.path.exists(lock_file):
+            await anyio.sleep(0.01)
+        await tg.cancel_scope.cancel()
+
+    assert not os.path.exists(lock_file)
+
+def test_publish_and_retire(tmp_path):
+
+    target = str(tmp_path / "cache" / "entry")
+    for i in range(2):
+        source = tmp_path / f"result_{i}"
+        source.mkdir()
+        (source / "file").write_text(str(i))
+        assert publish_path(str(source), target) == (i == 0)
+        assert not source.exists()
+
+    with open(os.path.join(target, "file")) as f:
+        assert f.read() == "0"
+
+    set_setting("shared_cache", True)
+    try:
+        retire_path(target)
+        assert not os.path.exists(target)
+        retired = [n for n in os.listdir(str(tmp_path / "cache")) if n.startswith(RETIRED_PREFIX)]
+        assert len(retired) == 1
+
+        assert purge_retired(str(tmp_path / "cache")) == 0
+        assert purge_retired(str(tmp_path / "cache"), grace_seconds=-1) == 1
+        assert os.listdir(str(tmp_path / "cache")) == []
+    finally:
+        reset_settings()
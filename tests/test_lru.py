@@ -0,0 +1,27 @@
+from bring.utils.lru import SizeLimitedLRU
+
+
+def test_lru_evicts_by_size():
+
+    lru = SizeLimitedLRU(max_size=100)
+    assert lru.put("a", 1, 40)
+    assert lru.put("b", 2, 40)
+    assert lru.get("a") == 1
+
+    # 'b' is the least recently used entry
+    assert lru.put("c", 3, 40)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c"), lru.size) == (1, 3, 80)
+
+    assert not lru.put("d", 4, 101)
+    assert lru.get("d") is None
+
+    lru.put("a", 5, 10)
+    assert (lru.get("a"), lru.size) == (5, 50)
+
+
+def test_lru_disabled():
+
+    lru = SizeLimitedLRU(max_size=lambda: 0)
+    assert not lru.put("a", 1, 1)
+    assert len(lru) == 0
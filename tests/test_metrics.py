@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+
+from bring.utils.metrics import MetricsRegistry
+
+
+def test_metrics_persisted_across_registries(tmp_path):
+
+    metrics_file = os.path.join(tmp_path, "metrics.json")
+
+    registry = MetricsRegistry(metrics_file=metrics_file)
+    counter = registry.counter("test_hits_total", "Test hits.")
+    counter.inc()
+    counter.inc(2, source_type="git_repo")
+    hist = registry.histogram("test_bytes", "Test bytes.", buckets=[10, 100])
+    hist.observe(5)
+    hist.observe(50)
+    registry.flush()
+
+    registry_2 = MetricsRegistry(metrics_file=metrics_file)
+    counter_2 = registry_2.counter("test_hits_total", "Test hits.")
+    counter_2.inc()
+    registry_2.flush()
+
+    assert counter_2.get() == 2
+    assert counter_2.get(source_type="git_repo") == 2
+    assert counter_2.total() == 4
+
+    hist_2 = registry_2.histogram("test_bytes", "Test bytes.", buckets=[10, 100])
+    assert hist_2.mean() == 27.5
+
+
+def test_metrics_prometheus_export(tmp_path):
+
+    registry = MetricsRegistry(metrics_file=None)
+    registry.counter("test_hits_total", "Test hits.").inc(3, source_type="git_repo")
+    hist = registry.histogram("test_bytes", "Test bytes.", buckets=[10, 100])
+    hist.observe(5)
+    hist.observe(500)
+
+    export = registry.to_prometheus()
+
+    assert "# TYPE test_hits_total counter" in export
+    assert 'test_hits_total{source_type="git_repo"} 3' in export
+    assert 'test_bytes_bucket{le="10"} 1' in export
+    assert 'test_bytes_bucket{le="100"} 1' in export
+    assert 'test_bytes_bucket{le="+Inf"} 2' in export
+    assert "test_bytes_count 2" in export
+
+
+def _flush_in_process(metrics_file, count):
+
+    registry = MetricsRegistry(metrics_file=metrics_file)
+    counter = registry.counter("test_hits_total", "Test hits.")
+    for _ in range(count):
+        counter.inc()
+        registry.flush()
+
+
+def test_metrics_concurrent_flushes(tmp_path):
+
+    metrics_file = os.path.join(tmp_path, "metrics.json")
+
+    processes = [multiprocessing.Process(target=_flush_in_process, args=(metrics_file, 50)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    registry = MetricsRegistry(metrics_file=metrics_file)
+    assert registry.counter("test_hits_total", "Test hits.").get() == 200
+
+
+def test_metrics_file_read_lazily(tmp_path):
+
+    metrics_file = os.path.join(tmp_path, "metrics.json")
+
+    registry = MetricsRegistry(metrics_file=metrics_file)
+    counter = registry.counter("test_hits_total", "Test hits.")
+
+    # values flushed by another process after registration are not lost
+    _flush_in_process(metrics_file, 3)
+    assert counter.get() == 3
@@ -0,0 +1,54 @@
+import json
+import os
+
+import pytest
+
+from bring.pkg.archive import get_install_path, pack_package, read_archive_manifest, unpack_package
+from bring.pkg.manifest import create_manifest, get_manifest_path, read_manifest
+
+
+def _create_package(path):
+
+    os.makedirs(os.path.join(path, "bin"))
+    os.makedirs(os.path.join(path, "empty"))
+    with open(os.path.join(path, "bin", "tool"), "w") as f:
+        f.write("#!/bin/sh\necho tool\n")
+    os.chmod(os.path.join(path, "bin", "tool"), 0o755)
+    os.symlink("bin/tool", os.path.join(path, "tool"))
+    return path
+
+
+@pytest.mark.anyio
+async def test_pack_and_unpack(tmp_path):
+
+    source = _create_package(str(tmp_path / "package_data"))
+    manifest = create_manifest(source, {"id": "version_1"}, "12345")
+    assert sorted(manifest["files"].keys()) == ["bin/tool"]
+    assert manifest["links"] == {"tool": "bin/tool"}
+
+    archive_file = pack_package(source, manifest, str(tmp_path / "archives" / "pkg.bring.tar.gz"))
+    assert read_archive_manifest(archive_file)["files"] == manifest["files"]
+
+    # import on another node
+    install_folder = str(tmp_path / "node_2" / "packages")
+    path = await unpack_package(archive_file, install_folder=install_folder)
+    assert path == get_install_path(manifest, install_folder=install_folder)
+    assert read_manifest(get_manifest_path(path))["transform_hash"] == "12345"
+    assert os.readlink(os.path.join(path, "tool")) == "bin/tool"
+    assert os.stat(os.path.join(path, "bin", "tool")).st_mode & 0o777 == 0o755
+    assert os.path.isdir(os.path.join(path, "empty"))
+
+
+@pytest.mark.anyio
+async def test_unpack_verifies_files(tmp_path):
+
+    source = _create_package(str(tmp_path / "package_data"))
+    manifest = create_manifest(source, {"id": "version_1"}, "12345")
+    manifest["files"]["bin/tool"]["sha256"] = "0" * 64
+    archive_file = pack_package(source, json.loads(json.dumps(manifest)), str(tmp_path / "pkg.bring.tar.gz"))
+
+    install_folder = str(tmp_path / "node_2" / "packages")
+    with pytest.raises(Exception, match="Checksum mismatch"):
+        await unpack_package(archive_file, install_folder=install_folder)
+
+    assert os.listdir(os.path.join(install_folder, "version_1", "12345")) == []
@@ -0,0 +1,152 @@
+import os
+
+import pytest
+from frkl.common.exceptions import FrklException
+
+from bring.pkg.delta import _Transaction, compute_delta, read_target_state, recover_target, update_target
+from bring.pkg.manifest import create_manifest
+
+
+def _write(path, content, mode=0o644):
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, mode)
+
+
+def _create_versions(tmp_path):
+
+    v1 = str(tmp_path / "v1")
+    _write(os.path.join(v1, "bin", "tool"), "tool 1", 0o755)
+    _write(os.path.join(v1, "share", "data"), "data")
+    _write(os.path.join(v1, "share", "readme"), "readme")
+    _write(os.path.join(v1, "old", "file"), "old")
+    os.symlink("bin/tool", os.path.join(v1, "tool"))
+
+    v2 = str(tmp_path / "v2")
+    _write(os.path.join(v2, "bin", "tool"), "tool 2", 0o755)
+    _write(os.path.join(v2, "share", "data"), "data")
+    _write(os.path.join(v2, "share", "readme"), "readme", 0o600)
+    _write(os.path.join(v2, "new", "file"), "new")
+    os.symlink("share/data", os.path.join(v2, "tool"))
+
+    return (v1, create_manifest(v1, {"id": "v1"}, "12345")), (v2, create_manifest(v2, {"id": "v2"}, "12345"))
+
+
+def test_update_target(tmp_path):
+
+    (v1, m1), (v2, m2) = _create_versions(tmp_path)
+    target = str(tmp_path / "target")
+
+    delta = update_target(v1, m1, target, "pkg")
+    assert sorted(delta["files_added"].keys()) == ["bin/tool", "old/file", "share/data", "share/readme"]
+    data_inode = os.stat(os.path.join(target, "share", "data")).st_ino
+
+    delta = compute_delta(m1, m2)
+    assert list(delta["files_changed"].keys()) == ["bin/tool"]
+    assert list(delta["files_removed"].keys()) == ["old/file"]
+    assert list(delta["modes_changed"].keys()) == ["share/readme"]
+    assert delta["links_changed"] == {"tool": "share/data"}
+    assert delta["unchanged"] == 1
+
+    assert update_target(v2, m2, target, "pkg") == delta
+    with open(os.path.join(target, "bin", "tool")) as f:
+        assert f.read() == "tool 2"
+    assert not os.path.exists(os.path.join(target, "old"))
+    assert os.path.isfile(os.path.join(target, "new", "file"))
+    assert os.stat(os.path.join(target, "share", "readme")).st_mode & 0o777 == 0o600
+    assert os.readlink(os.path.join(target, "tool")) == "share/data"
+    assert os.stat(os.path.join(target, "share", "data")).st_ino == data_inode
+    assert read_target_state(target, "pkg")["version_id"] == m2["version_id"]
+    assert sorted(x for x in os.listdir(target) if x.startswith(".")) == [".bring"]
+
+
+def test_update_target_conflict(tmp_path):
+
+    (v1, m1), (v2, m2) = _create_versions(tmp_path)
+    target = str(tmp_path / "target")
+    update_target(v1, m1, target, "pkg")
+
+    _write(os.path.join(target, "bin", "tool"), "changed locally", 0o755)
+    with pytest.raises(FrklException):
+        update_target(v2, m2, target, "pkg")
+    assert os.path.isfile(os.path.join(target, "old", "file"))
+    assert read_target_state(target, "pkg")["version_id"] == m1["version_id"]
+
+    update_target(v2, m2, target, "pkg", force=True)
+    with open(os.path.join(target, "bin", "tool")) as f:
+        assert f.read() == "tool 2"
+
+
+def test_update_target_rollback(tmp_path):
+
+    (v1, m1), (v2, m2) = _create_versions(tmp_path)
+    target = str(tmp_path / "target")
+    update_target(v1, m1, target, "pkg")
+
+    # the new version is corrupted in the install cache
+    _write(os.path.join(v2, "new", "file"), "corrupted")
+    with pytest.raises(FrklException):
+        update_target(v2, m2, target, "pkg")
+
+    with open(os.path.join(target, "bin", "tool")) as f:
+        assert f.read() == "tool 1"
+    assert os.path.isfile(os.path.join(target, "old", "file"))
+    assert not os.path.exists(os.path.join(target, "new"))
+    assert os.readlink(os.path.join(target, "tool")) == "bin/tool"
+    assert read_target_state(target, "pkg")["version_id"] == m1["version_id"]
+    assert sorted(x for x in os.listdir(target) if x.startswith(".")) == [".bring"]
+
+
+def test_replaced_folder_keeps_other_files(tmp_path):
+
+    v1 = str(tmp_path / "v1")
+    _write(os.path.join(v1, "bin", "tool"), "tool")
+    v2 = str(tmp_path / "v2")
+    _write(os.path.join(v2, "bin"), "tool")
+    m1 = create_manifest(v1, {"id": "v1"}, "12345")
+    m2 = create_manifest(v2, {"id": "v2"}, "12345")
+
+    target = str(tmp_path / "target")
+    update_target(v1, m1, target, "pkg")
+    _write(os.path.join(target, "bin", "MY_NOTES.txt"), "notes")
+
+    with pytest.raises(FrklException, match="MY_NOTES"):
+        update_target(v2, m2, target, "pkg")
+    with pytest.raises(FrklException):
+        update_target(v2, m2, target, "pkg", force=True)
+
+    assert os.path.isfile(os.path.join(target, "bin", "MY_NOTES.txt"))
+    assert os.path.isfile(os.path.join(target, "bin", "tool"))
+    assert read_target_state(target, "pkg")["version_id"] == m1["version_id"]
+
+
+def test_unfinished_update_is_rolled_back(tmp_path, monkeypatch):
+
+    (v1, m1), (v2, m2) = _create_versions(tmp_path)
+    target = str(tmp_path / "target")
+    update_target(v1, m1, target, "pkg")
+
+    # the process dies after some changes were made (no rollback, no cleanup)
+    def die(*args):
+        raise KeyboardInterrupt()
+
+    with monkeypatch.context() as m:
+        m.setattr(_Transaction, "chmod", die)
+        m.setattr(_Transaction, "rollback", lambda self: None)
+        m.setattr(_Transaction, "cleanup", lambda self: None)
+        with pytest.raises(KeyboardInterrupt):
+            update_target(v2, m2, target, "pkg")
+    assert not os.path.exists(os.path.join(target, "old"))
+
+    assert recover_target(target) == 1
+    with open(os.path.join(target, "bin", "tool")) as f:
+        assert f.read() == "tool 1"
+    assert os.path.isfile(os.path.join(target, "old", "file"))
+    assert not os.path.exists(os.path.join(target, "new"))
+    assert os.readlink(os.path.join(target, "tool")) == "bin/tool"
+    assert sorted(x for x in os.listdir(target) if x.startswith(".")) == [".bring"]
+
+    update_target(v2, m2, target, "pkg")
+    assert read_target_state(target, "pkg")["version_id"] == m2["version_id"]
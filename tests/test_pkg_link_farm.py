@@ -0,0 +1,77 @@
+import os
+
+import pytest
+from frkl.common.exceptions import FrklException
+
+from bring.pkg.delta import read_target_state
+from bring.pkg.link_farm import get_link_farms_folder, get_target_farm, install_to_target
+from bring.pkg.manifest import create_manifest
+
+
+def _create_version(path, content):
+
+    os.makedirs(os.path.join(path, "bin"))
+    os.makedirs(os.path.join(path, "empty"))
+    with open(os.path.join(path, "bin", "tool"), "w") as f:
+        f.write(content)
+    os.chmod(os.path.join(path, "bin", "tool"), 0o755)
+    os.symlink("bin/tool", os.path.join(path, "tool"))
+    return path, create_manifest(path, {"id": content}, "12345")
+
+
+def _read(path):
+
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("link_mode", ["auto", "symlink", "hardlink", "copy"])
+def test_install_to_target(tmp_path, link_mode):
+
+    v1, m1 = _create_version(str(tmp_path / "v1"), "tool_1")
+    target = str(tmp_path / "target" / "pkg")
+
+    farm_path = install_to_target(v1, m1, target, "pkg", link_mode=link_mode)
+    assert get_target_farm(target) == farm_path
+    assert _read(os.path.join(target, "tool")) == "tool_1"
+    assert os.stat(os.path.join(target, "bin", "tool")).st_mode & 0o777 == 0o755
+    assert os.path.isdir(os.path.join(target, "empty"))
+    assert read_target_state(target, "pkg")["version_id"] == m1["version_id"]
+
+    tool_path = os.path.join(target, "bin", "tool")
+    if link_mode == "symlink":
+        assert os.readlink(tool_path) == os.path.join(v1, "bin", "tool")
+    elif link_mode == "hardlink":
+        assert os.stat(tool_path).st_ino == os.stat(os.path.join(v1, "bin", "tool")).st_ino
+    elif link_mode == "copy":
+        assert os.stat(tool_path).st_ino != os.stat(os.path.join(v1, "bin", "tool")).st_ino
+
+
+def test_switch_versions(tmp_path):
+
+    v1, m1 = _create_version(str(tmp_path / "v1"), "tool_1")
+    v2, m2 = _create_version(str(tmp_path / "v2"), "tool_2")
+    target = str(tmp_path / "target" / "pkg")
+
+    farm_1 = install_to_target(v1, m1, target, "pkg", link_mode="copy")
+    farm_2 = install_to_target(v2, m2, target, "pkg", link_mode="copy")
+    assert _read(os.path.join(target, "tool")) == "tool_2"
+
+    # switching back only replaces the symbolic link
+    inode = os.stat(os.path.join(farm_1, "bin", "tool")).st_ino
+    assert install_to_target(v1, m1, target, "pkg", link_mode="copy") == farm_1
+    assert _read(os.path.join(target, "tool")) == "tool_1"
+    assert os.stat(os.path.join(target, "bin", "tool")).st_ino == inode
+    assert sorted(os.listdir(get_link_farms_folder(target))) == sorted([os.path.basename(farm_1), os.path.basename(farm_2)])
+
+
+def test_target_must_be_link(tmp_path):
+
+    v1, m1 = _create_version(str(tmp_path / "v1"), "tool_1")
+    target = str(tmp_path / "target" / "pkg")
+    os.makedirs(target)
+
+    with pytest.raises(FrklException):
+        install_to_target(v1, m1, target, "pkg")
+    assert os.listdir(target) == []
+    assert not os.path.exists(get_link_farms_folder(target))
@@ -4,8 +4,22 @@ from datetime import datetime
 import pytest
 from tzlocal import get_localzone
 
-from bring.pkg import ResolvePkg, PkgVersion
+from bring.pkg import ResolvePkg, PkgVersion, warm_pkgs
+from bring.config.settings import set_setting
+from bring.pkg.versions import format_release_date
+from bring.utils.git_external import NativeGitBackend
 from frkl.common.formats.auto import AutoInput
+from tests.benchmarks.fixtures import create_git_repo
+
+
+def _list_files(path):
+
+    result = []
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for name in files:
+            result.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(result)
 
 
 @pytest.mark.anyio
@@ -43,3 +57,132 @@ async def test_pkg_version_match(resource_folder, bring):
 
     matching_version = await pkg.find_matching_version(version="v1.1.0")
     assert isinstance(matching_version, PkgVersion)
+
+
+def _layer_statuses(plan):
+
+    return [(layer["layer"], layer["status"]) for layer in plan["layers"]]
+
+
+@pytest.mark.anyio
+async def test_pkg_plan_install(tmp_path, bring, pkg_caches):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=0, files=6, file_size=64)
+    version = repo["tags"][-1]
+    pkg_data = {"type": "git_repo", "url": repo["path"]}
+
+    pkg: ResolvePkg = ResolvePkg(tingistry=bring.tingistry, pkg=pkg_data, content=[repo["files"][0]])
+
+    plan = await pkg.plan_install(version=version)
+    assert plan["version"] is None
+    assert _layer_statuses(plan) == [("metadata_cache", "miss")]
+    assert plan["needs_install"] is True
+
+    plan = await pkg.plan_install(fetch_metadata=True, version=version)
+    assert plan["version"] == {"version": version}
+    assert plan["install_path"].startswith(pkg_caches)
+    # retrieving the metadata cloned the repository, which contains all tags
+    assert _layer_statuses(plan) == [
+        ("metadata_cache", "miss"),
+        ("git_cache", "hit"),
+        ("version_folder", "miss"),
+        ("install_cache", "miss"),
+    ]
+    assert [step["status"] for step in plan["transform"]] == ["run"]
+    assert plan["needs_install"] is True
+
+    assert await pkg.install(version=version) == plan["install_path"]
+
+    pkg = ResolvePkg(tingistry=bring.tingistry, pkg=pkg_data, content=[repo["files"][0]])
+    plan = await pkg.plan_install(version=version)
+    assert _layer_statuses(plan) == [("metadata_cache", "hit"), ("install_cache", "hit")]
+    assert [step["status"] for step in plan["transform"]] == ["skip"]
+    assert plan["needs_install"] is False
+
+
+@pytest.mark.anyio
+async def test_warm_pkgs_dedupes_sources(resource_folder, bring):
+
+    pkg_file = os.path.join(resource_folder, "example-source-1.pkg.br")
+
+    ai = AutoInput(pkg_file)
+    content = await ai.get_content_async()
+
+    pkgs = {
+        "one": ResolvePkg(tingistry=bring.tingistry, **content),
+        "two": ResolvePkg(tingistry=bring.tingistry, **content),
+    }
+
+    results = await warm_pkgs(pkgs)
+    assert len(results) == 1
+    assert results[0]["success"] is True
+    assert sorted(results[0]["pkgs"]) == ["one", "two"]
+    assert pkgs["one"].version_source.get_metadata_cache_status() != "miss"
+
+
+@pytest.mark.anyio
+async def test_pkg_content_paths(tmp_path, bring, pkg_caches):
+
+    repo = create_git_repo(str(tmp_path / "source"), commits=12, tags=3, branches=0, files=20, file_size=64)
+    single_file = repo["files"][2]
+
+    pkg = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "git_repo", "url": repo["path"]}, content=[single_file, "dir_1"])
+    assert pkg.content_paths == sorted(["dir_1", single_file])
+
+    source = pkg.version_source
+    version = await source.find_matching_version(version=repo["tags"][0])
+
+    sparse = await source.get_version_folder(version, content_paths=pkg.content_paths)
+    assert sparse.startswith(pkg_caches)
+    assert _list_files(sparse) == sorted(f for f in repo["files"] if f.startswith("dir_1/") or f == single_file)
+    assert not os.path.exists(os.path.join(sparse, ".git"))
+
+    # full checkouts never end up in the same folder as partial ones
+    full = await source.get_version_folder(version)
+    assert full != sparse
+    assert _list_files(full) == sorted(repo["files"])
+    assert os.path.isdir(os.path.join(full, ".git"))
+
+    # packages that might read any path of a version folder
+    assert ResolvePkg(tingistry=bring.tingistry, pkg={"type": "git_repo", "url": repo["path"]}).content_paths is None
+
+
+@pytest.mark.parametrize("backend_name", ["dulwich", "native"])
+def test_pkg_clone_requirement(bring, settings, backend_name):
+
+    if backend_name == "native" and not NativeGitBackend.is_available():
+        pytest.skip("no git executable")
+    set_setting("git_backend", backend_name)
+    history = ("blobless", None) if backend_name == "native" else ("full", None)
+
+    def version(ref, ref_type):
+        return PkgVersion(steps=[{"type": "git_clone", "url": "/tmp/repo", "version": ref}], id_vars={"version": ref}, metadata={"ref_type": ref_type})
+
+    commit = "a" * 40
+    source = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "git_repo", "url": "/tmp/repo"}).version_source
+    assert source.get_clone_requirement() == ("shallow", 1)
+    assert source.get_clone_requirement(version("v1.0.0", "tag")) == ("tags", 1)
+    assert source.get_clone_requirement(version(commit, "commit")) == history
+
+    source = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "git_repo", "url": "/tmp/repo", "use_commits_as_versions": True}).version_source
+    assert source.get_clone_requirement() == history
+    # tags and branches don't need the history, even if the package also has commit versions
+    assert source.get_clone_requirement(version("v1.0.0", "tag")) == ("tags", 1)
+    assert source.get_clone_requirement(version("master", "branch")) == ("shallow", 1)
+    assert source.get_clone_requirement(version(commit, "commit")) == history
+
+    source = ResolvePkg(tingistry=bring.tingistry, pkg={"type": "git_repo", "url": "/tmp/repo", "use_commits_as_versions": True, "clone_strategy": "tags"}).version_source
+    assert source.get_clone_requirement() == ("full", None)
+    assert source.get_clone_requirement(version("v1.0.0", "tag")) == ("tags", 1)
+    assert source.get_clone_requirement(version(commit, "commit")) == ("full", None)
+
+
+def test_format_release_date():
+
+    metadata = {"release_time": 1600000000, "release_timezone": 2 * 3600}
+    assert format_release_date(metadata) == "2020-09-13 14:26:40 +0200"
+
+    # metadata cached by older versions
+    assert format_release_date({"release_date": "2020-09-13 14:26:40+02:00"}) == "2020-09-13 14:26:40 +0200"
+
+    assert format_release_date({}) is None
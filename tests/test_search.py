@@ -0,0 +1,54 @@
+from bring.index.search import SearchIndex
+
+
+HELM = {
+    "info": {"slug": "A Kubernetes Package Manager", "homepage": "https://helm.sh"},
+    "tags": ["kubernetes", "helm"],
+    "labels": {"language": "go", "executable_type": "binary"},
+    "pkg": {"type": "template_url", "url": "https://get.helm.sh/helm-v${version}-${os}-${arch}.tar.gz"},
+    "args": {
+        "version": {"allowed": ["3.2.4", "3.2.3"]},
+        "os": {"allowed": ["darwin", "linux"]},
+        "arch": {"allowed": ["amd64", "arm"]},
+    },
+}
+
+BASHTOP = {
+    "info": {"slug": "Linux resource monitor"},
+    "tags": ["system info"],
+    "labels": {"language": "bash", "executable_type": "script"},
+    "pkg": {"type": "git_repo", "url": "https://github.com/aristocratos/bashtop.git"},
+}
+
+
+def test_search_index_queries():
+
+    index = SearchIndex()
+    index.add("binaries.helm", HELM)
+    index.add("bashtop", BASHTOP, versions_vars=[{"version": "v0.9.25"}])
+
+    assert index.search("kubernetes", "executable_type=binary", "os=linux", "arch=arm") == ["binaries.helm"]
+    assert index.search("kube*") == ["binaries.helm"]
+    assert index.search("linux") == ["bashtop", "binaries.helm"]
+    assert index.search("language=ba*") == ["bashtop"]
+    assert index.search("version=v0.9.25") == ["bashtop"]
+    assert index.search("tag=system info") == ["bashtop"]
+    assert index.search("kubernetes", "executable_type=script") == []
+
+
+def test_search_index_persistence(tmp_path):
+
+    index_file = str(tmp_path / "search.pickle")
+
+    index = SearchIndex(index_file=index_file)
+    index.add("binaries.helm", HELM)
+    index.add("bashtop", BASHTOP)
+    index.save()
+
+    index = SearchIndex(index_file=index_file)
+    assert index.search("helm") == ["binaries.helm"]
+
+    index.remove("binaries.helm")
+    assert index.search("helm") == []
+    assert index.search("go") == []
+    assert index.search("monitor") == ["bashtop"]
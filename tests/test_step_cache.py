@@ -0,0 +1,72 @@
+import json
+import os
+import time
+
+from bring.transform.step_cache import StepCache, calculate_base_key, calculate_step_keys
+
+
+def _create_result(path, size=100):
+
+    os.makedirs(path)
+    with open(os.path.join(path, "file"), "wb") as f:
+        f.write(b"x" * size)
+    return path
+
+
+def test_step_keys_share_prefix():
+
+    base_key = calculate_base_key("version_1", content_paths=["b", "a"])
+    assert base_key == calculate_base_key("version_1", content_paths=["a", "b"])
+
+    steps_1 = [{"type": "folder_content", "content_spec": ["a"]}, {"type": "folder_content", "content_spec": ["b"]}]
+    steps_2 = [{"type": "folder_content", "content_spec": ["a"]}, {"type": "folder_content", "content_spec": ["c"]}]
+
+    keys_1 = calculate_step_keys(base_key, steps_1)
+    keys_2 = calculate_step_keys(base_key, steps_2)
+    assert keys_1[0] == keys_2[0]
+    assert keys_1[1] != keys_2[1]
+
+    assert calculate_step_keys(calculate_base_key("version_2"), steps_1)[0] != keys_1[0]
+
+
+def test_step_cache_longest_prefix(tmp_path):
+
+    cache = StepCache(base_path=str(tmp_path / "cache"), max_size=1024 * 1024, max_age=0)
+    keys = calculate_step_keys(calculate_base_key("version_1"), [{"type": "a"}, {"type": "b"}, {"type": "c"}])
+
+    assert cache.find_longest_prefix(keys) == (0, None)
+
+    cached = cache.add(keys[1], _create_result(str(tmp_path / "result")), {"type": "b"})
+    assert os.path.isfile(os.path.join(cached, "file"))
+    assert not os.path.exists(str(tmp_path / "result"))
+
+    assert cache.find_longest_prefix(keys) == (2, cached)
+
+
+def test_step_cache_eviction(tmp_path):
+
+    cache = StepCache(base_path=str(tmp_path / "cache"), max_size=250, max_age=0)
+
+    for i in range(3):
+        cache.add(f"key_{i}", _create_result(str(tmp_path / f"result_{i}")), {"type": "a"})
+        os.utime(os.path.join(cache.base_path, f"key_{i}"), (time.time() - 100 + i, time.time() - 100 + i))
+        if i == 1:
+            # use the oldest entry, so the second one is the least recently used
+            assert cache.get("key_0") is not None
+
+    assert cache.get("key_1") is None
+    assert cache.get("key_0") is not None
+    assert cache.get("key_2") is not None
+
+    expiring = StepCache(base_path=cache.base_path, max_size=250, max_age=1)
+    assert expiring.prune() == 0
+    metadata_file = os.path.join(cache.base_path, "key_0", "step.json")
+    with open(metadata_file) as f:
+        metadata = json.load(f)
+    metadata["created"] = time.time() - 10
+    with open(metadata_file, "w") as f:
+        json.dump(metadata, f)
+
+    assert expiring.get("key_0") is None
+    assert expiring.get("key_2") is not None
+    assert cache.get("key_0") is None
@@ -0,0 +1,50 @@
+import pytest
+
+from bring.utils.version_index import VersionIndex, is_range_constraint, parse_version
+
+
+TAGS = ["v1.9.0", "v1.10.0", "v1.10.1-rc1", "v2.0.0-beta.2", "v2.0.0-rc.1", "2.15.3", "2.16.0", "2.16.4", "2.17.0", "0.2.3", "0.2.9", "0.3.0", "master", "3.1.0", "3.1.2", "3.1.3", "3.2.0-rc1"]
+
+
+def test_version_ordering():
+
+    index = VersionIndex(TAGS)
+    versions = index.versions
+
+    assert "master" not in versions
+    assert versions.index("v1.9.0") < versions.index("v1.10.0") < versions.index("v1.10.1-rc1")
+    assert versions.index("v2.0.0-beta.2") < versions.index("v2.0.0-rc.1")
+    assert parse_version("1.0rc1").key < parse_version("1.0").key < parse_version("1.0.post1").key
+    assert parse_version("1.0.dev1").key < parse_version("1.0a1").key
+    assert parse_version("v1.2").key == parse_version("1.2.0").key
+
+    assert index.latest == "3.2.0-rc1"
+    assert index.latest_stable == "3.1.3"
+
+
+@pytest.mark.parametrize(
+    "constraint, expected",
+    [
+        (">=3.1,<3.2", "3.1.3"),
+        ("~2.16", "2.16.4"),
+        ("~=2.16", "2.17.0"),
+        ("^0.2.3", "0.2.9"),
+        ("3.1.*", "3.1.3"),
+        ("3.1.*,!=3.1.3", "3.1.2"),
+        (">3.1.3", "3.2.0-rc1"),
+        ("^2", "2.17.0"),
+        (">=4", None),
+    ],
+)
+def test_resolve_range(constraint, expected):
+
+    assert VersionIndex(TAGS).resolve(constraint) == expected
+
+
+def test_is_range_constraint():
+
+    assert is_range_constraint(">=1.0")
+    assert is_range_constraint("^1.2")
+    assert is_range_constraint("1.2.*")
+    assert not is_range_constraint("v1.2.3")
+    assert not is_range_constraint("latest")
@@ -0,0 +1,79 @@
+import itertools
+from datetime import datetime
+
+import pytest
+
+from bring.pkg.versions import PkgVersion, VersionSource
+from bring.utils.version_resolver import VersionResolver
+
+
+def _create_matrix():
+
+    versions = []
+    for version, os_name, arch in itertools.product(["3.2.4", "3.2.3", "3.1.0"], ["linux", "darwin"], ["amd64", "arm64"]):
+        if os_name == "darwin" and arch == "arm64" and version != "3.2.4":
+            continue
+        versions.append(PkgVersion(steps=[], id_vars={"version": version, "os": os_name, "arch": arch}, metadata_timestamp=datetime.now()))
+    return versions
+
+
+def test_resolve_with_defaults():
+
+    resolver = VersionResolver(_create_matrix(), defaults={"version": "3.2.4", "os": "linux", "arch": "amd64"})
+
+    candidates = resolver.find_candidates({"os": "darwin"})
+    assert candidates[0].version.id_vars == {"version": "3.2.4", "os": "darwin", "arch": "amd64"}
+    assert (candidates[0].score, candidates[0].default_score) == (1, 2)
+    assert resolver.get_ambiguous_vars(candidates) == []
+
+    # the 'version' default doesn't fit, the other defaults still apply
+    candidates = resolver.find_candidates({"version": "3.1.0", "install_path": "/tmp"})
+    assert [c.version.id_vars for c in candidates] == [{"version": "3.1.0", "os": "linux", "arch": "amd64"}]
+
+    # input values are never dropped
+    candidates = resolver.find_candidates({"version": "3.2.3", "os": "darwin", "arch": "arm64"})
+    assert candidates == []
+
+
+def test_resolve_partial_input():
+
+    resolver = VersionResolver(_create_matrix())
+
+    candidates = resolver.find_candidates({"version": "3.2.4", "os": "darwin"})
+    assert len(candidates) == 2
+    assert resolver.get_ambiguous_vars(candidates) == ["arch"]
+
+
+def test_explain():
+
+    resolver = VersionResolver(_create_matrix())
+
+    assert resolver.explain({"version": "3.2.4"}) is None
+    assert resolver.explain({"version": "3.1.0", "os": "darwin", "arch": "arm64"}) == "No version has arch='arm64' (with version='3.1.0', os='darwin'), available values: amd64"
+    assert resolver.explain({"version": "4.0"}) == "No version has version='4.0', available values: 3.2.4, 3.2.3, 3.1.0"
+
+
+class StaticSource(VersionSource):
+
+    def get_pkg_args(self):
+
+        return {}
+
+    def _get_unique_source_type_id(self):
+
+        return "static"
+
+    async def _retrieve_pkg_versions(self, **source_input):
+
+        return [PkgVersion(steps=[], id_vars={"version": v}, metadata_timestamp=datetime.now()) for v in ["v3.1.0", "v3.0.0", "3.x", "master"]]
+
+
+@pytest.mark.anyio
+async def test_range_like_values_that_exist(bring, tmp_path):
+
+    source = StaticSource(tingistry=bring.tingistry)
+    source._cache_dir = str(tmp_path)
+
+    # a branch called '3.x' is not a range
+    assert (await source.find_matching_version(version="3.x")).id_vars == {"version": "3.x"}
+    assert (await source.find_matching_version(version="3.0.x")).id_vars == {"version": "v3.0.0"}
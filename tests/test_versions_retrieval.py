@@ -0,0 +1,124 @@
+import os
+import pickle
+import time
+from datetime import datetime
+
+import anyio
+import pytest
+
+from bring.pkg.versions import PkgVersion, VersionSource
+from bring.utils.locks import LOCK_FILE_EXTENSION, FileLease
+from bring.utils.metrics import VERSIONS_CACHE_MISSES, VERSIONS_RETRIEVALS_COALESCED
+
+
+class CountingSource(VersionSource):
+
+    retrievals = 0
+
+    def get_pkg_args(self):
+
+        return {}
+
+    def _get_unique_source_type_id(self):
+
+        return "counting"
+
+    async def _retrieve_pkg_versions(self, **source_input):
+
+        CountingSource.retrievals = CountingSource.retrievals + 1
+        await anyio.sleep(0.2)
+        return [PkgVersion(steps=[], id_vars={"version": "1.0"}, metadata_timestamp=datetime.now())]
+
+
+def _create_sources(bring, tmp_path, count):
+
+    sources = []
+    for _ in range(count):
+        source = CountingSource(tingistry=bring.tingistry)
+        source._cache_dir = str(tmp_path)
+        sources.append(source)
+    return sources
+
+
+@pytest.mark.anyio
+async def test_concurrent_retrievals_are_coalesced(bring, tmp_path):
+
+    CountingSource.retrievals = 0
+    sources = _create_sources(bring, tmp_path, 5)
+    misses = VERSIONS_CACHE_MISSES.get(source_type="counting_source")
+    coalesced = VERSIONS_RETRIEVALS_COALESCED.get(source_type="counting_source")
+
+    async with anyio.create_task_group() as tg:
+        for source in sources:
+            await tg.spawn(source.get_versions)
+
+    assert CountingSource.retrievals == 1
+    assert VERSIONS_CACHE_MISSES.get(source_type="counting_source") == misses + 1
+    assert VERSIONS_RETRIEVALS_COALESCED.get(source_type="counting_source") == coalesced + 4
+    for source in sources:
+        assert [v.id_vars for v in await source.get_versions()] == [{"version": "1.0"}]
+
+
+@pytest.mark.anyio
+async def test_cancelled_retrieval_is_retried(bring, tmp_path):
+
+    CountingSource.retrievals = 0
+    source, other = _create_sources(bring, tmp_path, 2)
+
+    async def cancelled():
+        async with anyio.move_on_after(0.05):
+            await source.get_versions()
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(cancelled)
+        await anyio.sleep(0.01)
+        versions = await other.get_versions()
+
+    assert CountingSource.retrievals == 2
+    assert [v.id_vars for v in versions] == [{"version": "1.0"}]
+
+
+@pytest.mark.anyio
+async def test_retrieval_waits_for_other_process(bring, tmp_path):
+
+    CountingSource.retrievals = 0
+    source, other = _create_sources(bring, tmp_path, 2)
+
+    # another process is retrieving the same versions
+    lock = FileLease(f"{source._get_cache_path()}{LOCK_FILE_EXTENSION}", node_id="other_node")
+    assert lock.try_acquire()
+
+    async def other_process():
+        await anyio.sleep(0.3)
+        await other.write_versions_cache([PkgVersion(steps=[], id_vars={"version": "2.0"}, metadata_timestamp=datetime.now())], {})
+        lock.release()
+
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(other_process)
+        versions = await source.get_versions()
+
+    assert CountingSource.retrievals == 0
+    assert [v.id_vars for v in versions] == [{"version": "2.0"}]
+
+
+@pytest.mark.anyio
+async def test_loaded_versions_are_shared(bring, tmp_path):
+
+    CountingSource.retrievals = 0
+    source, other = _create_sources(bring, tmp_path, 2)
+
+    versions = await source.get_versions()
+    source.get_version_index(versions)
+
+    other_versions = await other.get_versions()
+    assert CountingSource.retrievals == 1
+    assert other_versions is versions
+    assert other._version_indexes is source._version_indexes
+
+    # a cache file that was changed by another process is read again
+    cache_path = source._get_cache_path()
+    with open(cache_path, "wb") as f:
+        pickle.dump(([PkgVersion(steps=[], id_vars={"version": "2.0"}, metadata_timestamp=datetime.now())], {}), f)
+    os.utime(cache_path, ns=(time.time_ns(), time.time_ns() + 1000))
+    third = _create_sources(bring, tmp_path, 1)[0]
+    assert [v.id_vars for v in await third.get_versions()] == [{"version": "2.0"}]